@@ -17,6 +17,7 @@ from app.repos.user import User
 from app.schemas.user import TokenData
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
 
 def hash_password(password: str) -> str:
@@ -125,6 +126,23 @@ async def get_current_user(
     return user
 
 
+async def get_optional_user_id(
+    token: str | None = Depends(optional_oauth2_scheme),
+) -> int | None:
+    """User id of the bearer token if one is sent, None for anonymous requests."""
+    if token is None:
+        return None
+
+    try:
+        return decode_access_token(token).user_id
+    except InvalidTokenError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
 async def authenticate_user(session: AsyncSession, email: str, password: str) -> User:
     """Authenticate a user by email and password."""
     try:
@@ -16,6 +16,155 @@ class Settings:
     GOOGLE_CLIENT_SECRET: str = os.getenv("GOOGLE_CLIENT_SECRET", "")
 
     MAX_CONCURRENT_EXECUTIONS: int = int(os.getenv("MAX_CONCURRENT_EXECUTIONS", "3"))
+    # With adaptive concurrency MAX_CONCURRENT_EXECUTIONS is the starting limit,
+    # moved within these bounds by the observed load of the Docker host
+    CODE_RUNNER_ADAPTIVE_CONCURRENCY: bool = (
+        os.getenv("CODE_RUNNER_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+    )
+    CODE_RUNNER_CONCURRENCY_MIN: int = int(
+        os.getenv("CODE_RUNNER_CONCURRENCY_MIN", "1")
+    )
+    CODE_RUNNER_CONCURRENCY_MAX: int = int(
+        os.getenv("CODE_RUNNER_CONCURRENCY_MAX", "8")
+    )
+    CODE_RUNNER_CONCURRENCY_INTERVAL: float = float(
+        os.getenv("CODE_RUNNER_CONCURRENCY_INTERVAL", "5")
+    )
+    CODE_RUNNER_TARGET_START_LATENCY: float = float(
+        os.getenv("CODE_RUNNER_TARGET_START_LATENCY", "2")
+    )
+    CODE_RUNNER_TARGET_LOAD_PER_CPU: float = float(
+        os.getenv("CODE_RUNNER_TARGET_LOAD_PER_CPU", "1")
+    )
+    CODE_RUNNER_TARGET_TIMEOUT_RATE: float = float(
+        os.getenv("CODE_RUNNER_TARGET_TIMEOUT_RATE", "0.2")
+    )
+
+    # Limit shared by every worker replica running containers on one Docker host
+    CODE_RUNNER_HOST_SLOTS_ENABLED: bool = (
+        os.getenv("CODE_RUNNER_HOST_SLOTS_ENABLED", "true").lower() == "true"
+    )
+    CODE_RUNNER_HOST_MAX_CONCURRENT_EXECUTIONS: int = int(
+        os.getenv(
+            "CODE_RUNNER_HOST_MAX_CONCURRENT_EXECUTIONS",
+            os.getenv("MAX_CONCURRENT_EXECUTIONS", "3"),
+        )
+    )
+    CODE_RUNNER_HOST_SLOT_LEASE_TTL: int = int(
+        os.getenv("CODE_RUNNER_HOST_SLOT_LEASE_TTL", "30")
+    )
+    # Defaults to the Docker daemon ID when empty
+    CODE_RUNNER_DOCKER_HOST_ID: str = os.getenv("CODE_RUNNER_DOCKER_HOST_ID", "")
+
+    # Fair-share scheduling of prefetched runs between users
+    CODE_RUNNER_SCHEDULER_PREFETCH: int = int(
+        os.getenv("CODE_RUNNER_SCHEDULER_PREFETCH", "20")
+    )
+    CODE_RUNNER_MAX_IN_FLIGHT_PER_USER: int = int(
+        os.getenv("CODE_RUNNER_MAX_IN_FLIGHT_PER_USER", "2")
+    )
+    # Prefetched runs a user may have waiting, the rest go back behind others
+    CODE_RUNNER_MAX_QUEUED_PER_USER: int = int(
+        os.getenv("CODE_RUNNER_MAX_QUEUED_PER_USER", "4")
+    )
+    # e.g. "user:1=2,user:7=0.5", everyone else has weight 1
+    CODE_RUNNER_USER_WEIGHTS: str = os.getenv("CODE_RUNNER_USER_WEIGHTS", "")
+
+    # Rolling per-user budgets checked before a run is queued, 0 disables one
+    CODE_RUNNER_CPU_SECONDS_BUDGET: float = float(
+        os.getenv("CODE_RUNNER_CPU_SECONDS_BUDGET", "600")
+    )
+    CODE_RUNNER_RUNS_BUDGET: int = int(os.getenv("CODE_RUNNER_RUNS_BUDGET", "300"))
+    CODE_RUNNER_BUDGET_WINDOW: int = int(os.getenv("CODE_RUNNER_BUDGET_WINDOW", "3600"))
+
+    CODE_RUNNER_MAX_BATCH_CASES: int = int(
+        os.getenv("CODE_RUNNER_MAX_BATCH_CASES", "20")
+    )
+    CODE_RUNNER_COMPILE_TIMEOUT: int = int(
+        os.getenv("CODE_RUNNER_COMPILE_TIMEOUT", "30")
+    )
+    CODE_RUNNER_MAX_FILES: int = int(os.getenv("CODE_RUNNER_MAX_FILES", "20"))
+
+    CODE_RUNNER_MAX_RUNS_PER_CONNECTION: int = int(
+        os.getenv("CODE_RUNNER_MAX_RUNS_PER_CONNECTION", "5")
+    )
+    CODE_RUNNER_CANCEL_KEY_TTL: int = int(
+        os.getenv("CODE_RUNNER_CANCEL_KEY_TTL", "600")
+    )
+    CODE_RUNNER_RUN_RESULT_TTL: int = int(
+        os.getenv("CODE_RUNNER_RUN_RESULT_TTL", "3600")
+    )
+    CODE_RUNNER_LONG_POLL_MAX_WAIT: int = int(
+        os.getenv("CODE_RUNNER_LONG_POLL_MAX_WAIT", "30")
+    )
+
+    CODE_RUNNER_MAX_STDOUT_BYTES: int = int(
+        os.getenv("CODE_RUNNER_MAX_STDOUT_BYTES", "1048576")
+    )
+    CODE_RUNNER_MAX_STDERR_BYTES: int = int(
+        os.getenv("CODE_RUNNER_MAX_STDERR_BYTES", "262144")
+    )
+    CODE_RUNNER_KILL_ON_OUTPUT_LIMIT: bool = (
+        os.getenv("CODE_RUNNER_KILL_ON_OUTPUT_LIMIT", "true").lower() == "true"
+    )
+
+    # "docker" or "local" (sandboxes as local processes, see LocalProcessDriver)
+    CODE_RUNNER_BACKEND: str = os.getenv("CODE_RUNNER_BACKEND", "docker")
+    CODE_RUNNER_DOCKER_DRIVER: str = os.getenv("CODE_RUNNER_DOCKER_DRIVER", "async")
+    DOCKER_SOCKET_PATH: str = os.getenv("DOCKER_SOCKET_PATH", "/var/run/docker.sock")
+    CODE_RUNNER_LOCAL_ROOT: str = os.getenv("CODE_RUNNER_LOCAL_ROOT", "")
+    CODE_RUNNER_LOCAL_UNSHARE: bool = (
+        os.getenv("CODE_RUNNER_LOCAL_UNSHARE", "true").lower() == "true"
+    )
+    CODE_RUNNER_LOCAL_CPU_SECONDS: int = int(
+        os.getenv("CODE_RUNNER_LOCAL_CPU_SECONDS", "30")
+    )
+    CODE_RUNNER_LOCAL_MAX_PROCESSES: int = int(
+        os.getenv("CODE_RUNNER_LOCAL_MAX_PROCESSES", "1024")
+    )
+
+    CODE_RUNNER_POOL_ENABLED: bool = (
+        os.getenv("CODE_RUNNER_POOL_ENABLED", "true").lower() == "true"
+    )
+    CODE_RUNNER_POOL_MIN_SIZE: int = int(os.getenv("CODE_RUNNER_POOL_MIN_SIZE", "1"))
+    CODE_RUNNER_POOL_MAX_SIZE: int = int(os.getenv("CODE_RUNNER_POOL_MAX_SIZE", "3"))
+    CODE_RUNNER_POOL_TTL: int = int(os.getenv("CODE_RUNNER_POOL_TTL", "300"))
+    CODE_RUNNER_POOL_MAX_USES: int = int(os.getenv("CODE_RUNNER_POOL_MAX_USES", "10"))
+    # Java classes and Go binaries cached on a volume shared with the sandboxes
+    CODE_RUNNER_ARTIFACT_CACHE_ENABLED: bool = (
+        os.getenv("CODE_RUNNER_ARTIFACT_CACHE_ENABLED", "false").lower() == "true"
+    )
+    CODE_RUNNER_ARTIFACT_VOLUME: str = os.getenv(
+        "CODE_RUNNER_ARTIFACT_VOLUME", "code_runner_artifacts"
+    )
+    # Where the worker itself mounts CODE_RUNNER_ARTIFACT_VOLUME
+    CODE_RUNNER_ARTIFACT_CACHE_DIR: str = os.getenv(
+        "CODE_RUNNER_ARTIFACT_CACHE_DIR", "/var/cache/code-runner/artifacts"
+    )
+    CODE_RUNNER_ARTIFACT_CACHE_MAX_BYTES: int = int(
+        os.getenv("CODE_RUNNER_ARTIFACT_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+    )
+
+    CODE_RUNNER_IMAGE_REFRESH_INTERVAL: int = int(
+        os.getenv("CODE_RUNNER_IMAGE_REFRESH_INTERVAL", "300")
+    )
+    CODE_RUNNER_PULL_CONCURRENCY: int = int(
+        os.getenv("CODE_RUNNER_PULL_CONCURRENCY", "3")
+    )
+    # Most used images pulled before the worker starts, 0 pulls all of them
+    CODE_RUNNER_PREPULL_TOP: int = int(os.getenv("CODE_RUNNER_PREPULL_TOP", "3"))
+    CODE_RUNNER_IMAGE_STATUS_INTERVAL: int = int(
+        os.getenv("CODE_RUNNER_IMAGE_STATUS_INTERVAL", "10")
+    )
+    CODE_RUNNER_RESULT_CACHE_ENABLED: bool = (
+        os.getenv("CODE_RUNNER_RESULT_CACHE_ENABLED", "false").lower() == "true"
+    )
+    CODE_RUNNER_RESULT_CACHE_TTL: int = int(
+        os.getenv("CODE_RUNNER_RESULT_CACHE_TTL", "3600")
+    )
+    CODE_RUNNER_RESULT_CACHE_MAX_ENTRIES: int = int(
+        os.getenv("CODE_RUNNER_RESULT_CACHE_MAX_ENTRIES", "10000")
+    )
 
     FRONTEND_URL: str = os.getenv("FRONTEND_URL", "http://localhost:3000")
 
@@ -25,6 +174,15 @@ class Settings:
     ES_HOST: str = os.getenv("ELASTICSEARCH_HOST", "elasticsearch")
     ES_PORT: int = int(os.getenv("ELASTICSEARCH_PORT", "9200"))
     ES_URL: str = f"http://{ES_HOST}:{ES_PORT}"
+    ES_CONNECTIONS_PER_NODE: int = int(os.getenv("ES_CONNECTIONS_PER_NODE", "10"))
+    ES_REQUEST_TIMEOUT: float = float(os.getenv("ES_REQUEST_TIMEOUT", "10"))
+    ES_MAX_RETRIES: int = int(os.getenv("ES_MAX_RETRIES", "3"))
+    ES_RETRY_BACKOFF: float = float(os.getenv("ES_RETRY_BACKOFF", "1"))
+    ES_MAX_RETRY_BACKOFF: float = float(os.getenv("ES_MAX_RETRY_BACKOFF", "30"))
+    REINDEX_CHUNK_SIZE: int = int(os.getenv("REINDEX_CHUNK_SIZE", "500"))
+    REINDEX_PARALLELISM: int = int(os.getenv("REINDEX_PARALLELISM", "4"))
+    SNIPPET_EVENTS_BATCH_SIZE: int = int(os.getenv("SNIPPET_EVENTS_BATCH_SIZE", "500"))
+    SNIPPET_EVENTS_FLUSH_MS: int = int(os.getenv("SNIPPET_EVENTS_FLUSH_MS", "200"))
 
     RABBITMQ_USER: str = os.getenv("RABBITMQ_USER", "guest")
     RABBITMQ_PASS: str = os.getenv("RABBITMQ_PASS", "guest")
@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class RunStatusEnum(Enum):
+    QUEUED = "queued"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
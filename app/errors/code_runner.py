@@ -0,0 +1,14 @@
+class ImageNotFoundError(Exception):
+    pass
+
+
+class DockerDriverError(Exception):
+    pass
+
+
+class RunNotFoundError(Exception):
+    pass
+
+
+class QuotaExceededError(Exception):
+    pass
@@ -1,2 +1,10 @@
 class SnippetNotFoundError(Exception):
     pass
+
+
+class InvalidCursorError(Exception):
+    pass
+
+
+class SearchWindowExceededError(Exception):
+    pass
@@ -2,8 +2,10 @@ from fastapi import FastAPI
 
 
 def register_handlers(app: FastAPI) -> None:
+    from . import code_runner as code_runner_handlers
     from . import snippet as snippet_handlers
     from . import tag as tag_handlers
 
+    code_runner_handlers.attach(app)
     snippet_handlers.attach(app)
     tag_handlers.attach(app)
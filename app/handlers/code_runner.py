@@ -0,0 +1,14 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from app.errors.code_runner import QuotaExceededError, RunNotFoundError
+
+
+def attach(app: FastAPI) -> None:
+    @app.exception_handler(RunNotFoundError)
+    async def run_not_found_handler(request: Request, exc: RunNotFoundError):
+        return JSONResponse(status_code=404, content={"detail": "Run not found"})
+
+    @app.exception_handler(QuotaExceededError)
+    async def quota_exceeded_handler(request: Request, exc: QuotaExceededError):
+        return JSONResponse(status_code=429, content={"detail": str(exc)})
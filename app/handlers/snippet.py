@@ -1,10 +1,27 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 
-from app.errors.snippet import SnippetNotFoundError
+from app.errors.snippet import (
+    InvalidCursorError,
+    SearchWindowExceededError,
+    SnippetNotFoundError,
+)
 
 
 def attach(app: FastAPI) -> None:
     @app.exception_handler(SnippetNotFoundError)
     async def snippet_not_found_handler(request: Request, exc: SnippetNotFoundError):
         return JSONResponse(status_code=404, content={"detail": "Snippet not found"})
+
+    @app.exception_handler(InvalidCursorError)
+    async def invalid_cursor_handler(request: Request, exc: InvalidCursorError):
+        return JSONResponse(status_code=400, content={"detail": "Invalid cursor"})
+
+    @app.exception_handler(SearchWindowExceededError)
+    async def search_window_exceeded_handler(
+        request: Request, exc: SearchWindowExceededError
+    ):
+        return JSONResponse(
+            status_code=400,
+            content={"detail": "Offset too deep, page with the cursor instead"},
+        )
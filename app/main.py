@@ -11,6 +11,8 @@ from app.config import settings
 from app.db import engine
 from app.handlers import register_handlers
 from app.limiter import limiter
+from app.services.result_dispatcher import result_dispatcher
+from app.services.search import create_client as create_search_client
 from app.views.auth import router as auth_router
 from app.views.code_runner import router as code_runner_router
 from app.views.language import router as language_router
@@ -22,7 +24,11 @@ from app.views.tag import router as tag_router
 async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.execute(text("SELECT 1"))
+    await result_dispatcher.start()
+    app.state.search_client = create_search_client()
     yield
+    await app.state.search_client.close()
+    await result_dispatcher.close()
     await engine.dispose()
 
 
@@ -1,40 +1,164 @@
+import argparse
 import asyncio
 import logging
+import time
+from collections import deque
 
+from app.config import settings
 from app.db import SessionLocal
+from app.redis import get_redis
 from app.repos.snippet import Snippet
-from app.services.search import SearchService
+from app.services.search import WRITE_TARGETS_TTL, SearchService
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def reindex_all():
+def checkpoint_key(index: str) -> str:
+    """Last snippet id of `index` whose chunk, and all before it, was sent."""
+    return f"search:reindex:{index}:checkpoint"
+
+
+class BulkReindexer:
+    """Sends chunks as bulk requests, at most `parallelism` at once.
+
+    Chunks finish in the order they were sent, so the checkpoint only ever
+    moves past ids that are indexed along with everything before them.
+    """
+
+    def __init__(
+        self,
+        search_service: SearchService,
+        redis_client,
+        index: str,
+        parallelism: int,
+    ):
+        self.search_service = search_service
+        self.redis = redis_client
+        self.index = index
+        self.parallelism = parallelism
+        self.pending: deque[asyncio.Task] = deque()
+        self.indexed = 0
+        self.errors = 0
+
+    async def submit(self, documents: list[dict]):
+        if len(self.pending) >= self.parallelism:
+            await self._finish_oldest()
+        self.pending.append(asyncio.create_task(self._index_chunk(documents)))
+
+    async def drain(self):
+        while self.pending:
+            await self._finish_oldest()
+
+    def cancel(self):
+        for task in self.pending:
+            task.cancel()
+
+    async def _index_chunk(self, documents: list[dict]) -> tuple[int, int, list]:
+        indexed, errors = await self.search_service.bulk_index(documents, self.index)
+        return documents[-1]["id"], indexed, errors
+
+    async def _finish_oldest(self):
+        last_id, indexed, errors = await self.pending.popleft()
+        self.indexed += indexed
+        self.errors += len(errors)
+        for error in errors:
+            logger.error(f"Failed to index snippet: {error}")
+        await self.redis.set(checkpoint_key(self.index), last_id)
+        logger.info(f"Indexed up to snippet {last_id}")
+
+
+async def reindex_all(
+    chunk_size: int = None, parallelism: int = None, restart: bool = False
+) -> dict:
+    chunk_size = chunk_size or settings.REINDEX_CHUNK_SIZE
+    parallelism = parallelism or settings.REINDEX_PARALLELISM
     logger.info("Starting re-indexing process...")
 
     search_service = SearchService()
+    redis_gen = get_redis()
+    redis_client = await anext(redis_gen)
+    try:
+        await search_service.create_index()
+
+        index = await search_service.building_index()
+        if index and restart:
+            logger.info(f"Dropping unfinished rebuild of {index}")
+            await search_service.abort_rebuild(index)
+            await redis_client.delete(checkpoint_key(index))
+            index = None
+
+        after_id = 0
+        if index:
+            after_id = int(await redis_client.get(checkpoint_key(index)) or 0)
+            logger.info(f"Resuming rebuild of {index} after snippet {after_id}")
+        else:
+            index = await search_service.start_rebuild()
+            logger.info(f"Rebuilding into {index}")
 
-    await search_service.create_index()
+        # Rows are read only once every worker writes live events to the new
+        # index too, so none committed after the snapshot can be missed
+        await asyncio.sleep(WRITE_TARGETS_TTL)
 
-    async with SessionLocal() as session:
-        snippets = await Snippet.get_all(session)
-        logger.info(f"Found {len(snippets)} snippets in database.")
+        started = time.monotonic()
+        reindexer = BulkReindexer(search_service, redis_client, index, parallelism)
+        try:
+            async with SessionLocal() as session:
+                chunk = []
+                async for row in Snippet.stream_for_index(
+                    session, after_id, chunk_size
+                ):
+                    chunk.append(search_service.snippet_document(**row._mapping))
+                    if len(chunk) >= chunk_size:
+                        await reindexer.submit(chunk)
+                        chunk = []
+                if chunk:
+                    await reindexer.submit(chunk)
+                await reindexer.drain()
+        except BaseException:
+            reindexer.cancel()
+            raise
 
-        for snippet in snippets:
-            try:
-                await search_service.index_snippet(
-                    snippet_id=snippet.id,
-                    title=snippet.title,
-                    code=snippet.code,
-                    language=snippet.language,
-                )
-                logger.info(f"Indexed snippet {snippet.id}")
-            except Exception as e:
-                logger.error(f"Failed to index snippet {snippet.id}: {e}")
+        swapped = not reindexer.errors
+        if swapped:
+            old = await search_service.finish_rebuild(index)
+            await redis_client.delete(checkpoint_key(index))
+            logger.info(f"Aliases swapped to {index}, dropped {old}")
+        else:
+            logger.error(
+                f"Not swapping to {index} with failed documents, rerun to swap "
+                f"anyway or --restart to rebuild from scratch"
+            )
+    finally:
+        await search_service.close()
+        await redis_client.aclose()
 
-    await search_service.close()
-    logger.info("Re-indexing completed.")
+    seconds = time.monotonic() - started
+    report = {
+        "indexed": reindexer.indexed,
+        "errors": reindexer.errors,
+        "index": index,
+        "swapped": swapped,
+        "seconds": round(seconds, 3),
+        "docs_per_second": round(reindexer.indexed / seconds, 1) if seconds else 0.0,
+    }
+    logger.info(
+        f"Re-indexing completed: {report['indexed']} indexed, "
+        f"{report['errors']} errors in {report['seconds']}s "
+        f"({report['docs_per_second']} docs/s)"
+    )
+    return report
 
 
 if __name__ == "__main__":
-    asyncio.run(reindex_all())
+    parser = argparse.ArgumentParser(description="Rebuild the snippet search index")
+    parser.add_argument("--chunk-size", type=int)
+    parser.add_argument("--parallelism", type=int)
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="drop an unfinished rebuild instead of resuming it",
+    )
+    args = parser.parse_args()
+    report = asyncio.run(reindex_all(args.chunk_size, args.parallelism, args.restart))
+    raise SystemExit(1 if report["errors"] else 0)
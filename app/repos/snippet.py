@@ -1,4 +1,15 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Table, exc, select
+from typing import TYPE_CHECKING
+
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Integer,
+    String,
+    Table,
+    exc,
+    func,
+    select,
+)
 from sqlalchemy.orm import relationship, selectinload, joinedload
 
 from app.db import SessionLocal
@@ -7,6 +18,9 @@ from app.mq import publish_event
 from app.repos.base import Base
 from app.schemas.snippet import SnippetCreate, SnippetUpdate
 
+if TYPE_CHECKING:
+    from app.services.search import SearchService
+
 snippet_tags = Table(
     "snippet_tags",
     Base.metadata,
@@ -44,28 +58,13 @@ class Snippet(Base):
         session: SessionLocal,
         user_id: int,
         tag_name: str = None,
-        query_text: str = None,
         language_id: int = None,
         offset: int = 0,
         limit: int = 100,
     ) -> list["Snippet"]:
-        snippet_ids = None
-        if query_text:
-            from app.services.search import SearchService
-
-            search_service = SearchService()
-            try:
-                snippet_ids = await search_service.search_snippets(query_text)
-                if not snippet_ids:
-                    return []
-            finally:
-                await search_service.close()
-
+        """Page through a user's snippets, searches go through `search`."""
         query = select(Snippet).filter(Snippet.user_id == user_id)
 
-        if snippet_ids is not None:
-            query = query.filter(Snippet.id.in_(snippet_ids))
-
         if tag_name:
             from app.repos.tag import Tag
 
@@ -83,6 +82,73 @@ class Snippet(Base):
         result = await session.execute(query)
         return result.scalars().all()
 
+    @classmethod
+    async def search(
+        cls,
+        session: SessionLocal,
+        search_service: "SearchService",
+        user_id: int,
+        query_text: str,
+        tag_name: str = None,
+        language_id: int = None,
+        offset: int = 0,
+        limit: int = 100,
+        cursor: str = None,
+    ) -> tuple[list["Snippet"], str | None]:
+        """The user's snippets matching `query_text` in relevance order.
+
+        Filtering and paging happen in the search index, the database only
+        loads the page. Returns the cursor of the next page as well.
+        """
+        snippet_ids, next_cursor = await search_service.search_snippets(
+            query_text,
+            user_id=user_id,
+            tag=tag_name,
+            language_id=language_id,
+            size=limit,
+            offset=offset,
+            cursor=cursor,
+        )
+        if not snippet_ids:
+            return [], None
+
+        result = await session.execute(
+            select(Snippet)
+            .filter(Snippet.id.in_(snippet_ids), Snippet.user_id == user_id)
+            .options(selectinload(Snippet.tags), joinedload(Snippet.language))
+        )
+        position = {snippet_id: i for i, snippet_id in enumerate(snippet_ids)}
+        snippets = sorted(result.scalars().all(), key=lambda s: position[s.id])
+        return snippets, next_cursor
+
+    @classmethod
+    async def stream_for_index(
+        cls, session: SessionLocal, after_id: int = 0, batch_size: int = 500
+    ):
+        """Rows to index in id order, read through a server-side cursor."""
+        from app.repos.language import Language
+        from app.repos.tag import Tag
+
+        result = await session.stream(
+            select(
+                Snippet.id.label("snippet_id"),
+                Snippet.title,
+                Snippet.code,
+                Language.name.label("language"),
+                Snippet.user_id,
+                Snippet.language_id,
+                func.array_remove(func.array_agg(Tag.name), None).label("tags"),
+            )
+            .outerjoin(Snippet.language)
+            .outerjoin(Snippet.tags)
+            .filter(Snippet.id > after_id)
+            .group_by(Snippet.id, Language.name)
+            .order_by(Snippet.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for row in result:
+            yield row
+
     @classmethod
     async def get_by_ids(cls, session: SessionLocal, ids: list[int]) -> list["Snippet"]:
         result = await session.execute(
@@ -136,6 +202,9 @@ class Snippet(Base):
                 "title": db_snippet.title,
                 "code": db_snippet.code,
                 "language": db_snippet.language.name if db_snippet.language else None,
+                "user_id": db_snippet.user_id,
+                "language_id": db_snippet.language_id,
+                "tags": [tag.name for tag in db_snippet.tags],
             },
         )
 
@@ -190,6 +259,9 @@ class Snippet(Base):
                 "title": db_snippet.title,
                 "code": db_snippet.code,
                 "language": db_snippet.language.name if db_snippet.language else None,
+                "user_id": db_snippet.user_id,
+                "language_id": db_snippet.language_id,
+                "tags": [tag.name for tag in db_snippet.tags],
             },
         )
 
@@ -212,7 +284,7 @@ class Snippet(Base):
         await publish_event(
             "snippet_events",
             "snippet.deleted",
-            {"id": id},
+            {"id": id, "user_id": user_id},
         )
 
         return db_snippet
@@ -1,17 +1,106 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
+from app.config import settings
+from app.enums.code_runner import RunStatusEnum
 from app.enums.language import RunLanguage
 
 
+class CodeFile(BaseModel):
+    name: str = Field(..., max_length=255, pattern=r"^[\w.-]+(/[\w.-]+)*$")
+    content: str = Field(..., max_length=10000)
+
+    @field_validator("name")
+    @classmethod
+    def name_stays_in_source_dir(cls, value: str) -> str:
+        if any(part in (".", "..") for part in value.split("/")):
+            raise ValueError("File name must be a relative path without . or ..")
+        return value
+
+
 class CodeRunRequest(BaseModel):
     code: str = Field(..., min_length=1, max_length=10000)
     language: str = Field(..., pattern=f"^({'|'.join(RunLanguage.get_languages())})$")
     version: str | None = Field(
         None, description="Specific version of the language runtime"
     )
+    files: list[CodeFile] = Field(
+        default_factory=list,
+        max_length=settings.CODE_RUNNER_MAX_FILES,
+        description="Extra source files written next to the main one",
+    )
+    deterministic: bool = Field(
+        True, description="Set to false to bypass the cached result of a previous run"
+    )
+    run_id: str | None = Field(
+        None, max_length=64, description="Client id used to tag the run's frames"
+    )
+
+
+class CodeRunCancelRequest(BaseModel):
+    run_id: str = Field(..., max_length=64)
+
+
+class RunUsage(BaseModel):
+    cpu_time: float = Field(..., description="CPU seconds used by the run")
+    peak_memory: int = Field(..., description="Peak memory of the sandbox in bytes")
+    wall_time: float = Field(..., description="Seconds from start to exit")
 
 
 class CodeRunResponse(BaseModel):
     stdout: str
     stderr: str
     exit_code: int
+    truncated: bool = False
+    usage: RunUsage | None = None
+
+
+class CodeRunCase(BaseModel):
+    stdin: str = Field("", max_length=10000)
+    args: list[str] = Field(default_factory=list, max_length=20)
+
+
+class CodeBatchRunRequest(BaseModel):
+    code: str = Field(..., min_length=1, max_length=10000)
+    language: str = Field(..., pattern=f"^({'|'.join(RunLanguage.get_languages())})$")
+    version: str | None = Field(
+        None, description="Specific version of the language runtime"
+    )
+    files: list[CodeFile] = Field(
+        default_factory=list,
+        max_length=settings.CODE_RUNNER_MAX_FILES,
+        description="Extra source files written next to the main one",
+    )
+    cases: list[CodeRunCase] = Field(
+        ..., min_length=1, max_length=settings.CODE_RUNNER_MAX_BATCH_CASES
+    )
+    case_timeout: float = Field(5, gt=0, le=10, description="Seconds per case")
+
+
+class CodeBatchStepResponse(BaseModel):
+    stdout: str
+    stderr: str
+    exit_code: int
+    truncated: bool = False
+    timed_out: bool = False
+    wall_time: float
+    cached: bool = Field(False, description="Build reused from the artifact cache")
+
+
+class CodeBatchRunResponse(BaseModel):
+    compile: CodeBatchStepResponse
+    cases: list[CodeBatchStepResponse]
+    usage: RunUsage | None = None
+
+
+class CodeRunStatus(BaseModel):
+    task_id: str
+    status: RunStatusEnum
+    result: CodeRunResponse | CodeBatchRunResponse | None = None
+
+
+class CodeRunnerReadiness(BaseModel):
+    ready: bool
+    workers: int = Field(..., description="Workers that reported their images")
+    images: dict[str, str] = Field(
+        ..., description="Image state across workers: present, pulling or missing"
+    )
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Callable
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DECREASE_FACTOR = 0.5
+# Fewer runs than this say nothing about the timeout rate
+MIN_TIMEOUT_SAMPLES = 5
+
+
+def load_per_cpu() -> float:
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the runs a worker executes at once.
+
+    Every adjustment the limit is halved if the host looks overloaded (load
+    average per CPU, sandbox start latency or the share of runs timing out
+    above target), and raised by one if runs were waiting for a slot.
+    Samples are cleared on a decrease, so one bad burst halves it only once.
+    """
+
+    def __init__(
+        self,
+        min_limit: int,
+        max_limit: int,
+        initial: int,
+        target_start_latency: float,
+        target_load: float,
+        target_timeout_rate: float,
+        sample_size: int = 20,
+        load: Callable[[], float] = load_per_cpu,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_start_latency = target_start_latency
+        self.target_load = target_load
+        self.target_timeout_rate = target_timeout_rate
+        self._load = load
+
+        self._limit = min(max(initial, min_limit), max_limit)
+        self._start_latencies: deque[float] = deque(maxlen=sample_size)
+        self._timeouts: deque[bool] = deque(maxlen=sample_size)
+        self._saturated = False
+        metrics.set("code_runner_concurrency_limit", self._limit)
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def record(self, start_latency: float, timed_out: bool):
+        self._start_latencies.append(start_latency)
+        self._timeouts.append(timed_out)
+
+    def mark_saturated(self):
+        """Runs were waiting because the limit was reached."""
+        self._saturated = True
+
+    def adjust(self) -> str:
+        reason = self._overload_reason()
+        decision = "hold"
+        if reason:
+            limit = max(self.min_limit, int(self._limit * DECREASE_FACTOR))
+            self._start_latencies.clear()
+            self._timeouts.clear()
+            decision = "decrease" if limit < self._limit else "hold"
+        elif self._saturated and self._limit < self.max_limit:
+            limit = self._limit + 1
+            decision, reason = "increase", "saturated"
+        else:
+            limit = self._limit
+        self._saturated = False
+
+        if limit != self._limit:
+            logger.info(f"Concurrency limit {self._limit} -> {limit} ({reason})")
+            self._limit = limit
+        metrics.set("code_runner_concurrency_limit", self._limit)
+        metrics.inc(
+            "code_runner_concurrency_decisions_total",
+            decision=decision,
+            reason=reason or "healthy",
+        )
+        return decision
+
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.adjust()
+            except Exception as e:
+                logger.warning(f"Failed to adjust concurrency limit: {e}")
+
+    def _overload_reason(self) -> str | None:
+        load = self._load()
+        metrics.set("code_runner_load_per_cpu", load)
+        if load > self.target_load:
+            return "load"
+
+        if self._start_latencies:
+            latency = sum(self._start_latencies) / len(self._start_latencies)
+            metrics.set("code_runner_start_latency_seconds", latency)
+            if latency > self.target_start_latency:
+                return "start_latency"
+
+        if len(self._timeouts) >= MIN_TIMEOUT_SAMPLES:
+            rate = sum(self._timeouts) / len(self._timeouts)
+            metrics.set("code_runner_timeout_rate", rate)
+            if rate > self.target_timeout_rate:
+                return "timeouts"
+        return None
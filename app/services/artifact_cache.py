@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import uuid
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Where sandboxes see the cache volume, mounted read-only
+ARTIFACTS_MOUNT = "/artifacts"
+# Owner of the cache root, so sandbox root without capabilities cannot list it
+NOBODY_UID = 65534
+
+
+class ArtifactCache:
+    """Compiled classes and binaries kept on a worker-local volume.
+
+    Entries are directories named by a hash of the image, language and
+    source. The root is traversable but not listable from the sandboxes, so
+    a build can only be found by someone who already has its source. Least
+    recently used entries are evicted once the total size exceeds max_bytes.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._sizes: dict[str, int] = {}
+
+        os.makedirs(self.root, exist_ok=True)
+        os.chmod(self.root, 0o711)
+        try:
+            os.chown(self.root, NOBODY_UID, NOBODY_UID)
+        except PermissionError:
+            logger.warning(f"Could not chown {self.root}, sandboxes can list it")
+
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if entry.startswith("."):
+                # Leftover of a store interrupted by a restart
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isdir(path):
+                self._sizes[entry] = self._dir_size(path)
+
+    @staticmethod
+    def make_key(
+        language: str, image_id: str, code: str, files: list[dict] | None = None
+    ) -> str:
+        digest = hashlib.sha256()
+        for part in (language, image_id, code):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        if files:
+            digest.update(json.dumps(files, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def lookup(self, key: str) -> str | None:
+        """Return the path of a cached build inside the sandbox, if there is one."""
+        if key not in self._sizes:
+            metrics.inc("code_runner_artifact_cache_misses_total")
+            return None
+
+        try:
+            # The directory mtime is the LRU clock
+            os.utime(os.path.join(self.root, key))
+        except FileNotFoundError:
+            self._sizes.pop(key, None)
+            metrics.inc("code_runner_artifact_cache_misses_total")
+            return None
+        metrics.inc("code_runner_artifact_cache_hits_total")
+        return f"{ARTIFACTS_MOUNT}/{key}"
+
+    async def store(self, key: str, archive: bytes):
+        """Unpack a tar of a build directory into the cache."""
+        await asyncio.to_thread(self._store, key, archive)
+
+    def total_size(self) -> int:
+        return sum(self._sizes.values())
+
+    def _store(self, key: str, archive: bytes):
+        if key in self._sizes:
+            return
+
+        # Unpack next to the final path and rename, readers never see half a build
+        staging = os.path.join(self.root, f".{uuid.uuid4().hex}")
+        try:
+            with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+                tar.extractall(staging, filter="data")
+            os.chmod(staging, 0o755)
+            os.rename(staging, os.path.join(self.root, key))
+        except (tarfile.TarError, OSError) as e:
+            logger.warning(f"Failed to cache build {key}: {e}")
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+
+        self._sizes[key] = self._dir_size(os.path.join(self.root, key))
+        self._evict()
+
+    def _evict(self):
+        if self.total_size() <= self.max_bytes:
+            return
+
+        def last_used(key: str) -> float:
+            try:
+                return os.path.getmtime(os.path.join(self.root, key))
+            except FileNotFoundError:
+                return 0
+
+        for key in sorted(self._sizes, key=last_used):
+            if self.total_size() <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            self._sizes.pop(key)
+            metrics.inc("code_runner_artifact_cache_evictions_total")
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        return sum(
+            os.path.getsize(os.path.join(directory, name))
+            for directory, _, names in os.walk(path)
+            for name in names
+        )
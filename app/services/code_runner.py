@@ -1,25 +1,303 @@
 import asyncio
-
-import docker
+import codecs
+import io
+import logging
+import posixpath
+import tarfile
+import time
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
 
 from app.config import settings
 from app.constants import AVAILABLE_IMAGES
 from app.enums.language import RunLanguage
+from app.errors.code_runner import ImageNotFoundError
+from app.metrics import metrics
+from app.services.adaptive_concurrency import AdaptiveConcurrency
+from app.services.artifact_cache import ARTIFACTS_MOUNT, ArtifactCache
+from app.services.container_pool import ContainerPool, PooledContainer
+from app.services.docker_driver import (
+    STDERR,
+    DockerDriver,
+    collect_frames,
+    create_driver,
+)
+from app.services.host_slots import HostSlots
+from app.services.image_registry import ImageRegistry
+from app.services.resource_usage import UsageSampler
+from app.services.runner_images import runner_image_name
+
+logger = logging.getLogger(__name__)
+
+SANDBOX_OPTIONS = {
+    "mem_limit": "200m",
+    "cpu_period": 100000,
+    "cpu_quota": 50000,  # 50%
+    "network_mode": "none",
+    "working_dir": "/tmp",
+    "read_only": True,  # Read-only root filesystem
+    "tmpfs": {
+        "/tmp": "size=10m,mode=1777,exec",
+        "/root/.cache": "size=50m,mode=1777,exec",  # Writable cache for Go builds etc
+        "/root/.config": "size=10m,mode=1777,exec",  # Some tools might need config dir
+    },  # Writable /tmp with size limit
+    "cap_drop": ["ALL"],  # Drop all capabilities
+    "security_opt": ["no-new-privileges"],  # Prevent privilege escalation
+    "pids_limit": 200,  # Limit number of processes
+}
+
+# Sources are extracted here, the main one under the toolchain's "source" name
+SOURCE_DIR = "/tmp"
+
+# Compilers write here, "{build}" in a run command is replaced by the directory
+# holding the build, which is BUILD_DIR or a cached copy under ARTIFACTS_MOUNT
+BUILD_DIR = "/tmp/build"
+
+# Where each language's source is written, how it is compiled and how it runs.
+# Commands are executed directly, without a shell.
+TOOLCHAINS = {
+    RunLanguage.PYTHON.value: {
+        "source": "code.py",
+        "compile": None,
+        "run": ["python", "/tmp/code.py"],
+    },
+    RunLanguage.JAVASCRIPT.value: {
+        "source": "code.js",
+        "compile": None,
+        "run": ["node", "/tmp/code.js"],
+    },
+    RunLanguage.JAVA.value: {
+        "source": "Main.java",
+        # javac finds the other classes of a multi-file snippet on the sourcepath
+        "compile": [
+            "javac",
+            "-sourcepath",
+            SOURCE_DIR,
+            "-d",
+            BUILD_DIR,
+            "/tmp/Main.java",
+        ],
+        "run": ["java", "-cp", "{build}", "Main"],
+    },
+    RunLanguage.GO.value: {
+        "source": "code.go",
+        "compile": ["go", "build", "-o", f"{BUILD_DIR}/main", "/tmp/code.go"],
+        "run": ["{build}/main"],
+        # go build takes every file of the main package on the command line
+        "package_suffix": ".go",
+    },
+}
+
+# Streams a finished build to the worker so it can be cached
+ARCHIVE_BUILD_COMMAND = ["tar", "-C", BUILD_DIR, "-cf", "-", "."]
+
+if settings.CODE_RUNNER_ARTIFACT_CACHE_ENABLED:
+    # Read-only, so sandboxes can run cached builds but never write them
+    SANDBOX_OPTIONS["volumes"] = [
+        f"{settings.CODE_RUNNER_ARTIFACT_VOLUME}:{ARTIFACTS_MOUNT}:ro"
+    ]
+
+# Receives ("stdout" | "stderr", text) chunks while the code is running
+OutputCallback = Callable[[str, str], Awaitable[None]]
+
+
+def get_image(language: str, version: str = None) -> str:
+    versions = AVAILABLE_IMAGES.get(language, [])
+    if not versions:
+        # Fallback or default
+        return "python:3.9-slim"
+
+    if version:
+        for v in versions:
+            if v["version"] == version:
+                return v["image"]
+
+    # Default to first version if not specified or not found
+    return versions[0]["image"]
+
+
+def source_archive(code: str, toolchain: dict, files: list[dict] | None = None):
+    """Tar archive of a snippet's sources, to be extracted into SOURCE_DIR.
+
+    Extra files come first, so the main source wins if a name is repeated.
+    Compiled languages also get an empty build directory to compile into.
+    """
+    buffer = io.BytesIO()
+    directories = set()
+
+    def add_directory(name: str):
+        if name in directories:
+            return
+        directories.add(name)
+        info = tarfile.TarInfo(name)
+        info.type, info.mode = tarfile.DIRTYPE, 0o755
+        archive.addfile(info)
+
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        if toolchain["compile"]:
+            add_directory(posixpath.relpath(BUILD_DIR, SOURCE_DIR))
+        entries = [(f["name"], f["content"]) for f in files or ()]
+        for name, content in [*entries, (toolchain["source"], code)]:
+            parts = name.split("/")[:-1]
+            for depth in range(1, len(parts) + 1):
+                add_directory("/".join(parts[:depth]))
+            data = content.encode()
+            info = tarfile.TarInfo(name)
+            info.size, info.mode = len(data), 0o644
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
 
 
 class CodeRunnerService:
-    # Class-level semaphore to limit concurrent executions across all instances
-    _semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_EXECUTIONS)
+    # Class-level semaphore to limit concurrent executions across all instances,
+    # the adaptive limit of the worker stays below it
+    _semaphore = asyncio.Semaphore(
+        settings.CODE_RUNNER_CONCURRENCY_MAX
+        if settings.CODE_RUNNER_ADAPTIVE_CONCURRENCY
+        else settings.MAX_CONCURRENT_EXECUTIONS
+    )
 
-    def __init__(self):
-        self.client = docker.from_env()
+    def __init__(
+        self,
+        driver: DockerDriver | None = None,
+        pool: ContainerPool | None = None,
+        image_registry: ImageRegistry | None = None,
+        host_slots: HostSlots | None = None,
+        artifact_cache: ArtifactCache | None = None,
+        concurrency: AdaptiveConcurrency | None = None,
+    ):
+        self.driver = driver or create_driver(
+            (
+                "local"
+                if settings.CODE_RUNNER_BACKEND == "local"
+                else settings.CODE_RUNNER_DOCKER_DRIVER
+            ),
+            settings.DOCKER_SOCKET_PATH,
+        )
+        self.pool = pool
+        self.image_registry = image_registry
+        self.host_slots = host_slots
+        self.artifact_cache = artifact_cache
+        self.concurrency = concurrency
+        if artifact_cache is None and settings.CODE_RUNNER_ARTIFACT_CACHE_ENABLED:
+            self.artifact_cache = ArtifactCache(
+                settings.CODE_RUNNER_ARTIFACT_CACHE_DIR,
+                settings.CODE_RUNNER_ARTIFACT_CACHE_MAX_BYTES,
+            )
+
+    async def start_image_registry(self, images: list[str] | None = None):
+        """Track present runner images so runs never pull from the registry.
+
+        Missing images are pulled in the background, in the order given.
+        """
+        from app.workers.init_images import IMAGES
+
+        self.image_registry = ImageRegistry(
+            self.driver.list_image_tags,
+            self.driver.pull,
+            images or IMAGES,
+            refresh_interval=settings.CODE_RUNNER_IMAGE_REFRESH_INTERVAL,
+            max_concurrent_pulls=settings.CODE_RUNNER_PULL_CONCURRENCY,
+        )
+        await self.image_registry.refresh()
+        await self.image_registry.start()
+
+    async def start_host_slots(self, redis_client):
+        """Share the execution limit with the other workers of this Docker host."""
+        host_id = settings.CODE_RUNNER_DOCKER_HOST_ID or await self.driver.daemon_id()
+        self.host_slots = HostSlots(
+            redis_client,
+            host_id,
+            limit=settings.CODE_RUNNER_HOST_MAX_CONCURRENT_EXECUTIONS,
+            lease_ttl=settings.CODE_RUNNER_HOST_SLOT_LEASE_TTL,
+        )
+
+    def start_concurrency_controller(self) -> AdaptiveConcurrency:
+        """Let the worker's concurrency limit follow the load of the host.
+
+        Call it after start_host_slots: runs past the host's slots would only
+        wait for one, unseen by the start latency, so the limit stays below.
+        """
+        max_limit = settings.CODE_RUNNER_CONCURRENCY_MAX
+        if self.host_slots is not None:
+            max_limit = min(max_limit, self.host_slots.limit)
+        self.concurrency = AdaptiveConcurrency(
+            min_limit=min(settings.CODE_RUNNER_CONCURRENCY_MIN, max_limit),
+            max_limit=max_limit,
+            initial=settings.MAX_CONCURRENT_EXECUTIONS,
+            target_start_latency=settings.CODE_RUNNER_TARGET_START_LATENCY,
+            target_load=settings.CODE_RUNNER_TARGET_LOAD_PER_CPU,
+            target_timeout_rate=settings.CODE_RUNNER_TARGET_TIMEOUT_RATE,
+        )
+        return self.concurrency
+
+    async def start_pool(self):
+        """Start warm sandboxes for every image in AVAILABLE_IMAGES."""
+        if not self.driver.supports_pool:
+            logger.info("Container pool not supported by the backend, skipping")
+            return
+        self.pool = ContainerPool(
+            self.driver,
+            self._create_pooled_container,
+            min_size=settings.CODE_RUNNER_POOL_MIN_SIZE,
+            max_size=settings.CODE_RUNNER_POOL_MAX_SIZE,
+            ttl=settings.CODE_RUNNER_POOL_TTL,
+            max_uses=settings.CODE_RUNNER_POOL_MAX_USES,
+        )
+        await self.pool.start(
+            [
+                self._resolve_image(v["image"])
+                for versions in AVAILABLE_IMAGES.values()
+                for v in versions
+            ]
+        )
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+        if self.image_registry:
+            await self.image_registry.close()
+        await self.driver.close()
 
     async def run_code(
-        self, code: str, language: str, version: str = None, timeout: int = 10
+        self,
+        code: str,
+        language: str,
+        version: str = None,
+        timeout: int = 10,
+        on_output: OutputCallback | None = None,
+        files: list[dict] | None = None,
     ):
+        async with self._execution_slot():
+            return await self._execute_code(
+                code, language, version, timeout, on_output, files
+            )
+
+    async def run_batch(
+        self,
+        code: str,
+        language: str,
+        version: str = None,
+        cases: list[dict] = (),
+        case_timeout: float = 5,
+        files: list[dict] | None = None,
+    ):
+        """Compile once, then run every stdin/args case in the same sandbox."""
+        async with self._execution_slot():
+            return await self._execute_batch(
+                code, language, version, cases, case_timeout, files
+            )
+
+    @asynccontextmanager
+    async def _execution_slot(self):
         # Use semaphore to limit concurrent executions
         async with self._semaphore:
-            return await self._execute_code(code, language, version, timeout)
+            if self.host_slots is None:
+                yield
+                return
+            # Then wait for a slot on the Docker host shared with other workers
+            async with self.host_slots.hold():
+                yield
 
     def get_available_versions(self):
         return {
@@ -28,135 +306,393 @@ class CodeRunnerService:
         }
 
     async def _execute_code(
-        self, code: str, language: str, version: str = None, timeout: int = 10
+        self,
+        code: str,
+        language: str,
+        version: str = None,
+        timeout: int = 10,
+        on_output: OutputCallback | None = None,
+        files: list[dict] | None = None,
     ):
-        container = None
+        if language not in TOOLCHAINS:
+            return await self._error_result(
+                f"Language {language} is not supported", on_output
+            )
 
         try:
             image = self._get_image(language, version)
-            # Pull image if not present
-            try:
-                loop = asyncio.get_event_loop()
-                await loop.run_in_executor(None, lambda: self.client.images.pull(image))
-            except Exception:
-                pass  # Image might already exist
-
-            # Run code in container - pass code via command
-            container = self.client.containers.run(
-                image=image,
-                command=self._get_command(code, language),
-                mem_limit="200m",
-                cpu_period=100000,
-                cpu_quota=50000,  # 50%
-                network_mode="none",
-                working_dir="/tmp",
-                read_only=True,  # Read-only root filesystem
-                tmpfs={
-                    "/tmp": "size=10m,mode=1777,exec",
-                    "/root/.cache": "size=50m,mode=1777,exec",  # Writable cache for Go builds etc
-                    "/root/.config": "size=10m,mode=1777,exec",  # Some tools might need config dir
-                },  # Writable /tmp with size limit
-                cap_drop=["ALL"],  # Drop all capabilities
-                security_opt=["no-new-privileges"],  # Prevent privilege escalation
-                pids_limit=200,  # Limit number of processes
-                stdout=True,
-                stderr=True,
-                detach=True,
+            if self.image_registry and not self.image_registry.is_present(image):
+                # The registry pulls it in the background, the run fails fast
+                raise ImageNotFoundError(image)
+            image = self._resolve_image(image)
+
+            return await self._execute_sandboxed(
+                code, language, image, timeout, on_output, files
             )
 
-            # Wait for container to finish with timeout
-            try:
-                result = await asyncio.wait_for(
-                    self._wait_for_container(container), timeout=timeout
-                )
-                return result
-            except asyncio.TimeoutError:
-                try:
-                    container.kill()
-                except Exception:
-                    pass
-                return {"stdout": "", "stderr": "Timeout exceeded", "exit_code": -1}
-
-        except docker.errors.ImageNotFound:
+        except ImageNotFoundError:
             error_msg = f"Image for {language}"
             if version:
                 error_msg += f" {version}"
             error_msg += " not found"
 
-            return {
-                "stdout": "",
-                "stderr": error_msg,
-                "exit_code": -1,
-            }
+            return await self._error_result(error_msg, on_output)
         except Exception as e:
-            return {"stdout": "", "stderr": f"System error: {str(e)}", "exit_code": -1}
+            return await self._error_result(f"System error: {str(e)}", on_output)
+
+    async def _execute_sandboxed(
+        self,
+        code: str,
+        language: str,
+        image: str,
+        timeout: int = 10,
+        on_output: OutputCallback | None = None,
+        files: list[dict] | None = None,
+    ):
+        """Deliver the sources (or reuse a cached build), build and run as execs."""
+        started = time.monotonic()
+        sandbox = await self._acquire_sandbox(image)
+        start_latency = time.monotonic() - started
+        healthy = False
+        timed_out = False
+        sampler = UsageSampler(self.driver, sandbox.container_id)
+        await sampler.start(baseline=self.pool is not None)
+
+        try:
+            async with asyncio.timeout(timeout):
+                build, build_dir = await self._build(
+                    sandbox.container_id,
+                    code,
+                    language,
+                    image,
+                    on_output=on_output,
+                    files=files,
+                )
+                if build["exit_code"] != 0:
+                    result = {
+                        key: build[key]
+                        for key in ("stdout", "stderr", "exit_code", "truncated")
+                    }
+                else:
+                    result = await self._stream_exec(
+                        sandbox.container_id,
+                        self._get_run_command(TOOLCHAINS[language], build_dir),
+                        on_output,
+                    )
+            # A run stopped by the runner leaves its exec behind in the sandbox
+            healthy = result["exit_code"] != -1
+        except TimeoutError:
+            # The exec keeps running inside the sandbox, so the container is discarded
+            timed_out = True
+            result = await self._error_result("Timeout exceeded", on_output)
         finally:
-            # Remove container if it's still running
-            if container:
-                try:
-                    container.remove(force=True)
-                except Exception:
-                    pass
+            usage = await sampler.stop()
+            await self._release_sandbox(sandbox, healthy)
+
+        if self.concurrency is not None:
+            self.concurrency.record(start_latency, timed_out)
+        # Start-to-exit latency, comparable between backends
+        metrics.inc("code_runner_runs_total", backend=settings.CODE_RUNNER_BACKEND)
+        metrics.inc(
+            "code_runner_run_seconds_total",
+            usage["wall_time"],
+            backend=settings.CODE_RUNNER_BACKEND,
+        )
+        return {**result, "usage": usage}
+
+    async def _build(
+        self,
+        container_id: str,
+        code: str,
+        language: str,
+        image: str,
+        timeout: float | None = None,
+        on_output: OutputCallback | None = None,
+        files: list[dict] | None = None,
+    ) -> tuple[dict, str]:
+        """Write the sources into the sandbox and compile them.
+
+        Returns the build step result and the directory holding the build.
+        """
+        toolchain = TOOLCHAINS[language]
+        started = time.monotonic()
+        # Written on cache hits too, the program may read the extra files
+        await self.driver.put_archive(
+            container_id, SOURCE_DIR, source_archive(code, toolchain, files)
+        )
+        if not toolchain["compile"]:
+            return self._passed_step(time.monotonic() - started), BUILD_DIR
+
+        key = None
+        if self.artifact_cache is not None:
+            key = ArtifactCache.make_key(
+                language, await self.driver.image_id(image), code, files
+            )
+            cached = self.artifact_cache.lookup(key)
+            if cached:
+                return {**self._passed_step(0.0), "cached": True}, cached
+
+        build = await self._run_step(
+            container_id,
+            self._get_compile_command(toolchain, files),
+            timeout,
+            on_output,
+        )
+        # Archived before any user code runs in the sandbox and could alter it
+        if key and build["exit_code"] == 0:
+            await self._save_build(container_id, key)
+        return build, BUILD_DIR
+
+    async def _save_build(self, container_id: str, key: str):
+        try:
+            exec_id = await self.driver.exec_create(container_id, ARCHIVE_BUILD_COMMAND)
+            archive, _ = await collect_frames(self.driver.exec_attach(exec_id))
+            if await self.driver.exec_exit_code(exec_id) == 0:
+                await self.artifact_cache.store(key, archive)
+        except Exception as e:
+            logger.warning(f"Failed to archive build {key}: {e}")
+
+    async def _acquire_sandbox(self, image: str) -> PooledContainer:
+        """A sandbox to exec into, from the pool or freshly started."""
+        if self.pool is not None:
+            return await self.pool.acquire(image)
+        container_id = await self._create_pooled_container(image)
+        return PooledContainer(image=image, container_id=container_id)
+
+    async def _release_sandbox(self, sandbox: PooledContainer, healthy: bool):
+        if self.pool is not None:
+            await self.pool.release(sandbox, healthy=healthy)
+            return
+        try:
+            await self.driver.remove(sandbox.container_id, force=True)
+        except Exception:
+            pass
+
+    async def _stream_exec(
+        self,
+        container_id: str,
+        command: list[str],
+        on_output: OutputCallback | None = None,
+        stdin: bytes | None = None,
+    ):
+        exec_id = await self.driver.exec_create(
+            container_id, command, workdir="/tmp", stdin=stdin is not None
+        )
+        output, stopped = await self._capture_output(
+            self.driver.exec_attach(exec_id, stdin), on_output
+        )
+        if stopped:
+            return await self._output_limit_result(output, on_output)
+        return {**output, "exit_code": await self.driver.exec_exit_code(exec_id)}
+
+    async def _create_pooled_container(self, image: str) -> str:
+        # Idle process keeps the sandbox alive until a run execs into it
+        return await self.driver.run(
+            image, ["tail", "-f", "/dev/null"], SANDBOX_OPTIONS
+        )
 
     def _get_image(self, language: str, version: str = None):
-        versions = AVAILABLE_IMAGES.get(language, [])
-        if not versions:
-            # Fallback or default
-            return "python:3.9-slim"
-
-        if version:
-            for v in versions:
-                if v["version"] == version:
-                    return v["image"]
-
-        # Default to first version if not specified or not found
-        return versions[0]["image"]
-
-    def _get_command(self, code: str, language: str):
-        # Escape code for shell - use base64 to avoid escaping issues
-        import base64
-
-        code_b64 = base64.b64encode(code.encode()).decode()
-
-        commands = {
-            RunLanguage.PYTHON.value: [
-                "sh",
-                "-c",
-                f"echo '{code_b64}' | base64 -d > /tmp/code.py && python /tmp/code.py",
-            ],
-            RunLanguage.JAVASCRIPT.value: [
-                "sh",
-                "-c",
-                f"echo '{code_b64}' | base64 -d > /tmp/code.js && node /tmp/code.js",
-            ],
-            RunLanguage.JAVA.value: [
-                "sh",
-                "-c",
-                f"echo '{code_b64}' | base64 -d > /tmp/Main.java && javac /tmp/Main.java && java -cp /tmp Main",
-            ],
-            RunLanguage.GO.value: [
-                "sh",
-                "-c",
-                f"echo '{code_b64}' | base64 -d > /tmp/code.go && go run /tmp/code.go",
-            ],
+        return get_image(language, version)
+
+    def _resolve_image(self, image: str) -> str:
+        """Prefer the derived runner image built by init_images, if present."""
+        derived = runner_image_name(image)
+        if self.image_registry and self.image_registry.has(derived):
+            return derived
+        return image
+
+    def _get_compile_command(self, toolchain: dict, files: list[dict] | None):
+        command = list(toolchain["compile"])
+        suffix = toolchain.get("package_suffix")
+        if suffix:
+            command += [
+                f"{SOURCE_DIR}/{f['name']}"
+                for f in files or ()
+                if "/" not in f["name"]
+                and f["name"].endswith(suffix)
+                and f["name"] != toolchain["source"]
+            ]
+        return command
+
+    def _get_run_command(self, toolchain: dict, build_dir: str) -> list[str]:
+        return [part.replace("{build}", build_dir) for part in toolchain["run"]]
+
+    async def _execute_batch(
+        self,
+        code: str,
+        language: str,
+        version: str,
+        cases: list[dict],
+        case_timeout: float,
+        files: list[dict] | None = None,
+    ):
+        toolchain = TOOLCHAINS.get(language)
+        if toolchain is None:
+            return self._batch_error(f"Batch runs are not supported for {language}")
+
+        image = self._get_image(language, version)
+        if self.image_registry and not self.image_registry.is_present(image):
+            return self._batch_error(f"Image for {language} not found")
+        image = self._resolve_image(image)
+
+        started = time.monotonic()
+        try:
+            sandbox = await self._acquire_sandbox(image)
+        except Exception as e:
+            return self._batch_error(f"System error: {str(e)}")
+        start_latency = time.monotonic() - started
+        container_id = sandbox.container_id
+        # Only a batch that ran to the end leaves a sandbox fit for reuse,
+        # a cancelled one still has the current case running in it
+        healthy = False
+        results = []
+        sampler = UsageSampler(self.driver, container_id)
+        try:
+            await sampler.start(baseline=self.pool is not None)
+            build, build_dir = await self._build(
+                container_id,
+                code,
+                language,
+                image,
+                timeout=settings.CODE_RUNNER_COMPILE_TIMEOUT,
+                files=files,
+            )
+            if build["exit_code"] == 0:
+                for case in cases:
+                    result = await self._run_step(
+                        container_id,
+                        [
+                            *self._get_run_command(toolchain, build_dir),
+                            *(case.get("args") or []),
+                        ],
+                        case_timeout,
+                        stdin=(case.get("stdin") or "").encode(),
+                    )
+                    results.append(result)
+                    if result["exit_code"] == -1:
+                        # A case stopped on timeout or output limit is still
+                        # running, kill it before the next case starts
+                        await self.driver.kill_processes(container_id)
+            healthy = all(step["exit_code"] != -1 for step in [build, *results])
+        except Exception as e:
+            build = self._batch_error(f"System error: {str(e)}")["compile"]
+        finally:
+            usage = await sampler.stop()
+            await self._release_sandbox(sandbox, healthy)
+
+        if self.concurrency is not None:
+            timed_out = build["timed_out"] or any(r["timed_out"] for r in results)
+            self.concurrency.record(start_latency, timed_out)
+        return {"compile": build, "cases": results, "usage": usage}
+
+    async def _run_step(
+        self,
+        container_id: str,
+        command: list[str],
+        timeout: float | None,
+        on_output: OutputCallback | None = None,
+        stdin: bytes | None = None,
+    ):
+        started = time.monotonic()
+        timed_out = False
+        try:
+            result = await asyncio.wait_for(
+                self._stream_exec(container_id, command, on_output, stdin),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            timed_out = True
+            result = await self._error_result("Timeout exceeded", on_output)
+        return {
+            **result,
+            "timed_out": timed_out,
+            "wall_time": round(time.monotonic() - started, 6),
+        }
+
+    @staticmethod
+    def _passed_step(wall_time: float) -> dict:
+        return {
+            "stdout": "",
+            "stderr": "",
+            "exit_code": 0,
+            "truncated": False,
+            "timed_out": False,
+            "wall_time": round(wall_time, 6),
         }
 
-        return commands.get(language, ["sh", "-c", f"echo '{code_b64}' | base64 -d"])
+    def _batch_error(self, message: str) -> dict:
+        return {
+            "compile": {
+                "stdout": "",
+                "stderr": message,
+                "exit_code": -1,
+                "truncated": False,
+                "timed_out": False,
+                "wall_time": 0.0,
+            },
+            "cases": [],
+            "usage": None,
+        }
 
-    async def _wait_for_container(self, container):
-        # Use run_in_executor to not block event loop
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, container.wait)
+    async def _capture_output(
+        self,
+        frames: AsyncIterator[tuple[int, bytes]],
+        on_output: OutputCallback | None = None,
+    ) -> tuple[dict, bool]:
+        """Read output frames within the per-stream byte budgets.
 
-        # Splitting stdout and stderr in docker SDK is not always trivial through logs(),
-        # if demux=True is not supported, we get a merged output
+        Returns the captured output and whether reading stopped early because
+        a budget was exceeded and CODE_RUNNER_KILL_ON_OUTPUT_LIMIT is set.
+        """
+        budgets = {
+            "stdout": settings.CODE_RUNNER_MAX_STDOUT_BYTES,
+            "stderr": settings.CODE_RUNNER_MAX_STDERR_BYTES,
+        }
+        # Incremental decoders keep multi-byte characters split across frames intact
+        decoders = {
+            name: codecs.getincrementaldecoder("utf-8")(errors="replace")
+            for name in budgets
+        }
+        captured = {name: [] for name in budgets}
+        truncated = False
+        stopped = False
 
-        logs = await loop.run_in_executor(
-            None,
-            lambda: container.logs(stdout=True, stderr=True, stream=False),
-        )
+        async def emit(name: str, text: str):
+            if text:
+                captured[name].append(text)
+                if on_output is not None:
+                    await on_output(name, text)
 
-        stdout = logs.decode("utf-8") if logs else ""
-        stderr = ""  # We can't split without demux
+        async with aclosing(frames):
+            async for stream_type, chunk in frames:
+                name = "stderr" if stream_type == STDERR else "stdout"
+                if len(chunk) > budgets[name]:
+                    chunk = chunk[: budgets[name]]
+                    truncated = True
+                budgets[name] -= len(chunk)
+                await emit(name, decoders[name].decode(chunk))
+
+                if truncated and settings.CODE_RUNNER_KILL_ON_OUTPUT_LIMIT:
+                    stopped = True
+                    break
+
+        for name, decoder in decoders.items():
+            await emit(name, decoder.decode(b"", final=True))
+
+        output = {name: "".join(chunks) for name, chunks in captured.items()}
+        return {**output, "truncated": truncated}, stopped
+
+    async def _output_limit_result(
+        self, output: dict, on_output: OutputCallback | None
+    ):
+        message = (
+            "\nOutput limit exceeded" if output["stderr"] else "Output limit exceeded"
+        )
+        if on_output is not None:
+            await on_output("stderr", message)
+        return {**output, "stderr": output["stderr"] + message, "exit_code": -1}
 
-        return {"stdout": stdout, "stderr": stderr, "exit_code": result["StatusCode"]}
+    async def _error_result(self, message: str, on_output: OutputCallback | None):
+        if on_output is not None:
+            await on_output("stderr", message)
+        return {"stdout": "", "stderr": message, "exit_code": -1, "truncated": False}
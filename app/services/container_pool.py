@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from app.metrics import metrics
+from app.services.docker_driver import DockerDriver
+
+logger = logging.getLogger(__name__)
+
+# Everything a sandbox can write to: its tmpfs mounts and /dev/shm, which
+# Docker mounts writable even on a read-only root filesystem
+WRITABLE_DIRS = ["/tmp", "/root/.cache", "/root/.config", "/dev/shm"]
+
+# Kills everything except PID 1 and wipes writable mounts between runs, so a
+# recycled container does not leak files or background processes to the next run.
+RECYCLE_COMMAND = [
+    "sh",
+    "-c",
+    "kill -9 -1 2>/dev/null; "
+    f"find {' '.join(WRITABLE_DIRS)} -mindepth 1 -delete 2>/dev/null; true",
+]
+
+
+@dataclass
+class PooledContainer:
+    image: str
+    container_id: str
+    created_at: float = field(default_factory=time.monotonic)
+    uses: int = 0
+
+
+class ContainerPool:
+    """Keeps pre-started idle sandboxes per image so runs can exec into them."""
+
+    def __init__(
+        self,
+        driver: DockerDriver,
+        create_container: Callable[[str], Awaitable[str]],
+        min_size: int = 1,
+        max_size: int = 3,
+        ttl: float = 300,
+        max_uses: int = 10,
+        maintenance_interval: float = 5,
+    ):
+        self.driver = driver
+        self._create_container = create_container
+        self.min_size = min_size
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_uses = max_uses
+        self.maintenance_interval = maintenance_interval
+
+        self._images: list[str] = []
+        self._idle: dict[str, deque[PooledContainer]] = defaultdict(deque)
+        self._pending: dict[str, int] = defaultdict(int)
+        self._maintenance_task: asyncio.Task | None = None
+        self._background: set[asyncio.Task] = set()
+        self._closed = False
+
+    async def start(self, images: list[str]):
+        self._images = list(dict.fromkeys(images))
+        await asyncio.gather(
+            *(self._replenish(image) for image in self._images),
+            return_exceptions=True,
+        )
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    async def acquire(self, image: str) -> PooledContainer:
+        idle = self._idle[image]
+        while idle:
+            pooled = idle.popleft()
+            if self._is_expired(pooled):
+                self._spawn(self._remove(pooled))
+                continue
+            metrics.inc("code_runner_pool_hits_total", image=image)
+            self._spawn(self._replenish(image))
+            return pooled
+
+        metrics.inc("code_runner_pool_misses_total", image=image)
+        self._spawn(self._replenish(image))
+        return await self._create(image)
+
+    async def release(self, pooled: PooledContainer, healthy: bool = True):
+        pooled.uses += 1
+        idle = self._idle[pooled.image]
+
+        if (
+            self._closed
+            or not healthy
+            or pooled.uses >= self.max_uses
+            or self._is_expired(pooled)
+            or len(idle) >= self.max_size
+        ):
+            await self._remove(pooled)
+            return
+
+        try:
+            await self.driver.exec_run(pooled.container_id, RECYCLE_COMMAND)
+        except Exception as e:
+            logger.warning(f"Failed to recycle container for {pooled.image}: {e}")
+            await self._remove(pooled)
+            return
+
+        idle.append(pooled)
+        metrics.inc("code_runner_pool_recycled_total", image=pooled.image)
+
+    def stats(self) -> dict:
+        return {
+            image: {
+                "idle": len(self._idle[image]),
+                "hits": metrics.get("code_runner_pool_hits_total", image=image),
+                "misses": metrics.get("code_runner_pool_misses_total", image=image),
+            }
+            for image in self._images
+        }
+
+    async def close(self):
+        self._closed = True
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(
+            *self._background,
+            *([self._maintenance_task] if self._maintenance_task else []),
+            return_exceptions=True,
+        )
+
+        pooled_containers = [p for idle in self._idle.values() for p in idle]
+        self._idle.clear()
+        await asyncio.gather(
+            *(self._remove(p) for p in pooled_containers), return_exceptions=True
+        )
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(self.maintenance_interval)
+            for image in self._images:
+                idle = self._idle[image]
+                for pooled in [p for p in idle if self._is_expired(p)]:
+                    idle.remove(pooled)
+                    await self._remove(pooled)
+                try:
+                    await self._replenish(image)
+                except Exception as e:
+                    logger.warning(f"Failed to replenish pool for {image}: {e}")
+                metrics.set("code_runner_pool_idle", len(idle), image=image)
+
+    async def _replenish(self, image: str):
+        missing = self.min_size - len(self._idle[image]) - self._pending[image]
+        if missing <= 0 or self._closed:
+            return
+
+        self._pending[image] += missing
+        try:
+            results = await asyncio.gather(
+                *(self._create(image) for _ in range(missing)),
+                return_exceptions=True,
+            )
+        finally:
+            self._pending[image] -= missing
+
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.warning(f"Failed to start pooled container {image}: {result}")
+            elif self._closed:
+                await self._remove(result)
+            else:
+                self._idle[image].append(result)
+
+    async def _create(self, image: str) -> PooledContainer:
+        container_id = await self._create_container(image)
+        metrics.inc("code_runner_pool_created_total", image=image)
+        return PooledContainer(image=image, container_id=container_id)
+
+    async def _remove(self, pooled: PooledContainer):
+        try:
+            await self.driver.remove(pooled.container_id, force=True)
+        except Exception:
+            pass
+        metrics.inc("code_runner_pool_removed_total", image=pooled.image)
+
+    def _is_expired(self, pooled: PooledContainer) -> bool:
+        return time.monotonic() - pooled.created_at >= self.ttl
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
@@ -0,0 +1,599 @@
+import asyncio
+import json
+import re
+import socket
+import struct
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+
+import aiohttp
+import docker
+from docker.utils.socket import frames_iter
+
+from app.errors.code_runner import DockerDriverError, ImageNotFoundError
+
+STDOUT = 1
+STDERR = 2
+# Seconds between exec inspects while waiting for its exit code
+EXEC_POLL_INTERVAL = 0.05
+
+_UNITS = {"b": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+def parse_bytes(value) -> int:
+    if isinstance(value, int):
+        return value
+    match = re.fullmatch(r"(\d+)([bkmg]?)b?", str(value).strip().lower())
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    number, unit = match.groups()
+    return int(number) * _UNITS[unit or "b"]
+
+
+def to_host_config(options: dict) -> dict:
+    """Translate docker-py style run() kwargs into an Engine API HostConfig."""
+    host_config = {}
+    if "mem_limit" in options:
+        host_config["Memory"] = parse_bytes(options["mem_limit"])
+    if "cpu_period" in options:
+        host_config["CpuPeriod"] = options["cpu_period"]
+    if "cpu_quota" in options:
+        host_config["CpuQuota"] = options["cpu_quota"]
+    if "network_mode" in options:
+        host_config["NetworkMode"] = options["network_mode"]
+    if "read_only" in options:
+        host_config["ReadonlyRootfs"] = options["read_only"]
+    if "tmpfs" in options:
+        host_config["Tmpfs"] = options["tmpfs"]
+    if "cap_drop" in options:
+        host_config["CapDrop"] = options["cap_drop"]
+    if "security_opt" in options:
+        host_config["SecurityOpt"] = options["security_opt"]
+    if "pids_limit" in options:
+        host_config["PidsLimit"] = options["pids_limit"]
+    if "binds" in options:
+        host_config["Binds"] = options["binds"]
+    if "volumes" in options:
+        # docker-py accepts "volume:/path:mode" strings as binds
+        host_config["Binds"] = host_config.get("Binds", []) + list(options["volumes"])
+    return host_config
+
+
+def split_image(image: str) -> tuple[str, str]:
+    name, _, tag = image.rpartition(":")
+    if not name or "/" in tag:
+        return image, "latest"
+    return name, tag
+
+
+async def collect_frames(frames) -> tuple[bytes, bytes]:
+    stdout, stderr = bytearray(), bytearray()
+    async for stream_type, chunk in frames:
+        (stderr if stream_type == STDERR else stdout).extend(chunk)
+    return bytes(stdout), bytes(stderr)
+
+
+class DockerDriver(ABC):
+    """Container operations used by the code runner, all awaitable."""
+
+    # Sandboxes can be recycled by the container pool between runs
+    supports_pool = True
+
+    @abstractmethod
+    async def create(self, image: str, command: list[str], options: dict) -> str:
+        pass
+
+    @abstractmethod
+    async def start(self, container_id: str):
+        pass
+
+    async def run(self, image: str, command: list[str], options: dict) -> str:
+        container_id = await self.create(image, command, options)
+        try:
+            await self.start(container_id)
+        except Exception:
+            await self.remove(container_id)
+            raise
+        return container_id
+
+    @abstractmethod
+    def attach(self, container_id: str) -> AsyncIterator[tuple[int, bytes]]:
+        """Yield (stream, chunk) pairs, stream being STDOUT or STDERR."""
+
+    @abstractmethod
+    async def wait(self, container_id: str) -> int:
+        pass
+
+    @abstractmethod
+    async def logs(self, container_id: str) -> tuple[bytes, bytes]:
+        pass
+
+    @abstractmethod
+    async def stats(self, container_id: str) -> dict:
+        pass
+
+    @abstractmethod
+    async def kill(self, container_id: str):
+        pass
+
+    @abstractmethod
+    async def remove(self, container_id: str, force: bool = True):
+        pass
+
+    @abstractmethod
+    async def exec_create(
+        self,
+        container_id: str,
+        command: list[str],
+        workdir: str | None = None,
+        stdin: bool = False,
+    ) -> str:
+        pass
+
+    @abstractmethod
+    def exec_attach(
+        self, exec_id: str, stdin: bytes | None = None
+    ) -> AsyncIterator[tuple[int, bytes]]:
+        """Start the exec and yield its (stream, chunk) pairs until it exits.
+
+        stdin, if given, is written to the process and then closed, the exec
+        must have been created with stdin=True.
+        """
+
+    @abstractmethod
+    async def exec_exit_code(self, exec_id: str) -> int:
+        pass
+
+    async def exec_run(
+        self,
+        container_id: str,
+        command: list[str],
+        workdir: str | None = None,
+        stdin: bytes | None = None,
+    ) -> tuple[int, bytes, bytes]:
+        exec_id = await self.exec_create(
+            container_id, command, workdir, stdin=stdin is not None
+        )
+        stdout, stderr = await collect_frames(self.exec_attach(exec_id, stdin))
+        return await self.exec_exit_code(exec_id), stdout, stderr
+
+    async def kill_processes(self, container_id: str):
+        """Kill everything running in the container except its idle PID 1."""
+        await self.exec_run(container_id, ["sh", "-c", "kill -9 -1 2>/dev/null; true"])
+
+    async def put_archive(self, container_id: str, path: str, data: bytes):
+        """Extract a tar archive into path inside a running container.
+
+        The Engine archive endpoint writes below the container's root
+        filesystem, which is read-only in sandboxes and hidden under their
+        tmpfs mounts, so the archive is streamed into tar over exec stdin.
+        """
+        exit_code, _, stderr = await self.exec_run(
+            container_id, ["tar", "-x", "-C", path, "-f", "-"], stdin=data
+        )
+        if exit_code != 0:
+            message = stderr.decode("utf-8", errors="replace").strip()
+            raise DockerDriverError(f"put_archive {container_id}: {message}")
+
+    @abstractmethod
+    async def list_image_tags(self) -> set[str]:
+        pass
+
+    @abstractmethod
+    async def pull(self, image: str):
+        pass
+
+    @abstractmethod
+    async def daemon_id(self) -> str:
+        pass
+
+    @abstractmethod
+    async def image_id(self, image: str) -> str:
+        pass
+
+    async def close(self):
+        pass
+
+
+class AsyncDockerDriver(DockerDriver):
+    """Talks to the Docker Engine API over the unix socket with aiohttp."""
+
+    def __init__(self, socket_path: str = "/var/run/docker.sock"):
+        self.socket_path = socket_path
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(path=self.socket_path),
+                base_url="http://docker",
+                timeout=aiohttp.ClientTimeout(total=None),
+            )
+        return self._session
+
+    async def _request(self, method: str, path: str, ok=(200, 201, 204), **kwargs):
+        async with self.session.request(method, path, **kwargs) as response:
+            body = await response.read()
+            if response.status not in ok:
+                message = body.decode("utf-8", errors="replace")
+                try:
+                    message = json.loads(message).get("message", message)
+                except ValueError:
+                    pass
+                if response.status == 404 and "image" in message.lower():
+                    raise ImageNotFoundError(message)
+                raise DockerDriverError(f"{method} {path}: {response.status} {message}")
+            return json.loads(body) if body else None
+
+    async def create(self, image: str, command: list[str], options: dict) -> str:
+        config = {
+            "Image": image,
+            "Cmd": command,
+            "WorkingDir": options.get("working_dir", ""),
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": False,
+            "HostConfig": to_host_config(options),
+        }
+        response = await self._request("POST", "/containers/create", json=config)
+        return response["Id"]
+
+    async def start(self, container_id: str):
+        await self._request("POST", f"/containers/{container_id}/start", ok=(204, 304))
+
+    async def attach(self, container_id: str) -> AsyncIterator[tuple[int, bytes]]:
+        # logs=1 replays output written before the attach, so it can follow start()
+        async with self.session.post(
+            f"/containers/{container_id}/attach",
+            params={"stream": "1", "logs": "1", "stdout": "1", "stderr": "1"},
+        ) as response:
+            if response.status != 200:
+                raise DockerDriverError(f"attach {container_id}: {response.status}")
+            async for frame in self._read_frames(response.content):
+                yield frame
+
+    async def wait(self, container_id: str) -> int:
+        response = await self._request("POST", f"/containers/{container_id}/wait")
+        return response["StatusCode"]
+
+    async def logs(self, container_id: str) -> tuple[bytes, bytes]:
+        async with self.session.get(
+            f"/containers/{container_id}/logs",
+            params={"stdout": "1", "stderr": "1"},
+        ) as response:
+            if response.status != 200:
+                raise DockerDriverError(f"logs {container_id}: {response.status}")
+            return await collect_frames(self._read_frames(response.content))
+
+    async def stats(self, container_id: str) -> dict:
+        return await self._request(
+            "GET",
+            f"/containers/{container_id}/stats",
+            params={"stream": "false", "one-shot": "true"},
+        )
+
+    async def kill(self, container_id: str):
+        # 409 means the container is not running anymore
+        await self._request(
+            "POST", f"/containers/{container_id}/kill", ok=(204, 404, 409)
+        )
+
+    async def remove(self, container_id: str, force: bool = True):
+        await self._request(
+            "DELETE",
+            f"/containers/{container_id}",
+            params={"force": "1" if force else "0"},
+            ok=(204, 404, 409),
+        )
+
+    async def exec_create(
+        self,
+        container_id: str,
+        command: list[str],
+        workdir: str | None = None,
+        stdin: bool = False,
+    ) -> str:
+        config = {
+            "Cmd": command,
+            "AttachStdin": stdin,
+            "AttachStdout": True,
+            "AttachStderr": True,
+        }
+        if workdir:
+            config["WorkingDir"] = workdir
+        response = await self._request(
+            "POST", f"/containers/{container_id}/exec", json=config
+        )
+        return response["Id"]
+
+    async def exec_attach(
+        self, exec_id: str, stdin: bytes | None = None
+    ) -> AsyncIterator[tuple[int, bytes]]:
+        if stdin is not None:
+            async for frame in self._exec_with_stdin(exec_id, stdin):
+                yield frame
+            return
+        async with self.session.post(
+            f"/exec/{exec_id}/start", json={"Detach": False, "Tty": False}
+        ) as response:
+            if response.status != 200:
+                raise DockerDriverError(f"exec {exec_id}: {response.status}")
+            async for frame in self._read_frames(response.content):
+                yield frame
+
+    async def _exec_with_stdin(
+        self, exec_id: str, stdin: bytes
+    ) -> AsyncIterator[tuple[int, bytes]]:
+        """Start the exec on a connection of its own, hijacked into a raw stream.
+
+        aiohttp reads a 101 response as having no body, so the request is
+        written by hand and the stream read straight from the socket.
+        """
+        body = json.dumps({"Detach": False, "Tty": False}).encode()
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            writer.write(
+                f"POST /exec/{exec_id}/start HTTP/1.1\r\n"
+                f"Host: docker\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: Upgrade\r\n"
+                f"Upgrade: tcp\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+            if status not in (101, 200):
+                raise DockerDriverError(f"exec {exec_id}: {status}")
+            writer.write(stdin)
+            await writer.drain()
+            # Half-close, so the process reads EOF while its output still flows
+            writer.write_eof()
+            async for frame in self._read_frames(reader):
+                yield frame
+        finally:
+            writer.close()
+
+    async def exec_exit_code(self, exec_id: str) -> int:
+        # The stream can end just before Docker records the exit
+        while True:
+            response = await self._request("GET", f"/exec/{exec_id}/json")
+            if not response.get("Running"):
+                return response["ExitCode"]
+            await asyncio.sleep(EXEC_POLL_INTERVAL)
+
+    async def daemon_id(self) -> str:
+        info = await self._request("GET", "/info")
+        return info["ID"]
+
+    async def image_id(self, image: str) -> str:
+        info = await self._request("GET", f"/images/{image}/json")
+        return info["Id"]
+
+    async def list_image_tags(self) -> set[str]:
+        images = await self._request("GET", "/images/json")
+        return {tag for image in images for tag in image.get("RepoTags") or []}
+
+    async def pull(self, image: str):
+        name, tag = split_image(image)
+        async with self.session.post(
+            "/images/create", params={"fromImage": name, "tag": tag}
+        ) as response:
+            if response.status != 200:
+                raise DockerDriverError(f"pull {image}: {response.status}")
+            # Progress is streamed until the pull is done
+            async for line in response.content:
+                if b'"error"' in line:
+                    raise DockerDriverError(json.loads(line).get("error"))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    @staticmethod
+    async def _read_frames(stream) -> AsyncIterator[tuple[int, bytes]]:
+        """Demultiplex the Engine API stdout/stderr stream (8 byte headers)."""
+        while True:
+            try:
+                header = await stream.readexactly(8)
+            except asyncio.IncompleteReadError:
+                return
+            stream_type, size = struct.unpack(">BxxxL", header)
+            yield stream_type, await stream.readexactly(size)
+
+
+class DockerPyDriver(DockerDriver):
+    """Fallback driver running blocking docker-py calls in the default executor."""
+
+    def __init__(self, client=None):
+        self.client = client or docker.from_env()
+        self._containers = {}
+
+    @staticmethod
+    async def _call(func):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func)
+
+    async def create(self, image: str, command: list[str], options: dict) -> str:
+        try:
+            container = await self._call(
+                lambda: self.client.containers.create(
+                    image=image, command=command, **options
+                )
+            )
+        except docker.errors.ImageNotFound as e:
+            raise ImageNotFoundError(str(e))
+        self._containers[container.id] = container
+        return container.id
+
+    async def start(self, container_id: str):
+        await self._call(self._containers[container_id].start)
+
+    async def run(self, image: str, command: list[str], options: dict) -> str:
+        try:
+            container = await self._call(
+                lambda: self.client.containers.run(
+                    image=image,
+                    command=command,
+                    **options,
+                    stdout=True,
+                    stderr=True,
+                    detach=True,
+                )
+            )
+        except docker.errors.ImageNotFound as e:
+            raise ImageNotFoundError(str(e))
+        self._containers[container.id] = container
+        return container.id
+
+    async def attach(self, container_id: str) -> AsyncIterator[tuple[int, bytes]]:
+        container = self._containers[container_id]
+        frames = await self._call(
+            lambda: container.attach(stream=True, logs=True, demux=True)
+        )
+        async for frame in self._iter_demuxed(frames):
+            yield frame
+
+    async def wait(self, container_id: str) -> int:
+        result = await self._call(self._containers[container_id].wait)
+        return result["StatusCode"]
+
+    async def logs(self, container_id: str) -> tuple[bytes, bytes]:
+        # container.logs() has no demux, so the fallback returns merged output
+        logs = await self._call(
+            lambda: self._containers[container_id].logs(
+                stdout=True, stderr=True, stream=False
+            )
+        )
+        return logs or b"", b""
+
+    async def stats(self, container_id: str) -> dict:
+        return await self._call(
+            lambda: self.client.api.stats(container_id, stream=False, one_shot=True)
+        )
+
+    async def kill(self, container_id: str):
+        try:
+            await self._call(self._containers[container_id].kill)
+        except Exception:
+            pass
+
+    async def remove(self, container_id: str, force: bool = True):
+        container = self._containers.pop(container_id, None)
+        if container is None:
+            return
+        try:
+            await self._call(lambda: container.remove(force=force))
+        except docker.errors.NotFound:
+            pass
+
+    async def exec_run(
+        self,
+        container_id: str,
+        command: list[str],
+        workdir: str | None = None,
+        stdin: bytes | None = None,
+    ) -> tuple[int, bytes, bytes]:
+        if stdin is not None:
+            # container.exec_run() cannot write to stdin
+            return await super().exec_run(container_id, command, workdir, stdin)
+        result = await self._call(
+            lambda: self._containers[container_id].exec_run(
+                command, workdir=workdir, demux=True
+            )
+        )
+        stdout, stderr = result.output or (None, None)
+        return result.exit_code, stdout or b"", stderr or b""
+
+    async def exec_create(
+        self,
+        container_id: str,
+        command: list[str],
+        workdir: str | None = None,
+        stdin: bool = False,
+    ) -> str:
+        response = await self._call(
+            lambda: self.client.api.exec_create(
+                container_id, command, workdir=workdir, stdin=stdin
+            )
+        )
+        return response["Id"]
+
+    async def exec_attach(
+        self, exec_id: str, stdin: bytes | None = None
+    ) -> AsyncIterator[tuple[int, bytes]]:
+        if stdin is None:
+            frames = await self._call(
+                lambda: self.client.api.exec_start(exec_id, stream=True, demux=True)
+            )
+        else:
+            frames = await self._call(lambda: self._exec_with_stdin(exec_id, stdin))
+        async for frame in self._iter_demuxed(frames):
+            yield frame
+
+    def _exec_with_stdin(self, exec_id: str, stdin: bytes):
+        sock = self.client.api.exec_start(exec_id, socket=True)
+        raw = getattr(sock, "_sock", sock)
+        raw.sendall(stdin)
+        # Half-close, so the process reads EOF while its output still flows
+        raw.shutdown(socket.SHUT_WR)
+
+        def demuxed():
+            try:
+                for stream_type, chunk in frames_iter(sock, tty=False):
+                    yield (None, chunk) if stream_type == STDERR else (chunk, None)
+            finally:
+                sock.close()
+
+        return demuxed()
+
+    async def exec_exit_code(self, exec_id: str) -> int:
+        while True:
+            response = await self._call(lambda: self.client.api.exec_inspect(exec_id))
+            if not response.get("Running"):
+                return response["ExitCode"]
+            await asyncio.sleep(EXEC_POLL_INTERVAL)
+
+    async def daemon_id(self) -> str:
+        info = await self._call(self.client.info)
+        return info["ID"]
+
+    async def image_id(self, image: str) -> str:
+        try:
+            return (await self._call(lambda: self.client.images.get(image))).id
+        except docker.errors.ImageNotFound as e:
+            raise ImageNotFoundError(str(e))
+
+    async def list_image_tags(self) -> set[str]:
+        images = await self._call(self.client.images.list)
+        return {tag for image in images for tag in image.tags}
+
+    async def pull(self, image: str):
+        await self._call(lambda: self.client.images.pull(image))
+
+    async def close(self):
+        await self._call(self.client.close)
+
+    async def _iter_demuxed(self, frames) -> AsyncIterator[tuple[int, bytes]]:
+        # Each next() blocks on the socket, so it runs in the executor too
+        sentinel = object()
+        while True:
+            frame = await self._call(lambda: next(frames, sentinel))
+            if frame is sentinel:
+                return
+            stdout, stderr = frame
+            if stdout:
+                yield STDOUT, stdout
+            if stderr:
+                yield STDERR, stderr
+
+
+def create_driver(name: str, socket_path: str) -> DockerDriver:
+    if name == "local":
+        from app.services.local_driver import LocalProcessDriver
+
+        return LocalProcessDriver()
+    if name == "docker-py":
+        return DockerPyDriver()
+    return AsyncDockerDriver(socket_path)
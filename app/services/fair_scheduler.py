@@ -0,0 +1,96 @@
+from collections import defaultdict, deque
+from typing import Any
+
+
+def parse_weights(value: str) -> dict[str, float]:
+    """Parse ``"user:1=2,ip:10.0.0.1=0.5"`` into a weight per scheduling key."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        key, _, weight = item.rpartition("=")
+        weights[key.strip()] = float(weight)
+        if weights[key.strip()] <= 0:
+            raise ValueError(f"Scheduling weight must be positive: {item}")
+    return weights
+
+
+class FairScheduler:
+    """Deficit round robin over per-user sub-queues.
+
+    Every run costs one unit. A user with weight 2 gets two runs for each run
+    of a user with weight 1 while both have work queued, and nobody gets more
+    than ``max_in_flight_per_user`` runs executing at once.
+    """
+
+    def __init__(
+        self,
+        max_in_flight_per_user: int = 2,
+        weights: dict[str, float] | None = None,
+        default_weight: float = 1,
+    ):
+        self.max_in_flight_per_user = max_in_flight_per_user
+        self.weights = weights or {}
+        self.default_weight = default_weight
+
+        self._queues: dict[str, deque] = defaultdict(deque)
+        self._deficits: dict[str, float] = defaultdict(float)
+        self._in_flight: dict[str, int] = defaultdict(int)
+        # Users with queued work, in round robin order
+        self._active: deque[str] = deque()
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, user: str, item: Any):
+        if not self._queues[user]:
+            self._active.append(user)
+        self._queues[user].append(item)
+
+    def next(self) -> tuple[str, Any] | None:
+        """Pick the next run to start, or None if every user is at their cap."""
+        capped = 0
+        while self._active and capped < len(self._active):
+            user = self._active[0]
+            if self._in_flight[user] >= self.max_in_flight_per_user:
+                capped += 1
+                self._active.rotate(-1)
+                continue
+
+            if self._deficits[user] < 1:
+                self._deficits[user] += self.weights.get(user, self.default_weight)
+                if self._deficits[user] < 1:
+                    self._active.rotate(-1)
+                    continue
+
+            item = self._queues[user].popleft()
+            self._deficits[user] -= 1
+            self._in_flight[user] += 1
+            if not self._queues[user]:
+                # Idle users don't bank credit for later bursts
+                self._active.popleft()
+                del self._queues[user]
+                self._deficits.pop(user, None)
+            elif self._deficits[user] < 1:
+                self._active.rotate(-1)
+            return user, item
+
+        return None
+
+    def done(self, user: str):
+        self._in_flight[user] -= 1
+        if self._in_flight[user] <= 0:
+            del self._in_flight[user]
+
+    def drain(self) -> list[Any]:
+        """Remove and return every queued item."""
+        items = [item for queue in self._queues.values() for item in queue]
+        self._queues.clear()
+        self._deficits.clear()
+        self._active.clear()
+        return items
+
+    def in_flight(self, user: str) -> int:
+        return self._in_flight.get(user, 0)
+
+    def queued(self, user: str) -> int:
+        queue = self._queues.get(user)
+        return len(queue) if queue else 0
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import redis.asyncio as redis
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Expired leases are purged first, so a crashed worker's slots come back after
+# lease_ttl. Redis TIME is used so replicas with skewed clocks agree on expiry.
+ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now_ms)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now_ms + tonumber(ARGV[2]), ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RENEW_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+if redis.call('ZSCORE', KEYS[1], ARGV[2]) then
+    redis.call('ZADD', KEYS[1], now_ms + tonumber(ARGV[1]), ARGV[2])
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+def slots_key(host_id: str) -> str:
+    return f"code_runner:slots:{host_id}"
+
+
+class HostSlots:
+    """Redis-backed counting semaphore shared by every worker of a Docker host.
+
+    Each holder owns a lease in a sorted set scored by its expiry time. Leases
+    are renewed while a run is in progress and expire on their own if the
+    worker holding them dies.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        host_id: str,
+        limit: int,
+        lease_ttl: float = 30,
+        retry_interval: float = 0.1,
+    ):
+        self.redis = redis_client
+        self.key = slots_key(host_id)
+        self.limit = limit
+        self.lease_ttl = lease_ttl
+        self.retry_interval = retry_interval
+        self._acquire_script = redis_client.register_script(ACQUIRE_SCRIPT)
+        self._renew_script = redis_client.register_script(RENEW_SCRIPT)
+
+    async def try_acquire(self, token: str) -> bool:
+        acquired = await self._acquire_script(
+            keys=[self.key], args=[self.limit, self._lease_ms, token]
+        )
+        return bool(acquired)
+
+    async def acquire(self) -> str:
+        """Wait for a free slot and return the token of its lease."""
+        token = str(uuid.uuid4())
+        started = time.monotonic()
+        while not await self.try_acquire(token):
+            # Jitter keeps waiting workers from polling Redis in lockstep
+            await asyncio.sleep(self.retry_interval * random.uniform(0.5, 1.5))
+        metrics.inc("code_runner_slot_wait_seconds_total", time.monotonic() - started)
+        return token
+
+    async def renew(self, token: str) -> bool:
+        return bool(
+            await self._renew_script(keys=[self.key], args=[self._lease_ms, token])
+        )
+
+    async def release(self, token: str):
+        await self.redis.zrem(self.key, token)
+
+    @asynccontextmanager
+    async def hold(self):
+        token = await self.acquire()
+        renewer = asyncio.create_task(self._renew_forever(token))
+        try:
+            yield token
+        finally:
+            renewer.cancel()
+            await asyncio.gather(renewer, return_exceptions=True)
+            try:
+                await self.release(token)
+            except Exception as e:
+                # The lease expires on its own
+                logger.warning(f"Failed to release slot {token}: {e}")
+
+    async def _renew_forever(self, token: str):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                if not await self.renew(token):
+                    metrics.inc("code_runner_slot_leases_lost_total")
+                    logger.warning(f"Slot lease {token} expired while running")
+                    return
+            except Exception as e:
+                logger.warning(f"Failed to renew slot lease {token}: {e}")
+
+    @property
+    def _lease_ms(self) -> int:
+        return int(self.lease_ttl * 1000)
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ImageRegistry:
+    """Tracks which runner images are present on the Docker host.
+
+    The set is filled once at worker startup and refreshed by a background
+    task, so code runs only do an in-memory lookup instead of a registry pull.
+    Missing images are pulled in the order of ``images``, at most
+    ``max_concurrent_pulls`` at a time.
+    """
+
+    def __init__(
+        self,
+        list_present: Callable[[], Awaitable[Iterable[str]]],
+        pull: Callable[[str], Awaitable[None]],
+        images: list[str],
+        refresh_interval: float = 300,
+        max_concurrent_pulls: int = 3,
+    ):
+        self._list_present = list_present
+        self._pull = pull
+        self.images = list(dict.fromkeys(images))
+        self.refresh_interval = refresh_interval
+
+        self._present: set[str] = set()
+        self._pulling: dict[str, asyncio.Task] = {}
+        self._pull_slots = asyncio.Semaphore(max_concurrent_pulls)
+        self._refresh_task: asyncio.Task | None = None
+
+    def fill(self, images: Iterable[str]):
+        self._present = set(images)
+        metrics.set("code_runner_images_present", len(self._present))
+
+    def has(self, image: str) -> bool:
+        """Like is_present, without pulling a missing image."""
+        return image in self._present
+
+    def is_present(self, image: str) -> bool:
+        if image in self._present:
+            return True
+
+        metrics.inc("code_runner_image_misses_total", image=image)
+        self.schedule_pull(image)
+        return False
+
+    def status(self) -> dict[str, str]:
+        """State of every tracked image: present, pulling or missing."""
+        return {
+            image: (
+                "present"
+                if image in self._present
+                else "pulling" if image in self._pulling else "missing"
+            )
+            for image in self.images
+        }
+
+    def schedule_pull(self, image: str):
+        if image in self._pulling:
+            return
+        task = asyncio.create_task(self._pull_image(image))
+        self._pulling[image] = task
+        task.add_done_callback(lambda _: self._pulling.pop(image, None))
+
+    async def refresh(self):
+        present = set(await self._list_present())
+        self.fill(present)
+
+        for image in self.images:
+            if image not in present:
+                self.schedule_pull(image)
+
+    async def start(self):
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        tasks = list(self._pulling.values())
+        if self._refresh_task:
+            tasks.append(self._refresh_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Failed to refresh image registry: {e}")
+
+    async def _pull_image(self, image: str):
+        try:
+            # Waiters are woken in order, so earlier images are pulled first
+            async with self._pull_slots:
+                await self._pull(image)
+        except Exception as e:
+            metrics.inc("code_runner_image_pull_errors_total", image=image)
+            logger.warning(f"Failed to pull {image}: {e}")
+            return
+
+        self._present.add(image)
+        metrics.set("code_runner_images_present", len(self._present))
+        logger.info(f"Pulled {image} in background")
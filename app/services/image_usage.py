@@ -0,0 +1,68 @@
+import json
+import os
+import platform
+
+import redis.asyncio as redis
+
+from app.config import settings
+
+USAGE_KEY = "code_runner:image_usage"
+
+# An image counts as present if any worker has it, then pulling, then missing
+_STATE_ORDER = {"missing": 0, "pulling": 1, "present": 2}
+
+
+def status_key(worker_id: str) -> str:
+    return f"code_runner:image_status:{worker_id}"
+
+
+def worker_id() -> str:
+    return f"{platform.node()}:{os.getpid()}"
+
+
+class ImageUsage:
+    """Run counts per image, so the most used images are pulled first."""
+
+    def __init__(self, redis_client: redis.Redis):
+        self.redis = redis_client
+
+    async def record(self, image: str):
+        await self.redis.zincrby(USAGE_KEY, 1, image)
+
+    async def rank(self, images: list[str]) -> list[str]:
+        """Most used first, images never run keep their original order."""
+        scores = await self.redis.zmscore(USAGE_KEY, images)
+        position = {image: i for i, image in enumerate(images)}
+        return sorted(
+            images,
+            key=lambda image: (-(scores[position[image]] or 0), position[image]),
+        )
+
+    async def publish_status(self, worker: str, status: dict[str, str]):
+        """Report which images a worker has, expires with the worker."""
+        await self.redis.set(
+            status_key(worker),
+            json.dumps(status),
+            ex=settings.CODE_RUNNER_IMAGE_STATUS_INTERVAL * 3,
+        )
+
+    async def readiness(self) -> dict:
+        """Images across all live workers: present, pulling or missing."""
+        statuses = []
+        async for key in self.redis.scan_iter(match=status_key("*")):
+            raw = await self.redis.get(key)
+            if raw:
+                statuses.append(json.loads(raw))
+
+        images = {}
+        for status in statuses:
+            for image, state in status.items():
+                images[image] = max(
+                    images.get(image, "missing"), state, key=_STATE_ORDER.get
+                )
+        return {
+            "ready": bool(statuses)
+            and all(state == "present" for state in images.values()),
+            "workers": len(statuses),
+            "images": images,
+        }
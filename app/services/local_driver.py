@@ -0,0 +1,417 @@
+import asyncio
+import io
+import logging
+import os
+import platform
+import resource
+import shutil
+import signal
+import tarfile
+import tempfile
+import uuid
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+from app.config import settings
+from app.constants import AVAILABLE_IMAGES
+from app.errors.code_runner import DockerDriverError
+from app.services.artifact_cache import ARTIFACTS_MOUNT
+from app.services.docker_driver import STDERR, STDOUT, DockerDriver, parse_bytes
+
+logger = logging.getLogger(__name__)
+
+# New user, network, IPC and PID namespaces, the run's processes die with it
+UNSHARE_COMMAND = [
+    "unshare",
+    "--user",
+    "--net",
+    "--ipc",
+    "--pid",
+    "--fork",
+    "--kill-child",
+]
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def compilers() -> set[str]:
+    """Compile steps run without the data limit.
+
+    Compilers map far more memory than the run's limit, go build dies with
+    "out of memory" under it, and they run trusted toolchain code.
+    """
+    from app.services.code_runner import TOOLCHAINS
+
+    return {t["compile"][0] for t in TOOLCHAINS.values() if t["compile"]}
+
+
+@dataclass
+class LocalExec:
+    command: list[str]
+    workdir: str | None
+    stdin: bool
+    process: asyncio.subprocess.Process | None = None
+
+
+@dataclass
+class LocalSandbox:
+    root: str
+    options: dict
+    main: LocalExec
+    execs: list[LocalExec] = field(default_factory=list)
+    # Highest CPU seconds seen per process session, kept after it exits
+    cpu: dict[int, float] = field(default_factory=dict)
+
+
+def read_proc_stat(pid: int) -> dict | None:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # The command name is in parentheses and may itself contain spaces
+    fields = data[data.rindex(")") + 2 :].split()
+    utime, stime, cutime, cstime = (int(v) for v in fields[11:15])
+    return {
+        "session": int(fields[3]),
+        "cpu": (utime + stime + cutime + cstime) / _CLOCK_TICKS,
+        "rss": int(fields[21]) * _PAGE_SIZE,
+    }
+
+
+class LocalProcessDriver(DockerDriver):
+    """Runs sandboxes as local processes instead of Docker containers.
+
+    A sandbox is a private directory standing in for the container's /tmp.
+    Commands are executed directly with the host's language runtimes, with
+    sandbox paths rewritten to that directory, a minimal environment, rlimits
+    derived from the sandbox options and, where unprivileged user namespaces
+    are available, their own user, network, IPC and PID namespaces.
+
+    This is not a sandbox. Code runs with the worker's uid and can read and
+    write the host filesystem wherever that uid can, disk space is not
+    limited and memory only through RLIMIT_DATA. Use it where Docker is not
+    available and for benchmarking, never for untrusted code. It refuses to
+    start as root.
+    """
+
+    # Sandboxes are not recycled, the pool's cleanup assumes a container
+    supports_pool = False
+
+    def __init__(self, root: str | None = None, unshare: bool | None = None):
+        if os.geteuid() == 0:
+            raise DockerDriverError("The local backend must not run as root")
+        self.root = (
+            root
+            or settings.CODE_RUNNER_LOCAL_ROOT
+            or os.path.join(tempfile.gettempdir(), "code-runner")
+        )
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        self._unshare = (
+            settings.CODE_RUNNER_LOCAL_UNSHARE if unshare is None else unshare
+        )
+        self._namespace_prefix: list[str] | None = None
+        self._sandboxes: dict[str, LocalSandbox] = {}
+        self._execs: dict[str, tuple[str, LocalExec]] = {}
+
+    async def create(self, image: str, command: list[str], options: dict) -> str:
+        container_id = uuid.uuid4().hex
+        root = os.path.join(self.root, container_id)
+        os.mkdir(root, 0o700)
+        for directory in (".home", ".cache"):
+            os.mkdir(os.path.join(root, directory), 0o700)
+        self._sandboxes[container_id] = LocalSandbox(
+            root=root,
+            options=options,
+            main=LocalExec(command, options.get("working_dir"), stdin=False),
+        )
+        return container_id
+
+    async def start(self, container_id: str):
+        sandbox = self._get(container_id)
+        await self._spawn(sandbox, sandbox.main)
+
+    def attach(self, container_id: str) -> AsyncIterator[tuple[int, bytes]]:
+        sandbox = self._get(container_id)
+        return self._read_output(sandbox, sandbox.main)
+
+    async def wait(self, container_id: str) -> int:
+        process = self._get(container_id).main.process
+        return self._exit_code(await process.wait())
+
+    async def logs(self, container_id: str) -> tuple[bytes, bytes]:
+        # Output is not kept, it can only be read while attached
+        return b"", b""
+
+    async def stats(self, container_id: str) -> dict:
+        sandbox = self._get(container_id)
+        loop = asyncio.get_running_loop()
+        memory = await loop.run_in_executor(None, self._sample, sandbox)
+        return {
+            "cpu_stats": {
+                "cpu_usage": {"total_usage": sum(sandbox.cpu.values()) * 1e9}
+            },
+            "memory_stats": {"usage": memory},
+        }
+
+    async def kill(self, container_id: str):
+        sandbox = self._sandboxes.get(container_id)
+        if sandbox is not None:
+            for local_exec in (sandbox.main, *sandbox.execs):
+                self._kill(local_exec)
+
+    async def kill_processes(self, container_id: str):
+        for local_exec in self._get(container_id).execs:
+            self._kill(local_exec)
+
+    async def remove(self, container_id: str, force: bool = True):
+        await self.kill(container_id)
+        sandbox = self._sandboxes.pop(container_id, None)
+        if sandbox is None:
+            return
+        for exec_id in [k for k, v in self._execs.items() if v[0] == container_id]:
+            del self._execs[exec_id]
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, lambda: shutil.rmtree(sandbox.root, ignore_errors=True)
+        )
+
+    async def exec_create(
+        self,
+        container_id: str,
+        command: list[str],
+        workdir: str | None = None,
+        stdin: bool = False,
+    ) -> str:
+        sandbox = self._get(container_id)
+        local_exec = LocalExec(command, workdir, stdin)
+        sandbox.execs.append(local_exec)
+        exec_id = uuid.uuid4().hex
+        self._execs[exec_id] = (container_id, local_exec)
+        return exec_id
+
+    async def exec_attach(
+        self, exec_id: str, stdin: bytes | None = None
+    ) -> AsyncIterator[tuple[int, bytes]]:
+        container_id, local_exec = self._get_exec(exec_id)
+        sandbox = self._get(container_id)
+        process = await self._spawn(sandbox, local_exec)
+        async for frame in self._read_output(sandbox, local_exec, stdin):
+            yield frame
+        await process.wait()
+
+    async def exec_exit_code(self, exec_id: str) -> int:
+        _, local_exec = self._get_exec(exec_id)
+        return self._exit_code(await local_exec.process.wait())
+
+    async def put_archive(self, container_id: str, path: str, data: bytes):
+        target = self._translate(self._get(container_id), path)
+        loop = asyncio.get_running_loop()
+
+        def extract():
+            with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+                archive.extractall(target, filter="data")
+
+        try:
+            await loop.run_in_executor(None, extract)
+        except (tarfile.TarError, OSError) as e:
+            raise DockerDriverError(f"put_archive {container_id}: {e}")
+
+    async def list_image_tags(self) -> set[str]:
+        # The host's runtimes stand in for every image
+        return {v["image"] for versions in AVAILABLE_IMAGES.values() for v in versions}
+
+    async def pull(self, image: str):
+        pass
+
+    async def daemon_id(self) -> str:
+        return f"local:{platform.node()}"
+
+    async def image_id(self, image: str) -> str:
+        return f"local:{platform.node()}:{image}"
+
+    async def _spawn(
+        self, sandbox: LocalSandbox, local_exec: LocalExec
+    ) -> asyncio.subprocess.Process:
+        command = [self._translate(sandbox, part) for part in local_exec.command]
+        workdir = self._translate(sandbox, local_exec.workdir or "/tmp")
+        limit_memory = local_exec.command[0] not in compilers()
+        try:
+            local_exec.process = await asyncio.create_subprocess_exec(
+                *await self._namespaces(),
+                *command,
+                cwd=workdir,
+                env=self._environment(sandbox),
+                stdin=(
+                    asyncio.subprocess.PIPE
+                    if local_exec.stdin
+                    else asyncio.subprocess.DEVNULL
+                ),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                # Own process group, so a kill reaches everything it started
+                start_new_session=True,
+                preexec_fn=lambda: self._set_limits(sandbox.options, limit_memory),
+            )
+        except OSError as e:
+            raise DockerDriverError(f"exec {command[0]}: {e}")
+        return local_exec.process
+
+    async def _read_output(
+        self,
+        sandbox: LocalSandbox,
+        local_exec: LocalExec,
+        stdin: bytes | None = None,
+    ) -> AsyncIterator[tuple[int, bytes]]:
+        process = local_exec.process
+        frames: asyncio.Queue = asyncio.Queue()
+
+        async def feed():
+            try:
+                process.stdin.write(stdin)
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                process.stdin.close()
+
+        async def pump(stream, stream_type: int):
+            while chunk := await stream.read(65536):
+                await frames.put((stream_type, chunk))
+            await frames.put(None)
+
+        tasks = [
+            asyncio.create_task(pump(process.stdout, STDOUT)),
+            asyncio.create_task(pump(process.stderr, STDERR)),
+        ]
+        if stdin is not None:
+            tasks.append(asyncio.create_task(feed()))
+        finished = False
+        try:
+            open_streams = 2
+            while open_streams:
+                frame = await frames.get()
+                if frame is None:
+                    open_streams -= 1
+                else:
+                    yield frame
+            finished = True
+            # Likely exited but not reaped yet, so its CPU time can still be read
+            self._sample(sandbox)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Reading stopped early on a timeout or output limit, kill the run
+            if not finished:
+                self._kill(local_exec)
+
+    async def _namespaces(self) -> list[str]:
+        if self._namespace_prefix is None:
+            self._namespace_prefix = []
+            if self._unshare and shutil.which("unshare"):
+                probe = await asyncio.create_subprocess_exec(
+                    *UNSHARE_COMMAND,
+                    "true",
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                if await probe.wait() == 0:
+                    self._namespace_prefix = UNSHARE_COMMAND
+            if not self._namespace_prefix:
+                logger.warning("Namespaces unavailable, local runs share the host's")
+        return self._namespace_prefix
+
+    def _translate(self, sandbox: LocalSandbox, path: str) -> str:
+        """Map a path inside the sandbox to where it is on the host."""
+        for prefix, target in (
+            ("/tmp", sandbox.root),
+            ("/root", os.path.join(sandbox.root, ".home")),
+            (ARTIFACTS_MOUNT, settings.CODE_RUNNER_ARTIFACT_CACHE_DIR),
+        ):
+            if path == prefix or path.startswith(prefix + "/"):
+                return target + path[len(prefix) :]
+        return path
+
+    def _environment(self, sandbox: LocalSandbox) -> dict[str, str]:
+        # Nothing from the worker's environment, it holds credentials
+        home = os.path.join(sandbox.root, ".home")
+        return {
+            "PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin"),
+            "HOME": home,
+            "TMPDIR": sandbox.root,
+            "LANG": "C.UTF-8",
+            "GOCACHE": os.path.join(sandbox.root, ".cache", "go-build"),
+            "GOPATH": os.path.join(home, "go"),
+        }
+
+    @staticmethod
+    def _set_limits(options: dict, limit_memory: bool = True):
+        """Runs in the child between fork and exec."""
+        limits = {
+            resource.RLIMIT_CORE: 0,
+            resource.RLIMIT_CPU: settings.CODE_RUNNER_LOCAL_CPU_SECONDS,
+            resource.RLIMIT_NOFILE: 256,
+        }
+        if limit_memory and "mem_limit" in options:
+            limits[resource.RLIMIT_DATA] = parse_bytes(options["mem_limit"])
+        # A single file can't be bigger than the largest tmpfs of the container
+        sizes = [
+            parse_bytes(option.split("=", 1)[1])
+            for mount in (options.get("tmpfs") or {}).values()
+            for option in mount.split(",")
+            if option.startswith("size=")
+        ]
+        if sizes:
+            limits[resource.RLIMIT_FSIZE] = max(sizes)
+        if settings.CODE_RUNNER_LOCAL_MAX_PROCESSES:
+            # Counts every process of the worker's user, not just this run's
+            limits[resource.RLIMIT_NPROC] = settings.CODE_RUNNER_LOCAL_MAX_PROCESSES
+        for limit, value in limits.items():
+            resource.setrlimit(limit, (value, value))
+
+    def _sample(self, sandbox: LocalSandbox) -> int:
+        """Update the sandbox's CPU time and return its memory in use."""
+        sessions = {e.process.pid for e in (sandbox.main, *sandbox.execs) if e.process}
+        if not sessions:
+            return 0
+        cpu = dict.fromkeys(sessions, 0.0)
+        memory = 0
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            stat = read_proc_stat(int(entry))
+            if stat is None or stat["session"] not in sessions:
+                continue
+            cpu[stat["session"]] += stat["cpu"]
+            memory += stat["rss"]
+        for session, seconds in cpu.items():
+            sandbox.cpu[session] = max(sandbox.cpu.get(session, 0.0), seconds)
+        return memory
+
+    @staticmethod
+    def _kill(local_exec: LocalExec):
+        process = local_exec.process
+        if process is None or process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def _exit_code(returncode: int) -> int:
+        # Docker reports a process killed by a signal as 128 + signal
+        return 128 - returncode if returncode < 0 else returncode
+
+    def _get(self, container_id: str) -> LocalSandbox:
+        try:
+            return self._sandboxes[container_id]
+        except KeyError:
+            raise DockerDriverError(f"No such sandbox: {container_id}")
+
+    def _get_exec(self, exec_id: str) -> tuple[str, LocalExec]:
+        try:
+            return self._execs[exec_id]
+        except KeyError:
+            raise DockerDriverError(f"No such exec: {exec_id}")
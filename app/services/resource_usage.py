@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+from app.services.docker_driver import DockerDriver
+
+
+def cpu_seconds(stats: dict) -> float:
+    usage = (stats.get("cpu_stats") or {}).get("cpu_usage") or {}
+    return usage.get("total_usage", 0) / 1e9
+
+
+def memory_bytes(stats: dict, lifetime_peak: bool = True) -> int:
+    memory = stats.get("memory_stats") or {}
+    # max_usage is only reported on cgroup v1, v2 hosts fall back to sampling
+    if lifetime_peak and memory.get("max_usage"):
+        return memory["max_usage"]
+    return memory.get("usage") or 0
+
+
+class UsageSampler:
+    """Samples a container's Docker stats while a run is in progress.
+
+    A fresh container's cgroup disappears when it exits, so the last sample
+    taken while it ran is kept. For a pooled container the CPU time already
+    used by earlier runs is measured first and subtracted, and the peak
+    memory is sampled too: cgroup v1's max_usage covers the container's
+    whole life, earlier runs included.
+    """
+
+    def __init__(self, driver: DockerDriver, container_id: str, interval: float = 0.2):
+        self.driver = driver
+        self.container_id = container_id
+        self.interval = interval
+
+        self._cpu_baseline = 0.0
+        self._cpu = 0.0
+        self._peak_memory = 0
+        self._lifetime_peak = True
+        self._started = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def start(self, baseline: bool = False):
+        if baseline:
+            await self._sample()
+            self._cpu_baseline, self._cpu, self._peak_memory = self._cpu, 0.0, 0
+            self._lifetime_peak = False
+        self._started = time.monotonic()
+        self._task = asyncio.create_task(self._sample_forever())
+
+    async def stop(self) -> dict:
+        wall_time = time.monotonic() - self._started
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._sample()
+
+        return {
+            "cpu_time": round(max(self._cpu - self._cpu_baseline, 0.0), 6),
+            "peak_memory": self._peak_memory,
+            "wall_time": round(wall_time, 6),
+        }
+
+    async def _sample_forever(self):
+        while True:
+            await self._sample()
+            await asyncio.sleep(self.interval)
+
+    async def _sample(self):
+        try:
+            stats = await self.driver.stats(self.container_id)
+            # Stats of an exited container are empty, never count them down
+            self._cpu = max(self._cpu, cpu_seconds(stats))
+            self._peak_memory = max(
+                self._peak_memory, memory_bytes(stats, self._lifetime_peak)
+            )
+        except Exception:
+            pass
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import time
+
+from redis.asyncio import Redis
+
+CACHE_KEY_PREFIX = "code_results"
+CACHE_INDEX_KEY = f"{CACHE_KEY_PREFIX}:index"
+
+
+class ResultCache:
+    """Content-addressed cache of code run results stored in Redis.
+
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    evicted once more than ``max_entries`` are stored.
+    """
+
+    def __init__(self, redis_client: Redis, ttl: int = 3600, max_entries: int = 10000):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @staticmethod
+    def make_key(
+        code: str,
+        language: str,
+        version: str | None,
+        stdin: str | None = None,
+        args: list[str] | None = None,
+        limits: dict | None = None,
+        files: list[dict] | None = None,
+    ) -> str:
+        payload = json.dumps(
+            {
+                "code": code,
+                "language": language,
+                "version": version,
+                "stdin": stdin,
+                "args": args,
+                "limits": limits,
+                "files": files,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> dict | None:
+        cached = await self.redis.get(f"{CACHE_KEY_PREFIX}:{key}")
+        if cached is None:
+            return None
+
+        await self.redis.zadd(CACHE_INDEX_KEY, {key: time.time()})
+        return json.loads(cached)
+
+    async def set(self, key: str, result: dict):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(f"{CACHE_KEY_PREFIX}:{key}", json.dumps(result), ex=self.ttl)
+            pipe.zadd(CACHE_INDEX_KEY, {key: time.time()})
+            pipe.zcard(CACHE_INDEX_KEY)
+            *_, size = await pipe.execute()
+
+        if size > self.max_entries:
+            evicted = await self.redis.zpopmin(CACHE_INDEX_KEY, size - self.max_entries)
+            if evicted:
+                await self.redis.delete(
+                    *(f"{CACHE_KEY_PREFIX}:{key}" for key, _ in evicted)
+                )
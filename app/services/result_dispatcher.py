@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+
+import redis.asyncio as redis
+
+from app.config import settings
+from app.services.run_cancellation import request_cancel
+
+logger = logging.getLogger(__name__)
+
+TASK_RESULTS_PREFIX = "task_results:"
+
+
+class ResultDispatcher:
+    """Process-wide listener for code run frames published by the workers.
+
+    A single pattern subscription to ``task_results:*`` replaces one Redis
+    connection and polling loop per websocket. Frames are routed to the
+    asyncio queues registered for their task id.
+    """
+
+    def __init__(self, reconnect_delay: float = 1.0):
+        self.reconnect_delay = reconnect_delay
+        self._queues: dict[str, list[asyncio.Queue]] = {}
+        self._task: asyncio.Task | None = None
+        self._client: redis.Redis | None = None
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """Register a task before publishing it, so no frame is missed."""
+        queue = asyncio.Queue()
+        self._queues.setdefault(task_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue | None = None):
+        """Drop one subscriber of a task, or all of them if no queue is given."""
+        queues = self._queues.get(task_id, [])
+        if queue is not None and queue in queues:
+            queues.remove(queue)
+        if queue is None or not queues:
+            self._queues.pop(task_id, None)
+
+    @property
+    def client(self) -> redis.Redis:
+        """Command client shared by every websocket of the process."""
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    async def cancel(self, task_id: str):
+        """Stop delivering frames for a task and ask the workers to kill it."""
+        self.unsubscribe(task_id)
+        await request_cancel(self.client, task_id)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen_forever())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def dispatch(self, channel: str, data: str):
+        task_id = channel.removeprefix(TASK_RESULTS_PREFIX)
+        queues = self._queues.get(task_id)
+        if queues:
+            frame = json.loads(data)
+            for queue in queues:
+                queue.put_nowait(frame)
+
+    async def _listen_forever(self):
+        while True:
+            client = self._create_client()
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f"{TASK_RESULTS_PREFIX}*")
+                    async for message in pubsub.listen():
+                        if message["type"] == "pmessage":
+                            self.dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Result listener disconnected: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                await client.aclose()
+
+    @staticmethod
+    def _create_client() -> redis.Redis:
+        return redis.Redis(
+            host=settings.REDIS_HOST,
+            port=int(settings.REDIS_PORT),
+            decode_responses=True,
+        )
+
+
+result_dispatcher = ResultDispatcher()
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from typing import Callable
+
+import redis.asyncio as redis
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CANCEL_CHANNEL = "task_cancellations"
+
+
+def cancel_key(task_id: str) -> str:
+    return f"task_cancelled:{task_id}"
+
+
+async def request_cancel(redis_client: redis.Redis, task_id: str):
+    """Ask the workers to stop a run, whether it is running or still queued."""
+    # The key covers runs no worker has picked up yet, the message running ones
+    await redis_client.set(
+        cancel_key(task_id), 1, ex=settings.CODE_RUNNER_CANCEL_KEY_TTL
+    )
+    await redis_client.publish(CANCEL_CHANNEL, task_id)
+
+
+async def is_cancelled(redis_client: redis.Redis, task_id: str) -> bool:
+    return bool(await redis_client.exists(cancel_key(task_id)))
+
+
+async def listen_for_cancellations(
+    on_cancel: Callable[[str], None], reconnect_delay: float = 1.0
+):
+    while True:
+        client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=int(settings.REDIS_PORT),
+            decode_responses=True,
+        )
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(CANCEL_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        on_cancel(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Cancellation listener disconnected: {e}")
+            await asyncio.sleep(reconnect_delay)
+        finally:
+            await client.aclose()
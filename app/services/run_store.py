@@ -0,0 +1,62 @@
+import json
+
+import redis.asyncio as redis
+
+from app.config import settings
+from app.enums.code_runner import RunStatusEnum
+
+
+def run_key(task_id: str) -> str:
+    return f"code_runs:{task_id}"
+
+
+def idempotency_key(owner: str, key: str) -> str:
+    # Scoped to the owner, so a guessed key never returns another user's run
+    return f"code_runs:idempotency:{owner}:{key}"
+
+
+class RunStore:
+    """Status and final result of submitted runs, kept in Redis with a TTL.
+
+    Unlike the result frames on ``task_results:*``, a stored run can be read
+    by clients that were not subscribed while it was executing.
+    """
+
+    def __init__(self, redis_client: redis.Redis, ttl: int | None = None):
+        self.redis = redis_client
+        self.ttl = ttl or settings.CODE_RUNNER_RUN_RESULT_TTL
+
+    async def create(self, task_id: str) -> dict:
+        run = {"task_id": task_id, "status": RunStatusEnum.QUEUED.value}
+        await self.redis.set(run_key(task_id), json.dumps(run), ex=self.ttl)
+        return run
+
+    async def claim(self, owner: str, key: str, task_id: str) -> str | None:
+        """Bind an owner's idempotency key to a task id.
+
+        Returns the task id already bound to the key, or None if this call
+        claimed it and the run should be published.
+        """
+        claimed = await self.redis.set(
+            idempotency_key(owner, key), task_id, ex=self.ttl, nx=True
+        )
+        if claimed:
+            return None
+        return await self.redis.get(idempotency_key(owner, key))
+
+    async def release(self, owner: str, key: str):
+        """Free a claimed key whose run was never submitted."""
+        await self.redis.delete(idempotency_key(owner, key))
+
+    async def get(self, task_id: str) -> dict | None:
+        data = await self.redis.get(run_key(task_id))
+        return json.loads(data) if data else None
+
+    async def complete(
+        self,
+        task_id: str,
+        result: dict | None,
+        status: RunStatusEnum = RunStatusEnum.COMPLETED,
+    ):
+        run = {"task_id": task_id, "status": status.value, "result": result}
+        await self.redis.set(run_key(task_id), json.dumps(run), ex=self.ttl)
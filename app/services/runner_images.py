@@ -0,0 +1,71 @@
+"""Derived runner images with language runtime startup work done ahead of time.
+
+Sandboxes have a read-only root filesystem and fresh tmpfs mounts, so
+anything a runtime caches on first use is rebuilt on every run. The derived
+images bake those caches in:
+
+* Python: bytecode for the standard library.
+* Java: the default CDS archive and a dynamic CDS archive of javac itself.
+* Go: a build cache of the commonly used standard library packages, copied
+  into the writable GOCACHE by a ``go`` wrapper before the first build.
+"""
+
+import hashlib
+
+from app.enums.language import RunLanguage
+
+PYTHON_DOCKERFILE = """\
+FROM {base}
+RUN python -m compileall -q -j 0 \
+    "$(python -c 'import sysconfig; print(sysconfig.get_path("stdlib"))')" || true
+"""
+
+JAVA_DOCKERFILE = """\
+FROM {base}
+RUN java -Xshare:dump > /dev/null 2>&1 || true
+RUN mkdir -p /opt/runner/bin /tmp/warm \\
+    && printf 'public class Main {\\n    public static void main(String[] args) {\\n        System.out.println("warm");\\n    }\\n}\\n' > /tmp/warm/Main.java \\
+    && javac -J-XX:ArchiveClassesAtExit=/opt/runner/javac.jsa -d /tmp/warm /tmp/warm/Main.java \\
+    && rm -rf /tmp/warm \\
+    && printf '#!/bin/sh\\nexec %s -J-XX:SharedArchiveFile=/opt/runner/javac.jsa -J-XX:TieredStopAtLevel=1 "$@"\\n' "$(command -v javac)" > /opt/runner/bin/javac \\
+    && chmod 755 /opt/runner/bin/javac
+ENV PATH=/opt/runner/bin:$PATH
+"""
+
+GO_DOCKERFILE = """\
+FROM {base}
+ENV GOCACHE=/root/.cache/go-build
+RUN mkdir -p /opt/runner/bin /tmp/warm \\
+    && printf 'package main\\n\\nimport (\\n\\t"bufio"\\n\\t"fmt"\\n\\t"math"\\n\\t"os"\\n\\t"sort"\\n\\t"strconv"\\n\\t"strings"\\n)\\n\\nfunc main() {\\n\\t_ = bufio.NewReader(os.Stdin)\\n\\tfmt.Println(math.Pi, sort.IntsAreSorted(nil), strconv.Itoa(1), strings.ToUpper("x"))\\n}\\n' > /tmp/warm/main.go \\
+    && GOCACHE=/opt/go-cache go build -o /dev/null /tmp/warm/main.go \\
+    && rm -rf /tmp/warm \\
+    && printf '#!/bin/sh\\nif [ ! -d "$GOCACHE" ]; then mkdir -p "$GOCACHE" && cp -a /opt/go-cache/. "$GOCACHE"/; fi\\nexec %s "$@"\\n' "$(command -v go)" > /opt/runner/bin/go \\
+    && chmod 755 /opt/runner/bin/go
+ENV PATH=/opt/runner/bin:$PATH
+"""
+
+DOCKERFILES = {
+    RunLanguage.PYTHON.value: PYTHON_DOCKERFILE,
+    RunLanguage.JAVA.value: JAVA_DOCKERFILE,
+    RunLanguage.GO.value: GO_DOCKERFILE,
+}
+
+# Labels used to rebuild a derived image when its base or recipe changes
+BASE_ID_LABEL = "code_runner.base_id"
+RECIPE_LABEL = "code_runner.recipe"
+
+
+def runner_image_name(base: str) -> str:
+    return f"code-runner/{base.replace('/', '_')}"
+
+
+def runner_dockerfile(language: str, base: str) -> str | None:
+    """Dockerfile of the derived image, None if the language has no recipe."""
+    template = DOCKERFILES.get(language)
+    if template is None:
+        return None
+    return template.replace("{base}", base)
+
+
+def recipe_hash(dockerfile: str) -> str:
+    return hashlib.sha256(dockerfile.encode()).hexdigest()[:16]
@@ -1,63 +1,346 @@
-from elasticsearch import AsyncElasticsearch
+import base64
+import json
+import time
+
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from elasticsearch.helpers import async_bulk
+
 from app.config import settings
+from app.errors.snippet import InvalidCursorError, SearchWindowExceededError
 
 ES_URL = settings.ES_URL
 
+# Searches go through READ_ALIAS, live writes to every index behind
+# WRITE_ALIAS. Both point at one snippets_v{n} index, except while a
+# rebuild adds the next version to WRITE_ALIAS to receive writes too.
+READ_ALIAS = "snippets"
+WRITE_ALIAS = "snippets_write"
+INDEX_PREFIX = "snippets_v"
+# How long a worker may keep writing to the indices it resolved last
+WRITE_TARGETS_TTL = 5.0
+
+# index.max_result_window, offset + size past it fails the whole search
+MAX_RESULT_WINDOW = 10000
+
+# Overloaded or restarting cluster, worth retrying on another attempt
+RETRY_ON_STATUS = (429, 502, 503, 504)
+
+MAPPINGS = {
+    "properties": {
+        "title": {"type": "text"},
+        "code": {"type": "text"},
+        "language": {"type": "keyword"},
+        "id": {"type": "integer"},
+        "user_id": {"type": "integer"},
+        "language_id": {"type": "integer"},
+        "tags": {"type": "keyword"},
+    }
+}
+
+
+def routing(user_id: int | None) -> str | None:
+    """A user's snippets share a shard, their searches only query that one."""
+    return str(user_id) if user_id is not None else None
+
+
+def encode_cursor(sort: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(sort).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        sort = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise InvalidCursorError
+    if not isinstance(sort, list):
+        raise InvalidCursorError
+    return sort
+
+
+def create_client() -> AsyncElasticsearch:
+    """Client with a pool of keep-alive connections, meant to be shared."""
+    return AsyncElasticsearch(
+        ES_URL,
+        connections_per_node=settings.ES_CONNECTIONS_PER_NODE,
+        request_timeout=settings.ES_REQUEST_TIMEOUT,
+        max_retries=settings.ES_MAX_RETRIES,
+        retry_on_timeout=True,
+        retry_on_status=RETRY_ON_STATUS,
+        # A node that failed is retried after this many seconds, doubling
+        dead_node_backoff_factor=settings.ES_RETRY_BACKOFF,
+        max_dead_node_backoff=settings.ES_MAX_RETRY_BACKOFF,
+    )
+
 
 class SearchService:
-    def __init__(self):
-        self.client = AsyncElasticsearch(ES_URL)
-        self.index_name = "snippets"
+    def __init__(self, client: AsyncElasticsearch | None = None):
+        # A shared client outlives the service and is closed by its owner
+        self._owns_client = client is None
+        self.client = client or create_client()
+        self.index_name = READ_ALIAS
+        self._write_indices: list[str] = []
+        self._write_indices_at = 0.0
 
     async def create_index(self):
-        if not await self.client.indices.exists(index=self.index_name):
+        """Make sure the aliases exist, on a first version if needed."""
+        if await self.client.indices.exists_alias(name=READ_ALIAS):
+            return
+
+        index = f"{INDEX_PREFIX}1"
+        if not await self.client.indices.exists(index=READ_ALIAS):
             await self.client.indices.create(
-                index=self.index_name,
-                body={
-                    "mappings": {
-                        "properties": {
-                            "title": {"type": "text"},
-                            "code": {"type": "text"},
-                            "language": {"type": "keyword"},
-                            "id": {"type": "integer"},
-                        }
-                    }
-                },
+                index=index,
+                mappings=MAPPINGS,
+                aliases={READ_ALIAS: {}, WRITE_ALIAS: {}},
             )
+            return
+
+        # An index from before versioning holds the name, copy it to a
+        # version and replace it with the aliases in one step
+        await self.client.indices.create(index=index, mappings=MAPPINGS)
+        await self.client.reindex(
+            source={"index": READ_ALIAS},
+            dest={"index": index},
+            wait_for_completion=True,
+        )
+        await self.client.indices.update_aliases(
+            actions=[
+                {"remove_index": {"index": READ_ALIAS}},
+                {"add": {"index": index, "alias": READ_ALIAS}},
+                {"add": {"index": index, "alias": WRITE_ALIAS}},
+            ]
+        )
+
+    async def alias_indices(self, alias: str) -> list[str]:
+        try:
+            response = await self.client.indices.get_alias(name=alias)
+        except NotFoundError:
+            return []
+        return sorted(response)
+
+    async def write_indices(self) -> list[str]:
+        if time.monotonic() - self._write_indices_at > WRITE_TARGETS_TTL:
+            self._write_indices = await self.alias_indices(WRITE_ALIAS)
+            self._write_indices_at = time.monotonic()
+        return self._write_indices
+
+    async def building_index(self) -> str | None:
+        """The version being rebuilt: written to but not searched yet."""
+        live = set(await self.alias_indices(READ_ALIAS))
+        building = [
+            index
+            for index in await self.alias_indices(WRITE_ALIAS)
+            if index not in live
+        ]
+        return building[-1] if building else None
+
+    async def start_rebuild(self) -> str:
+        """Create the next version and let it receive live writes."""
+        response = await self.client.indices.get(
+            index=f"{INDEX_PREFIX}*", allow_no_indices=True
+        )
+        versions = [
+            int(index.removeprefix(INDEX_PREFIX))
+            for index in response
+            if index.removeprefix(INDEX_PREFIX).isdigit()
+        ]
+        index = f"{INDEX_PREFIX}{max(versions, default=0) + 1}"
+        await self.client.indices.create(
+            index=index,
+            mappings=MAPPINGS,
+            # No refreshes while it is bulk loaded, nothing searches it yet
+            settings={"index": {"refresh_interval": "-1"}},
+            aliases={WRITE_ALIAS: {}},
+        )
+        return index
+
+    async def finish_rebuild(self, index: str) -> list[str]:
+        """Swap both aliases to the rebuilt index, drop the old versions."""
+        await self.client.indices.put_settings(
+            index=index, settings={"index": {"refresh_interval": None}}
+        )
+        await self.client.indices.refresh(index=index)
+
+        old = [i for i in await self.alias_indices(WRITE_ALIAS) if i != index]
+        old += [i for i in await self.alias_indices(READ_ALIAS) if i not in old]
+        actions = [{"add": {"index": index, "alias": READ_ALIAS}}]
+        for old_index in old:
+            actions.append({"remove_index": {"index": old_index}})
+        await self.client.indices.update_aliases(actions=actions)
+        return old
+
+    async def abort_rebuild(self, index: str):
+        await self.client.indices.delete(index=index, ignore_unavailable=True)
+
+    @staticmethod
+    def snippet_document(
+        snippet_id: int,
+        title: str,
+        code: str,
+        language: str,
+        user_id: int = None,
+        language_id: int = None,
+        tags: list[str] = None,
+    ):
+        return {
+            "id": snippet_id,
+            "title": title,
+            "code": code,
+            "language": language,
+            "user_id": user_id,
+            "language_id": language_id,
+            "tags": list(tags or []),
+        }
 
     async def index_snippet(
-        self, snippet_id: int, title: str, code: str, language: str
+        self,
+        snippet_id: int,
+        title: str,
+        code: str,
+        language: str,
+        user_id: int = None,
+        language_id: int = None,
+        tags: list[str] = None,
     ):
-        await self.client.index(
-            index=self.index_name,
-            id=str(snippet_id),
-            document={
-                "id": snippet_id,
-                "title": title,
-                "code": code,
-                "language": language,
-            },
+        document = self.snippet_document(
+            snippet_id, title, code, language, user_id, language_id, tags
         )
+        for index in await self.write_indices():
+            await self.client.index(
+                index=index,
+                id=str(snippet_id),
+                document=document,
+                routing=routing(user_id),
+            )
 
-    async def delete_snippet(self, snippet_id: int):
-        await self.client.delete(
-            index=self.index_name, id=str(snippet_id), ignore=[404]
+    async def bulk_index(
+        self, documents: list[dict], index: str = WRITE_ALIAS
+    ) -> tuple[int, list]:
+        """Add documents in one bulk request, returns (indexed, errors).
+
+        Documents are only created, so a live write that reached the index
+        first is not overwritten with older data.
+        """
+        actions = [
+            {
+                "_op_type": "create",
+                "_index": index,
+                "_id": str(doc["id"]),
+                "_routing": routing(doc["user_id"]),
+                "_source": doc,
+            }
+            for doc in documents
+        ]
+        indexed, errors = await async_bulk(
+            self.client,
+            actions,
+            chunk_size=len(actions),
+            raise_on_error=False,
+            raise_on_exception=False,
         )
+        conflicts = [e for e in errors if e.get("create", {}).get("status") == 409]
+        errors = [e for e in errors if e not in conflicts]
+        return indexed + len(conflicts), errors
 
-    async def search_snippets(self, query: str) -> list[int]:
-        response = await self.client.search(
-            index=self.index_name,
-            body={
-                "query": {
-                    "multi_match": {
-                        "query": query,
-                        "fields": ["title", "code"],
-                        "fuzziness": "AUTO",
-                    }
+    async def bulk_apply(
+        self, documents: list[dict], deleted: list[tuple[int, int | None]]
+    ) -> list:
+        """Index and delete snippets in every write index in one bulk request.
+
+        `deleted` holds (snippet id, user id) pairs, the user routes the
+        delete. Returns the failed items, deleting a missing document is
+        not a failure. Raises if the request itself fails.
+        """
+        actions = []
+        for index in await self.write_indices():
+            actions += [
+                {
+                    "_index": index,
+                    "_id": str(doc["id"]),
+                    "_routing": routing(doc["user_id"]),
+                    "_source": doc,
+                }
+                for doc in documents
+            ]
+            actions += [
+                {
+                    "_op_type": "delete",
+                    "_index": index,
+                    "_id": str(snippet_id),
+                    "_routing": routing(user_id),
+                }
+                for snippet_id, user_id in deleted
+            ]
+        if not actions:
+            return []
+        _, errors = await async_bulk(
+            self.client, actions, chunk_size=len(actions), raise_on_error=False
+        )
+        return [e for e in errors if e.get("delete", {}).get("status") != 404]
+
+    async def delete_snippet(self, snippet_id: int, user_id: int = None):
+        for index in await self.write_indices():
+            await self.client.delete(
+                index=index,
+                id=str(snippet_id),
+                routing=routing(user_id),
+                ignore=[404],
+            )
+
+    async def search_snippets(
+        self,
+        query: str,
+        user_id: int,
+        tag: str = None,
+        language_id: int = None,
+        size: int = 10,
+        offset: int = 0,
+        cursor: str = None,
+    ) -> tuple[list[int], str | None]:
+        """Ids of the user's snippets matching `query`, best first.
+
+        Returns the next page's cursor along with the ids, None on the last
+        page. A cursor continues where the previous page ended and replaces
+        the offset, which gets expensive deep into the results.
+        """
+        filters = [{"term": {"user_id": user_id}}]
+        if tag:
+            filters.append({"term": {"tags": tag}})
+        if language_id:
+            filters.append({"term": {"language_id": language_id}})
+
+        body = {
+            "query": {
+                "bool": {
+                    "must": {
+                        "multi_match": {
+                            "query": query,
+                            "fields": ["title", "code"],
+                            "fuzziness": "AUTO",
+                        }
+                    },
+                    "filter": filters,
                 }
             },
+            # The id breaks ties between equal scores, so pages never overlap
+            "sort": [{"_score": "desc"}, {"id": "asc"}],
+            "size": size,
+            "_source": False,
+        }
+        if cursor:
+            body["search_after"] = decode_cursor(cursor)
+        elif offset:
+            if offset + size > MAX_RESULT_WINDOW:
+                raise SearchWindowExceededError()
+            body["from"] = offset
+
+        response = await self.client.search(
+            index=self.index_name, routing=routing(user_id), body=body
         )
-        return [int(hit["_id"]) for hit in response["hits"]["hits"]]
+        hits = response["hits"]["hits"]
+        next_cursor = encode_cursor(hits[-1]["sort"]) if len(hits) == size else None
+        return [int(hit["_id"]) for hit in hits], next_cursor
 
     async def close(self):
-        await self.client.close()
+        if self._owns_client:
+            await self.client.close()
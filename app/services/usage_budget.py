@@ -0,0 +1,88 @@
+import time
+
+import redis.asyncio as redis
+
+from app.config import settings
+from app.errors.code_runner import QuotaExceededError
+
+
+def run_owner(user_id: int | None, client: str | None) -> str:
+    """Key runs by their user, or by client address for anonymous runs."""
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{client or 'unknown'}"
+
+
+class UsageBudget:
+    """Rolling per-owner budgets of runs and CPU seconds, kept in Redis.
+
+    Usage is added to per-minute buckets that expire with the window, and a
+    budget is the sum of the buckets still inside the window. A limit of 0
+    disables that budget.
+    """
+
+    bucket_size = 60
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        cpu_seconds_limit: float | None = None,
+        runs_limit: int | None = None,
+        window: int | None = None,
+    ):
+        self.redis = redis_client
+        self.cpu_seconds_limit = (
+            settings.CODE_RUNNER_CPU_SECONDS_BUDGET
+            if cpu_seconds_limit is None
+            else cpu_seconds_limit
+        )
+        self.runs_limit = (
+            settings.CODE_RUNNER_RUNS_BUDGET if runs_limit is None else runs_limit
+        )
+        self.window = window or settings.CODE_RUNNER_BUDGET_WINDOW
+
+    async def usage(self, owner: str) -> dict:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in self._window_keys(owner):
+                pipe.hgetall(key)
+            buckets = await pipe.execute()
+
+        return {
+            "cpu_seconds": sum(float(b.get("cpu_seconds", 0)) for b in buckets),
+            "runs": sum(int(b.get("runs", 0)) for b in buckets),
+        }
+
+    async def check(self, owner: str):
+        """Raise QuotaExceededError if the owner has used up a budget."""
+        if not self.cpu_seconds_limit and not self.runs_limit:
+            return
+
+        usage = await self.usage(owner)
+        if self.runs_limit and usage["runs"] >= self.runs_limit:
+            raise QuotaExceededError(f"Run limit of {self.runs_limit} reached")
+        if self.cpu_seconds_limit and usage["cpu_seconds"] >= self.cpu_seconds_limit:
+            raise QuotaExceededError(
+                f"CPU time limit of {self.cpu_seconds_limit}s reached"
+            )
+
+    async def record(self, owner: str, runs: int = 0, cpu_seconds: float = 0):
+        key = self._bucket_key(owner, self._current_bucket())
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if runs:
+                pipe.hincrby(key, "runs", runs)
+            if cpu_seconds:
+                pipe.hincrbyfloat(key, "cpu_seconds", cpu_seconds)
+            pipe.expire(key, self.window + self.bucket_size)
+            await pipe.execute()
+
+    def _current_bucket(self) -> int:
+        return int(time.time()) // self.bucket_size
+
+    def _window_keys(self, owner: str) -> list[str]:
+        current = self._current_bucket()
+        count = max(self.window // self.bucket_size, 1)
+        return [self._bucket_key(owner, current - i) for i in range(count)]
+
+    @staticmethod
+    def _bucket_key(owner: str, bucket: int) -> str:
+        return f"code_usage:{owner}:{bucket}"
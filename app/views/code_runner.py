@@ -2,11 +2,39 @@ import asyncio
 import json
 import uuid
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from redis.asyncio import Redis as RedisClient
+from redis.exceptions import RedisError
 
+from app.auth import decode_access_token, get_optional_user_id
+from app.config import settings
+from app.enums.code_runner import RunStatusEnum
+from app.errors.auth import InvalidTokenError
+from app.errors.code_runner import QuotaExceededError, RunNotFoundError
 from app.mq import publish_event
 from app.redis import get_redis
-from app.schemas.code_runner import CodeRunRequest
+from app.schemas.code_runner import (
+    CodeBatchRunRequest,
+    CodeRunCancelRequest,
+    CodeRunnerReadiness,
+    CodeRunRequest,
+    CodeRunStatus,
+)
+from app.services.image_usage import ImageUsage
+from app.services.result_dispatcher import result_dispatcher
+from app.services.run_cancellation import request_cancel
+from app.services.run_store import RunStore
+from app.services.usage_budget import UsageBudget, run_owner
 
 router = APIRouter(prefix="/code", tags=["code"])
 
@@ -21,58 +49,294 @@ async def get_available_versions():
     }
 
 
+@router.get(
+    "/ready",
+    response_model=CodeRunnerReadiness,
+    responses={503: {"description": "Runner images are still being pulled"}},
+)
+async def get_readiness(response: Response, redis: RedisClient = Depends(get_redis)):
+    """Whether the code runner workers have every runner image present."""
+    readiness = await ImageUsage(redis).readiness()
+    if not readiness["ready"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return readiness
+
+
+async def admit_run(redis: RedisClient, user_id: int | None, client: str | None):
+    """Charge a run to its owner's budget, or raise QuotaExceededError."""
+    budget = UsageBudget(redis)
+    owner = run_owner(user_id, client)
+    await budget.check(owner)
+    await budget.record(owner, runs=1)
+
+
+async def publish_run(
+    task_id: str,
+    request: CodeRunRequest | CodeBatchRunRequest,
+    user_id: int | None,
+    client: str | None,
+    event: str = "run_code",
+):
+    # user_id and client key the run for fair-share scheduling in the worker
+    await publish_event(
+        "code_execution_tasks",
+        event,
+        {
+            "task_id": task_id,
+            **request.model_dump(exclude={"run_id"}),
+            "user_id": user_id,
+            "client": client,
+        },
+    )
+
+
+async def submit(
+    request: CodeRunRequest | CodeBatchRunRequest,
+    event: str,
+    http_request: Request,
+    idempotency_key: str | None,
+    user_id: int | None,
+    redis: RedisClient,
+) -> dict:
+    store = RunStore(redis)
+    task_id = str(uuid.uuid4())
+    client = http_request.client.host if http_request.client else None
+    owner = run_owner(user_id, client)
+
+    if idempotency_key:
+        existing_id = await store.claim(owner, idempotency_key, task_id)
+        if existing_id:
+            # The claiming request may not have stored its run yet, it is
+            # queued all the same and must never be published twice
+            existing = await store.get(existing_id)
+            return existing or {
+                "task_id": existing_id,
+                "status": RunStatusEnum.QUEUED.value,
+            }
+
+    try:
+        await admit_run(redis, user_id, client)
+        run = await store.create(task_id)
+        await publish_run(task_id, request, user_id, client, event)
+    except Exception:
+        # A retry with the same key must not find a run that never started
+        if idempotency_key:
+            await store.release(owner, idempotency_key)
+        raise
+    return run
+
+
+@router.post(
+    "/runs", response_model=CodeRunStatus, status_code=status.HTTP_202_ACCEPTED
+)
+async def submit_run(
+    request: CodeRunRequest,
+    http_request: Request,
+    idempotency_key: str | None = Header(None, max_length=64),
+    user_id: int | None = Depends(get_optional_user_id),
+    redis: RedisClient = Depends(get_redis),
+):
+    """Queue a run and return its task id without waiting for the result.
+
+    Retrying with the same ``Idempotency-Key`` header returns the run the key
+    was first used for instead of running the code again.
+    """
+    return await submit(
+        request, "run_code", http_request, idempotency_key, user_id, redis
+    )
+
+
+@router.post(
+    "/runs/batch",
+    response_model=CodeRunStatus,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def submit_batch_run(
+    request: CodeBatchRunRequest,
+    http_request: Request,
+    idempotency_key: str | None = Header(None, max_length=64),
+    user_id: int | None = Depends(get_optional_user_id),
+    redis: RedisClient = Depends(get_redis),
+):
+    """Queue one program with many stdin/args cases, run in a single sandbox.
+
+    The program is compiled once and every case gets its own timeout. Poll
+    ``GET /code/runs/{task_id}`` for the per-case results.
+    """
+    return await submit(
+        request, "run_batch", http_request, idempotency_key, user_id, redis
+    )
+
+
+@router.get(
+    "/runs/{task_id}",
+    response_model=CodeRunStatus,
+    responses={404: {"description": "Run not found"}},
+)
+async def get_run(
+    task_id: str,
+    wait: float = Query(0, ge=0, description="Seconds to wait for the result"),
+    redis: RedisClient = Depends(get_redis),
+):
+    """Return the run's status, long-polling up to ``wait`` seconds for it."""
+    store = RunStore(redis)
+    run = await store.get(task_id)
+    if run is None:
+        raise RunNotFoundError(task_id)
+    if run["status"] != RunStatusEnum.QUEUED.value or not wait:
+        return run
+
+    frames = result_dispatcher.subscribe(task_id)
+    try:
+        async with asyncio.timeout(min(wait, settings.CODE_RUNNER_LONG_POLL_MAX_WAIT)):
+            # The run may have finished before the subscription was registered
+            run = await store.get(task_id) or run
+            while run["status"] == RunStatusEnum.QUEUED.value:
+                frame = await frames.get()
+                if frame.get("type") == "exit":
+                    run = await store.get(task_id) or run
+                    break
+    except TimeoutError:
+        pass
+    finally:
+        result_dispatcher.unsubscribe(task_id, frames)
+
+    return run
+
+
+@router.delete(
+    "/runs/{task_id}",
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={404: {"description": "Run not found"}},
+)
+async def cancel_run(task_id: str, redis: RedisClient = Depends(get_redis)):
+    run = await RunStore(redis).get(task_id)
+    if run is None:
+        raise RunNotFoundError(task_id)
+    if run["status"] == RunStatusEnum.QUEUED.value:
+        await request_cancel(redis, task_id)
+    return {"message": "Cancellation requested"}
+
+
 @router.websocket("/ws/run")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, token: str | None = None):
+    """Run code over a websocket.
+
+    Clients send ``{"type": "run", "run_id": ..., "code": ..., ...}`` to start
+    a run and ``{"type": "cancel", "run_id": ...}`` to stop one. Several runs
+    can be in flight at once, and every frame sent back carries its ``run_id``.
+    Browsers cannot set headers on websockets, so the access token of a signed
+    in user is passed as the ``token`` query parameter.
+    """
+    user_id = None
+    if token:
+        try:
+            user_id = decode_access_token(token).user_id
+        except InvalidTokenError:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+    client = websocket.client.host if websocket.client else None
+
     await websocket.accept()
-    redis_gen = get_redis()
-    redis_client = await anext(redis_gen)
-    pubsub = redis_client.pubsub()
+
+    send_lock = asyncio.Lock()
+    # run_id -> (task_id, task forwarding the run's frames)
+    runs: dict[str, tuple[str, asyncio.Task]] = {}
+
+    async def send(frame: dict):
+        async with send_lock:
+            await websocket.send_json(frame)
+
+    async def forward_frames(run_id: str, task_id: str, frames: asyncio.Queue):
+        try:
+            while True:
+                frame = await frames.get()
+                await send({**frame, "run_id": run_id})
+                if frame.get("type") == "exit":
+                    break
+        except WebSocketDisconnect:
+            pass
+        finally:
+            result_dispatcher.unsubscribe(task_id, frames)
+            runs.pop(run_id, None)
+
+    async def cancel(run_id: str):
+        task_id, forwarder = runs.pop(run_id)
+        forwarder.cancel()
+        await result_dispatcher.cancel(task_id)
 
     try:
         while True:
             data = await websocket.receive_text()
             try:
                 payload = json.loads(data)
-                # Validate payload using Pydantic
-                request = CodeRunRequest(**payload)
+                if payload.get("type") == "cancel":
+                    request = CodeRunCancelRequest(**payload)
+                else:
+                    # Validate payload using Pydantic
+                    request = CodeRunRequest(**payload)
             except Exception as e:
-                await websocket.send_json({"error": f"Invalid request: {str(e)}"})
+                await send({"error": f"Invalid request: {str(e)}"})
+                continue
+
+            if isinstance(request, CodeRunCancelRequest):
+                if request.run_id not in runs:
+                    await send({"error": "Unknown run", "run_id": request.run_id})
+                    continue
+                await cancel(request.run_id)
+                await send(
+                    {
+                        "type": "exit",
+                        "run_id": request.run_id,
+                        "exit_code": -1,
+                        "truncated": False,
+                        "cancelled": True,
+                    }
+                )
                 continue
 
             task_id = str(uuid.uuid4())
+            run_id = request.run_id or task_id
 
-            # Subscribe to result channel
-            await pubsub.subscribe(f"task_results:{task_id}")
-
-            # Publish task to RabbitMQ
-            await publish_event(
-                "code_execution_tasks",
-                "run_code",
-                {
-                    "task_id": task_id,
-                    "code": request.code,
-                    "language": request.language,
-                    "version": request.version,
-                },
-            )
+            if run_id in runs:
+                await send({"error": "Run id already in use", "run_id": run_id})
+                continue
+            if len(runs) >= settings.CODE_RUNNER_MAX_RUNS_PER_CONNECTION:
+                await send({"error": "Too many concurrent runs", "run_id": run_id})
+                continue
 
-            # Wait for result
             try:
-                while True:
-                    message = await pubsub.get_message(
-                        ignore_subscribe_messages=True, timeout=1.0
-                    )
-                    if message:
-                        result = json.loads(message["data"])
-                        await websocket.send_json(result)
-                        break
-                    await asyncio.sleep(0.1)
+                # Budgets go through the dispatcher's client, not one per socket
+                await admit_run(result_dispatcher.client, user_id, client)
+            except QuotaExceededError as e:
+                await send({"error": str(e), "run_id": run_id})
+                continue
+            except RedisError as e:
+                await send({"error": f"Execution error: {str(e)}", "run_id": run_id})
+                continue
+
+            # Register for result frames before the task can produce any
+            frames = result_dispatcher.subscribe(task_id)
+
+            try:
+                # Publish task to RabbitMQ
+                await publish_run(task_id, request, user_id, client)
             except Exception as e:
-                await websocket.send_json({"error": f"Execution error: {str(e)}"})
-            finally:
-                await pubsub.unsubscribe(f"task_results:{task_id}")
+                result_dispatcher.unsubscribe(task_id, frames)
+                await send({"error": f"Execution error: {str(e)}", "run_id": run_id})
+                continue
+
+            runs[run_id] = (
+                task_id,
+                asyncio.create_task(forward_frames(run_id, task_id, frames)),
+            )
 
     except WebSocketDisconnect:
         pass
     finally:
-        await redis_client.aclose()
+        # Free the worker capacity of runs nobody is waiting for anymore
+        for run_id in list(runs):
+            try:
+                await cancel(run_id)
+            except Exception:
+                pass
@@ -1,7 +1,7 @@
 import json
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Request, status
+from fastapi import APIRouter, Depends, Query, Request, Response, status
 from redis.asyncio import Redis as RedisClient
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -17,22 +17,48 @@ from app.services.search import SearchService
 router = APIRouter(prefix="/snippets", tags=["Snippets"])
 
 
+def get_search_service(request: Request) -> SearchService:
+    """Search service on the Elasticsearch client shared by the app."""
+    return SearchService(request.app.state.search_client)
+
+
 @router.get("", response_model=List[SnippetRead])
 async def get_snippets(
+    response: Response,
     q: Optional[str] = None,
     tag: Optional[str] = None,
     language_id: Optional[int] = None,
-    offset: int = 0,
-    limit: int = 10,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
     session: AsyncSession = Depends(get_db),
+    search_service: SearchService = Depends(get_search_service),
     current_user: User = Depends(get_current_user),
 ):
-    """Get all snippets, optionally filtered by tag and search query."""
+    """Get all snippets, optionally filtered by tag and search query.
+
+    Search results carry the cursor of their next page in the
+    X-Next-Cursor header, pass it back as `cursor` to continue.
+    """
+    if q:
+        snippets, next_cursor = await Snippet.search(
+            session,
+            search_service,
+            user_id=current_user.id,
+            query_text=q,
+            tag_name=tag,
+            language_id=language_id,
+            offset=offset,
+            limit=limit,
+            cursor=cursor,
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return snippets
     return await Snippet.get_all(
         session,
         user_id=current_user.id,
         tag_name=tag,
-        query_text=q,
         language_id=language_id,
         offset=offset,
         limit=limit,
@@ -40,16 +66,31 @@ async def get_snippets(
 
 
 @router.get("/search", response_model=list[SnippetRead])
-async def search_snippets(q: str, session: AsyncSession = Depends(get_db)):
-    search_service = SearchService()
-    try:
-        snippet_ids = await search_service.search_snippets(q)
-        if not snippet_ids:
-            return []
-        snippets = await Snippet.get_by_ids(session, snippet_ids)
-        return snippets
-    finally:
-        await search_service.close()
+async def search_snippets(
+    response: Response,
+    q: str,
+    tag: Optional[str] = None,
+    language_id: Optional[int] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_db),
+    search_service: SearchService = Depends(get_search_service),
+    current_user: User = Depends(get_current_user),
+):
+    """Search the current user's snippets, paged like `GET /snippets?q=`."""
+    return await get_snippets(
+        response,
+        q=q,
+        tag=tag,
+        language_id=language_id,
+        offset=offset,
+        limit=limit,
+        cursor=cursor,
+        session=session,
+        search_service=search_service,
+        current_user=current_user,
+    )
 
 
 @router.get(
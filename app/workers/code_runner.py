@@ -1,14 +1,66 @@
 import asyncio
 import json
 import logging
+import signal
+from functools import partial
 
+import aio_pika
+
+from app.config import settings
+from app.enums.code_runner import RunStatusEnum
+from app.metrics import metrics
 from app.mq import get_connection
 from app.redis import get_redis
-from app.services.code_runner import CodeRunnerService
+from app.services.adaptive_concurrency import AdaptiveConcurrency
+from app.services.code_runner import SANDBOX_OPTIONS, CodeRunnerService, get_image
+from app.services.fair_scheduler import FairScheduler, parse_weights
+from app.services.image_usage import ImageUsage, worker_id
+from app.services.result_cache import ResultCache
+from app.services.run_cancellation import is_cancelled, listen_for_cancellations
+from app.services.run_store import RunStore
+from app.services.usage_budget import UsageBudget, run_owner
+from app.workers.init_images import IMAGES
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seconds a deferred run holds its prefetch slot before going back to the
+# queue, so a user flooding an otherwise idle queue doesn't spin it
+DEFER_DELAY = 1
+
+# Runs in progress on this worker, so cancellation requests can reach them
+running_tasks: dict[str, asyncio.Task] = {}
+
+
+async def publish_frame(redis_client, channel: str, frame: dict):
+    """Publish one output frame of a run to its Redis result channel."""
+    await redis_client.publish(channel, json.dumps(frame))
+
+
+def cancel_run(task_id: str):
+    task = running_tasks.get(task_id)
+    if task is not None:
+        logger.info(f"Cancelling task {task_id}")
+        task.cancel()
+
+
+async def run_cancellable(task_id: str, redis_client, run) -> dict | None:
+    """Await a run unless it gets cancelled, in which case return None."""
+    task = asyncio.create_task(run)
+    running_tasks[task_id] = task
+    try:
+        # Cancelled while it was still waiting in the queue
+        if await is_cancelled(redis_client, task_id):
+            task.cancel()
+        return await task
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise
+        metrics.inc("code_runner_cancelled_total")
+        return None
+    finally:
+        running_tasks.pop(task_id, None)
+
 
 async def process_message(message, code_runner_service: CodeRunnerService):
     async with message.process():
@@ -18,32 +70,285 @@ async def process_message(message, code_runner_service: CodeRunnerService):
         code = data.get("code")
         language = data.get("language")
         version = data.get("version")
+        files = data.get("files") or None
+        deterministic = data.get("deterministic", True)
+        batch = body.get("event") == "run_batch"
 
         logger.info(f"Processing task {task_id} for {language} {version}")
 
-        result = await code_runner_service.run_code(code, language, version)
-
-        # Publish result to Redis
         redis_gen = get_redis()
         redis_client = await anext(redis_gen)
         try:
-            await redis_client.publish(f"task_results:{task_id}", json.dumps(result))
+            run_store = RunStore(redis_client)
+            stored = await run_store.get(task_id)
+            if stored and stored["status"] != RunStatusEnum.QUEUED.value:
+                # Redelivered after the run already finished, don't run it twice
+                logger.info(f"Task {task_id} already {stored['status']}, skipping")
+                return
+
+            # Ranks the images pulled first when a worker starts on a cold host
+            await ImageUsage(redis_client).record(get_image(language, version))
+
+            result = None
+            cache_key = None
+            result_cache = None
+            if (
+                settings.CODE_RUNNER_RESULT_CACHE_ENABLED
+                and deterministic
+                and not batch
+            ):
+                result_cache = ResultCache(
+                    redis_client,
+                    ttl=settings.CODE_RUNNER_RESULT_CACHE_TTL,
+                    max_entries=settings.CODE_RUNNER_RESULT_CACHE_MAX_ENTRIES,
+                )
+                # Single runs take no stdin or args, the code and files are
+                # all their input
+                cache_key = ResultCache.make_key(
+                    code, language, version, limits=SANDBOX_OPTIONS, files=files
+                )
+                result = await result_cache.get(cache_key)
+                metrics.inc(
+                    "code_runner_result_cache_hits_total"
+                    if result is not None
+                    else "code_runner_result_cache_misses_total"
+                )
+
+            channel = f"task_results:{task_id}"
+
+            async def publish_output(stream: str, text: str):
+                await publish_frame(
+                    redis_client, channel, {"type": stream, "data": text}
+                )
+
+            if result is None:
+                if batch:
+                    run = code_runner_service.run_batch(
+                        code,
+                        language,
+                        version,
+                        cases=data.get("cases") or [],
+                        case_timeout=data.get("case_timeout", 5),
+                        files=files,
+                    )
+                else:
+                    run = code_runner_service.run_code(
+                        code, language, version, on_output=publish_output, files=files
+                    )
+                result = await run_cancellable(task_id, redis_client, run)
+                if result is None:
+                    await run_store.complete(task_id, None, RunStatusEnum.CANCELLED)
+                    await publish_frame(
+                        redis_client,
+                        channel,
+                        {
+                            "type": "exit",
+                            "exit_code": -1,
+                            "truncated": False,
+                            "cancelled": True,
+                        },
+                    )
+                    return
+
+                usage = result.get("usage")
+                if usage:
+                    await UsageBudget(redis_client).record(
+                        run_owner(data.get("user_id"), data.get("client")),
+                        cpu_seconds=usage["cpu_time"],
+                    )
+
+                # Timeouts and system errors are not a property of the code
+                if result_cache and result["exit_code"] >= 0:
+                    # Replaying a cached result costs no resources
+                    await result_cache.set(cache_key, {**result, "usage": None})
+            else:
+                for stream in ("stdout", "stderr"):
+                    if result[stream]:
+                        await publish_output(stream, result[stream])
+
+            # A batch has no single exit code, its frame reports the build step
+            summary = result["compile"] if batch else result
+
+            # Stored before the exit frame, so pollers woken by it can read it
+            await run_store.complete(task_id, result)
+            await publish_frame(
+                redis_client,
+                channel,
+                {
+                    "type": "exit",
+                    "exit_code": summary["exit_code"],
+                    "truncated": summary.get("truncated", False),
+                    "usage": result.get("usage"),
+                },
+            )
         finally:
             await redis_client.aclose()
 
 
+async def log_metrics(interval: float = 60):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Code runner metrics: {metrics.snapshot()}")
+
+
+async def report_images(image_usage: ImageUsage, code_runner_service, worker: str):
+    """Keep this worker's image status fresh for the readiness endpoint."""
+    while True:
+        try:
+            await image_usage.publish_status(
+                worker, code_runner_service.image_registry.status()
+            )
+        except Exception as e:
+            logger.warning(f"Failed to report image status: {e}")
+        await asyncio.sleep(settings.CODE_RUNNER_IMAGE_STATUS_INTERVAL)
+
+
+def scheduling_key(message) -> str:
+    try:
+        data = json.loads(message.body).get("data") or {}
+    except ValueError:
+        return "invalid"
+    return run_owner(data.get("user_id"), data.get("client"))
+
+
+async def consume(
+    queue,
+    code_runner_service: CodeRunnerService,
+    stop_event,
+    concurrency: AdaptiveConcurrency | None = None,
+):
+    """Process messages in fair-share order until stop_event is set, then drain.
+
+    Prefetched messages wait in per-user sub-queues and are started by deficit
+    round robin, so one user flooding the queue cannot starve the others.
+    Runs of a user who already has CODE_RUNNER_MAX_QUEUED_PER_USER waiting
+    are published again at the back of the queue, so their backlog cannot
+    fill the prefetch window either. At most ``concurrency.limit`` run at
+    once, MAX_CONCURRENT_EXECUTIONS without a controller.
+    """
+    scheduler = FairScheduler(
+        max_in_flight_per_user=settings.CODE_RUNNER_MAX_IN_FLIGHT_PER_USER,
+        weights=parse_weights(settings.CODE_RUNNER_USER_WEIGHTS),
+    )
+    in_flight: set[asyncio.Task] = set()
+    deferring: set[asyncio.Task] = set()
+    stopping = False
+
+    def limit() -> int:
+        if concurrency is None:
+            return settings.MAX_CONCURRENT_EXECUTIONS
+        return concurrency.limit
+
+    def dispatch():
+        while not stopping:
+            if len(in_flight) >= limit():
+                if concurrency is not None and len(scheduler):
+                    concurrency.mark_saturated()
+                return
+            picked = scheduler.next()
+            if picked is None:
+                return
+            user, message = picked
+            task = asyncio.create_task(process_message(message, code_runner_service))
+            in_flight.add(task)
+            task.add_done_callback(partial(on_done, user))
+
+    def on_done(user: str, task: asyncio.Task):
+        in_flight.discard(task)
+        scheduler.done(user)
+        dispatch()
+
+    async def defer(message):
+        await asyncio.sleep(DEFER_DELAY)
+        try:
+            await queue.channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=message.body,
+                    headers=message.headers,
+                    delivery_mode=message.delivery_mode,
+                ),
+                routing_key=queue.name,
+            )
+        except Exception as e:
+            logger.error(f"Failed to defer run, requeueing it: {e}")
+            await message.nack(requeue=True)
+            return
+        await message.ack()
+        metrics.inc("code_runner_scheduler_deferred_total")
+
+    async def on_message(message):
+        user = scheduling_key(message)
+        if scheduler.queued(user) >= settings.CODE_RUNNER_MAX_QUEUED_PER_USER:
+            task = asyncio.create_task(defer(message))
+            deferring.add(task)
+            task.add_done_callback(deferring.discard)
+            return
+        scheduler.submit(user, message)
+        metrics.set("code_runner_scheduler_queued", len(scheduler))
+        dispatch()
+
+    consumer_tag = await queue.consume(on_message)
+    await stop_event.wait()
+
+    # Stop receiving new deliveries, unacked prefetched ones get requeued
+    await queue.cancel(consumer_tag)
+    stopping = True
+    for message in scheduler.drain():
+        await message.nack(requeue=True)
+    logger.info(f"Draining {len(in_flight)} in-flight runs...")
+    await asyncio.gather(*in_flight, *deferring, return_exceptions=True)
+
+
 async def main():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
     code_runner_service = CodeRunnerService()
+    redis_gen = get_redis()
+    redis_client = await anext(redis_gen)
+    if settings.CODE_RUNNER_HOST_SLOTS_ENABLED:
+        await code_runner_service.start_host_slots(redis_client)
+    image_usage = ImageUsage(redis_client)
+    # init_images only pulled the most used images, the rest follow in this order
+    await code_runner_service.start_image_registry(await image_usage.rank(IMAGES))
+    if settings.CODE_RUNNER_POOL_ENABLED:
+        await code_runner_service.start_pool()
+    metrics_task = asyncio.create_task(log_metrics())
+    cancellations_task = asyncio.create_task(listen_for_cancellations(cancel_run))
+    images_task = asyncio.create_task(
+        report_images(image_usage, code_runner_service, worker_id())
+    )
+    concurrency = None
+    concurrency_task = None
+    if settings.CODE_RUNNER_ADAPTIVE_CONCURRENCY:
+        concurrency = code_runner_service.start_concurrency_controller()
+        concurrency_task = asyncio.create_task(
+            concurrency.run(settings.CODE_RUNNER_CONCURRENCY_INTERVAL)
+        )
 
-    connection = await get_connection()
-    async with connection:
-        channel = await connection.channel()
-        queue = await channel.declare_queue("code_execution_tasks", durable=True)
+    try:
+        connection = await get_connection()
+        async with connection:
+            channel = await connection.channel()
+            # Runs beyond the concurrency limit wait in the fair scheduler
+            await channel.set_qos(
+                prefetch_count=settings.CODE_RUNNER_SCHEDULER_PREFETCH
+            )
+            queue = await channel.declare_queue("code_execution_tasks", durable=True)
 
-        logger.info("Code Runner Worker started, waiting for messages...")
+            logger.info("Code Runner Worker started, waiting for messages...")
 
-        async for message in queue:
-            await process_message(message, code_runner_service)
+            await consume(queue, code_runner_service, stop_event, concurrency)
+    finally:
+        metrics_task.cancel()
+        cancellations_task.cancel()
+        images_task.cancel()
+        if concurrency_task:
+            concurrency_task.cancel()
+        await code_runner_service.close()
+        await redis_client.aclose()
 
 
 if __name__ == "__main__":
@@ -1,15 +1,31 @@
 #!/usr/bin/env python3
 """
 Initialization script for code-runner-worker.
-Pre-pulls Docker images needed for code execution.
+Pre-pulls the most used Docker images needed for code execution and builds
+the derived runner images with runtime startup caches baked in. The worker
+pulls the remaining images in the background once it is consuming.
 """
 
+import asyncio
+import io
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import docker
 
+from app.config import settings
 from app.constants import AVAILABLE_IMAGES
+from app.redis import get_redis
+from app.services.image_usage import ImageUsage
+from app.services.runner_images import (
+    BASE_ID_LABEL,
+    RECIPE_LABEL,
+    recipe_hash,
+    runner_dockerfile,
+    runner_image_name,
+)
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -22,27 +38,37 @@ IMAGES = [
 ]
 
 
-def pull_images():
-    """Pull all required Docker images."""
+def pull_image(client, image: str) -> bool:
     try:
-        client = docker.from_env()
-        logger.info("Starting to pre-pull Docker images...")
+        try:
+            client.images.get(image)
+            logger.info(f"✓ Image {image} already exists locally")
+            return True
+        except docker.errors.ImageNotFound:
+            logger.info(f"Image {image} not found locally, pulling...")
 
-        for image in IMAGES:
-            try:
-                try:
-                    client.images.get(image)
-                    logger.info(f"✓ Image {image} already exists locally")
-                    continue
-                except docker.errors.ImageNotFound:
-                    logger.info(f"Image {image} not found locally, pulling...")
+        client.images.pull(image)
+        logger.info(f"✓ Successfully pulled {image}")
+        return True
+    except Exception as e:
+        # Continue with other images even if one fails
+        logger.warning(f"✗ Failed to pull {image}: {e}")
+        return False
 
-                logger.info(f"Pulling {image}...")
-                client.images.pull(image)
-                logger.info(f"✓ Successfully pulled {image}")
-            except Exception as e:
-                logger.warning(f"✗ Failed to pull {image}: {e}")
-                # Continue with other images even if one fails
+
+def pull_images(images: list[str] | None = None):
+    """Pull the given Docker images, all required ones by default.
+
+    Up to CODE_RUNNER_PULL_CONCURRENCY images are pulled at a time, starting
+    with the first ones in the list.
+    """
+    images = IMAGES if images is None else images
+    try:
+        client = docker.from_env()
+        logger.info(f"Starting to pre-pull {len(images)} Docker images...")
+
+        with ThreadPoolExecutor(settings.CODE_RUNNER_PULL_CONCURRENCY) as executor:
+            list(executor.map(partial(pull_image, client), images))
 
         logger.info("Finished pre-pulling Docker images")
         return True
@@ -51,6 +77,75 @@ def pull_images():
         return False
 
 
+async def rank_images() -> list[str]:
+    redis_gen = get_redis()
+    redis_client = await anext(redis_gen)
+    try:
+        return await ImageUsage(redis_client).rank(IMAGES)
+    finally:
+        await redis_client.aclose()
+
+
+def ranked_images() -> list[str]:
+    """IMAGES, most used first. Kept in order if usage can't be read."""
+    try:
+        return asyncio.run(rank_images())
+    except Exception as e:
+        logger.warning(f"Could not read image usage, keeping default order: {e}")
+        return list(IMAGES)
+
+
+def build_runner_images(client=None):
+    """Build a derived runner image for every base image that has a recipe.
+
+    An image is rebuilt only when its base image or recipe changed. Failures
+    are logged and skipped, the runner then keeps using the base image.
+    """
+    client = client or docker.from_env()
+
+    for language, versions in AVAILABLE_IMAGES.items():
+        for version in versions:
+            base = version["image"]
+            dockerfile = runner_dockerfile(language, base)
+            if dockerfile is None:
+                continue
+
+            tag = runner_image_name(base)
+            try:
+                try:
+                    base_id = client.images.get(base).id
+                except docker.errors.ImageNotFound:
+                    # Pulled by the worker later, built on the next start
+                    logger.info(f"Base image {base} not present, skipping {tag}")
+                    continue
+
+                labels = {BASE_ID_LABEL: base_id, RECIPE_LABEL: recipe_hash(dockerfile)}
+                try:
+                    existing = client.images.get(tag)
+                    if all(existing.labels.get(k) == v for k, v in labels.items()):
+                        logger.info(f"✓ Runner image {tag} is up to date")
+                        continue
+                except docker.errors.ImageNotFound:
+                    pass
+
+                logger.info(f"Building runner image {tag}...")
+                client.images.build(
+                    fileobj=io.BytesIO(dockerfile.encode()),
+                    tag=tag,
+                    labels=labels,
+                    rm=True,
+                    forcerm=True,
+                )
+                logger.info(f"✓ Successfully built {tag}")
+            except Exception as e:
+                logger.warning(f"✗ Failed to build {tag}: {e}")
+
+
 if __name__ == "__main__":
-    success = pull_images()
+    top = settings.CODE_RUNNER_PREPULL_TOP
+    images = ranked_images()
+    # The worker starts once these are present and pulls the rest itself
+    success = pull_images(images[:top] if top else images)
+    if success:
+        build_runner_images()
     sys.exit(0 if success else 1)
@@ -2,6 +2,7 @@ import asyncio
 import json
 import logging
 
+from app.config import settings
 from app.enums.snippet import SnippetEventEnum
 from app.mq import get_connection
 from app.services.search import SearchService
@@ -9,24 +10,111 @@ from app.services.search import SearchService
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seconds to wait before a batch that failed is redelivered
+RETRY_DELAY = 1
 
-async def process_message(message, search_service: SearchService):
-    async with message.process():
-        data = json.loads(message.body)
-        event = data.get("event")
-        payload = data.get("data")
 
-        logger.info(f"Received event: {event}")
+def collapse_events(messages) -> tuple[list[dict], list[tuple[int, int | None]]]:
+    """Last state of every snippet in the batch.
 
-        if event in (SnippetEventEnum.CREATED.value, SnippetEventEnum.UPDATED.value):
-            await search_service.index_snippet(
-                snippet_id=payload["id"],
-                title=payload["title"],
-                code=payload["code"],
-                language=payload["language"],
+    Returns documents to index and (snippet id, user id) pairs to delete.
+    """
+    latest = {}
+    for message in messages:
+        try:
+            data = json.loads(message.body)
+            event = SnippetEventEnum(data.get("event"))
+            payload = data.get("data")
+            latest[payload["id"]] = (event, payload)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error(f"Skipping malformed snippet event: {e}")
+
+    documents, deleted = [], []
+    for snippet_id, (event, payload) in latest.items():
+        if event == SnippetEventEnum.DELETED:
+            deleted.append((snippet_id, payload.get("user_id")))
+        else:
+            documents.append(
+                SearchService.snippet_document(
+                    snippet_id=snippet_id,
+                    title=payload["title"],
+                    code=payload["code"],
+                    language=payload["language"],
+                    user_id=payload.get("user_id"),
+                    language_id=payload.get("language_id"),
+                    tags=payload.get("tags"),
+                )
             )
-        elif event == SnippetEventEnum.DELETED.value:
-            await search_service.delete_snippet(snippet_id=payload["id"])
+    return documents, deleted
+
+
+def is_retriable(error: dict) -> bool:
+    status = next(iter(error.values()), {}).get("status", 0)
+    return status == 429 or status >= 500
+
+
+async def process_batch(messages, search_service: SearchService) -> bool:
+    """Send a batch as one bulk request, settle its messages after the reply.
+
+    Messages arrive and are settled in order on one channel, so the last
+    delivery tag settles the whole batch. Returns whether it was acked.
+    """
+    documents, deleted = collapse_events(messages)
+    logger.info(
+        f"Received {len(messages)} events: "
+        f"{len(documents)} to index, {len(deleted)} to delete"
+    )
+    try:
+        errors = await search_service.bulk_apply(documents, deleted)
+    except Exception as e:
+        logger.error(f"Bulk request failed, requeueing {len(messages)} events: {e}")
+        await messages[-1].nack(multiple=True, requeue=True)
+        return False
+
+    if any(is_retriable(error) for error in errors):
+        logger.warning(
+            f"Elasticsearch is overloaded, requeueing {len(messages)} events"
+        )
+        await messages[-1].nack(multiple=True, requeue=True)
+        return False
+
+    for error in errors:
+        logger.error(f"Failed to apply snippet event: {error}")
+    await messages[-1].ack(multiple=True)
+    return True
+
+
+async def batches(queue, size: int, timeout: float):
+    """Messages grouped up to `size`, or whatever arrived within `timeout`."""
+    loop = asyncio.get_running_loop()
+    buffer: asyncio.Queue = asyncio.Queue()
+
+    async def read():
+        try:
+            async for message in queue:
+                await buffer.put(message)
+        finally:
+            buffer.put_nowait(None)
+
+    reader = asyncio.create_task(read())
+    try:
+        while (message := await buffer.get()) is not None:
+            batch = [message]
+            deadline = loop.time() + timeout
+            while len(batch) < size:
+                try:
+                    message = await asyncio.wait_for(
+                        buffer.get(), deadline - loop.time()
+                    )
+                except TimeoutError:
+                    break
+                if message is None:
+                    yield batch
+                    return
+                batch.append(message)
+            yield batch
+    finally:
+        reader.cancel()
 
 
 async def main():
@@ -43,15 +131,21 @@ async def main():
         logger.error("Could not connect to Elasticsearch after 30 seconds")
         return
 
+    batch_size = settings.SNIPPET_EVENTS_BATCH_SIZE
     connection = await get_connection()
     async with connection:
         channel = await connection.channel()
+        # Room for the next batch to arrive while one is being flushed
+        await channel.set_qos(prefetch_count=batch_size * 2)
         queue = await channel.declare_queue("snippet_events", durable=True)
 
         logger.info("Worker started, waiting for messages...")
 
-        async for message in queue:
-            await process_message(message, search_service)
+        async for batch in batches(
+            queue, batch_size, settings.SNIPPET_EVENTS_FLUSH_MS / 1000
+        ):
+            if not await process_batch(batch, search_service):
+                await asyncio.sleep(RETRY_DELAY)
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ import { Play, Terminal, Loader2, ChevronDown, Check } from 'lucide-react';
 import { useTranslation } from 'react-i18next';
 import { useLocation } from 'react-router-dom';
 import api from '../lib/api';
+import { authService } from '../services/authService';
 
 const LANGUAGES = [
   { id: 'python', name: 'Python', defaultCode: 'print("Hello, World!")' },
@@ -29,6 +30,7 @@ export function CodeRunner() {
   const [output, setOutput] = useState('');
   const [isRunning, setIsRunning] = useState(false);
   const wsRef = useRef<WebSocket | null>(null);
+  const hasOutputRef = useRef(false);
 
   const [availableVersions, setAvailableVersions] = useState<Record<string, string[]>>({});
   const [selectedVersion, setSelectedVersion] = useState<string | null>(null);
@@ -76,7 +78,10 @@ export function CodeRunner() {
   useEffect(() => {
     // Connect to WebSocket
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.hostname}:8000/code/ws/run`;
+    const token = authService.getToken();
+    const wsUrl = `${protocol}//${window.location.hostname}:8000/code/ws/run${
+      token ? `?token=${encodeURIComponent(token)}` : ''
+    }`;
 
     const connect = () => {
         const ws = new WebSocket(wsUrl);
@@ -89,16 +94,26 @@ export function CodeRunner() {
             const data = JSON.parse(event.data);
             if (data.error) {
                 setOutput(prev => prev + `Error: ${data.error}\n`);
-            } else {
-                let result = '';
-                if (data.stdout) result += data.stdout;
-                if (data.stderr) result += `Error:\n${data.stderr}`;
-                if (data.exit_code !== undefined && data.exit_code !== 0) {
-                    result += `\nProcess exited with code ${data.exit_code}`;
-                }
-                setOutput(result);
+                setIsRunning(false);
+            } else if (data.type === 'stdout' || data.type === 'stderr') {
+                // Output is streamed in chunks while the code is running
+                const isFirstChunk = !hasOutputRef.current;
+                hasOutputRef.current = true;
+                setOutput(prev => (isFirstChunk ? '' : prev) + data.data);
+            } else if (data.type === 'exit') {
+                const streamed = hasOutputRef.current;
+                setOutput(prev => {
+                    let result = streamed ? prev : '';
+                    if (data.truncated) {
+                        result += '\n[output truncated]';
+                    }
+                    if (data.exit_code !== 0) {
+                        result += `${streamed ? '\n' : ''}Process exited with code ${data.exit_code}`;
+                    }
+                    return result;
+                });
+                setIsRunning(false);
             }
-            setIsRunning(false);
         };
 
         ws.onclose = () => {
@@ -134,6 +149,7 @@ export function CodeRunner() {
     }
 
     setIsRunning(true);
+    hasOutputRef.current = false;
     setOutput(t('runner.running') + '\n');
 
     wsRef.current.send(JSON.stringify({
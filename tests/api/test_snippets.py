@@ -114,18 +114,19 @@ async def test_delete_snippet(async_client: AsyncClient):
 
 
 @pytest.mark.asyncio
-async def test_search_snippets(async_client: AsyncClient, monkeypatch):
+async def test_search_snippets(async_client: AsyncClient):
     headers = await get_auth_headers(async_client, "search_snippet@example.com")
 
     # Mock SearchService
     from unittest.mock import AsyncMock
 
     mock_search = AsyncMock()
-    mock_search.search_snippets.return_value = [1]
+    mock_search.search_snippets.return_value = ([1], None)
 
-    import app.services.search
+    from app.main import app
+    from app.views.snippet import get_search_service
 
-    monkeypatch.setattr(app.services.search, "SearchService", lambda: mock_search)
+    app.dependency_overrides[get_search_service] = lambda: mock_search
 
     # Create Language
     lang_res = await async_client.post("/languages", json={"name": "SearchLang"})
@@ -136,13 +137,18 @@ async def test_search_snippets(async_client: AsyncClient, monkeypatch):
     create_res = await async_client.post("/snippets", json=payload, headers=headers)
     snippet_id = create_res.json()["id"]
 
-    mock_search.search_snippets.return_value = [snippet_id]
+    mock_search.search_snippets.return_value = ([snippet_id], None)
 
-    response = await async_client.get("/snippets?query=find", headers=headers)
+    response = await async_client.get("/snippets?q=find", headers=headers)
     assert response.status_code == 200
     data = response.json()
     assert len(data) == 1
     assert data[0]["id"] == snippet_id
+    # Only the current user's snippets are searched
+    assert mock_search.search_snippets.call_args.kwargs["user_id"] is not None
+
+    response = await async_client.get("/snippets/search?q=find")
+    assert response.status_code == 401
 
 
 @pytest.mark.asyncio
@@ -203,3 +209,9 @@ async def test_pagination(async_client: AsyncClient):
     assert response.status_code == 200
     data = response.json()
     assert len(data) == 1
+
+    # Page sizes are bounded
+    response = await async_client.get("/snippets?limit=1000", headers=headers)
+    assert response.status_code == 422
+    response = await async_client.get("/snippets/search?q=x&limit=0", headers=headers)
+    assert response.status_code == 422
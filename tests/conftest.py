@@ -14,6 +14,7 @@ from app.db import get_db
 from app.limiter import limiter
 from app.main import app
 from app.repos.base import Base
+from app.services.search import create_client as create_search_client
 
 # Disable rate limiting for tests
 limiter.enabled = False
@@ -90,6 +91,8 @@ async def async_client(db_session: AsyncSession) -> AsyncGenerator[AsyncClient,
         yield db_session
 
     app.dependency_overrides[get_db] = override_get_db
+    # The transport doesn't run the lifespan that normally creates it
+    app.state.search_client = create_search_client()
 
     async with AsyncClient(
         transport=ASGITransport(app=app), base_url="http://test"
@@ -97,3 +100,4 @@ async def async_client(db_session: AsyncSession) -> AsyncGenerator[AsyncClient,
         yield client
 
     app.dependency_overrides.clear()
+    await app.state.search_client.close()
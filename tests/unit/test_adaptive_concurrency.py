@@ -0,0 +1,95 @@
+import pytest
+
+from app.metrics import metrics
+from app.services.adaptive_concurrency import AdaptiveConcurrency
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def make_controller(load=0.5, initial=4):
+    return AdaptiveConcurrency(
+        min_limit=1,
+        max_limit=6,
+        initial=initial,
+        target_start_latency=2,
+        target_load=1,
+        target_timeout_rate=0.2,
+        load=lambda: load,
+    )
+
+
+def test_increases_by_one_only_when_saturated():
+    controller = make_controller()
+
+    assert controller.adjust() == "hold"
+    controller.mark_saturated()
+    assert controller.adjust() == "increase"
+    assert controller.limit == 5
+    assert metrics.get("code_runner_concurrency_limit") == 5
+    assert (
+        metrics.get(
+            "code_runner_concurrency_decisions_total",
+            decision="increase",
+            reason="saturated",
+        )
+        == 1
+    )
+
+
+def test_never_exceeds_max_limit():
+    controller = make_controller(initial=6)
+
+    controller.mark_saturated()
+
+    assert controller.adjust() == "hold"
+    assert controller.limit == 6
+
+
+def test_halves_on_high_load_down_to_min():
+    controller = make_controller(load=3)
+
+    assert controller.adjust() == "decrease"
+    assert controller.limit == 2
+    controller.adjust()
+    controller.adjust()
+    assert controller.limit == 1
+    assert (
+        metrics.get(
+            "code_runner_concurrency_decisions_total", decision="hold", reason="load"
+        )
+        == 1
+    )
+
+
+def test_halves_on_slow_sandbox_starts_once_per_burst():
+    controller = make_controller()
+    controller.record(start_latency=5, timed_out=False)
+
+    assert controller.adjust() == "decrease"
+    assert controller.limit == 2
+    # The slow samples were cleared with the decrease
+    assert controller.adjust() == "hold"
+    assert controller.limit == 2
+
+
+def test_timeout_rate_needs_enough_samples():
+    controller = make_controller()
+    for _ in range(4):
+        controller.record(start_latency=0.1, timed_out=True)
+
+    assert controller.adjust() == "hold"
+    controller.record(start_latency=0.1, timed_out=True)
+    assert controller.adjust() == "decrease"
+    assert (
+        metrics.get(
+            "code_runner_concurrency_decisions_total",
+            decision="decrease",
+            reason="timeouts",
+        )
+        == 1
+    )
@@ -0,0 +1,63 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from app.services.artifact_cache import ArtifactCache
+
+
+def make_archive(files: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_make_key_depends_on_image_and_source():
+    key = ArtifactCache.make_key("java", "sha256:a", "class Main {}")
+
+    assert key == ArtifactCache.make_key("java", "sha256:a", "class Main {}")
+    assert key != ArtifactCache.make_key("java", "sha256:b", "class Main {}")
+    assert key != ArtifactCache.make_key("java", "sha256:a", "class Main { }")
+
+
+@pytest.mark.asyncio
+async def test_store_and_lookup(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=1024)
+
+    assert cache.lookup("k1") is None
+    await cache.store("k1", make_archive({"Main.class": b"cafebabe"}))
+
+    assert cache.lookup("k1") == "/artifacts/k1"
+    assert (tmp_path / "k1" / "Main.class").read_bytes() == b"cafebabe"
+    assert oct(os.stat(tmp_path).st_mode & 0o777) == "0o711"
+
+
+@pytest.mark.asyncio
+async def test_evicts_least_recently_used_by_size(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=250)
+    await cache.store("old", make_archive({"a": b"x" * 100}))
+    await cache.store("used", make_archive({"a": b"x" * 100}))
+    os.utime(tmp_path / "old", (1, 1))
+    os.utime(tmp_path / "used", (2, 2))
+    cache.lookup("used")
+
+    await cache.store("new", make_archive({"a": b"x" * 100}))
+
+    assert sorted(os.listdir(tmp_path)) == ["new", "used"]
+    assert cache.total_size() == 200
+
+
+def test_scans_existing_entries_and_drops_staging_dirs(tmp_path):
+    (tmp_path / "k1").mkdir()
+    (tmp_path / "k1" / "main").write_bytes(b"x" * 10)
+    (tmp_path / ".partial").mkdir()
+
+    cache = ArtifactCache(str(tmp_path), max_bytes=1024)
+
+    assert cache.total_size() == 10
+    assert not (tmp_path / ".partial").exists()
@@ -1,57 +1,85 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+import io
+import tarfile
+from contextlib import asynccontextmanager
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import docker
 import pytest
 
-from app.services.code_runner import CodeRunnerService
+from app.config import settings
+from app.services.artifact_cache import ArtifactCache
+from app.services.code_runner import TOOLCHAINS, CodeRunnerService, source_archive
+from app.services.docker_driver import DockerPyDriver
+from app.services.host_slots import HostSlots
 
 
 @pytest.fixture
 def code_runner_service():
     with patch("docker.from_env") as mock_docker:
-        service = CodeRunnerService()
-        service.client = mock_docker.return_value
-        yield service
+        driver = DockerPyDriver(mock_docker.return_value)
+        driver.put_archive = AsyncMock()
+        # Execs with stdin share the mocked exec_start with the other execs
+        driver._exec_with_stdin = MagicMock(
+            side_effect=lambda exec_id, stdin: driver.client.api.exec_start(
+                exec_id, stdin=stdin
+            )
+        )
+        yield CodeRunnerService(driver=driver)
+
+
+def mock_exec(service, frames=(), exit_code=0):
+    """Start sandboxes that answer every exec with the given output."""
+    sandbox = MagicMock(id="sandbox")
+    service.driver.client.containers.run.return_value = sandbox
+    service.driver.client.api.exec_start.return_value = iter(frames)
+    service.driver.client.api.exec_inspect.return_value = {"ExitCode": exit_code}
+    return sandbox
+
+
+def archive_members(data: bytes) -> dict:
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        return {
+            m.name: archive.extractfile(m).read() if m.isfile() else None
+            for m in archive.getmembers()
+        }
 
 
 @pytest.mark.asyncio
 async def test_run_code_success(code_runner_service):
-    mock_container = MagicMock()
-    mock_container.wait.return_value = {"StatusCode": 0}
-    # Mock logs to return bytes
-    mock_container.logs.return_value = b"Hello World\n"
-
-    code_runner_service.client.containers.run.return_value = mock_container
+    sandbox = mock_exec(code_runner_service, [(b"Hello World\n", None)])
 
     result = await code_runner_service.run_code('print("Hello World")', "python")
 
     assert result["stdout"] == "Hello World\n"
     assert result["stderr"] == ""
     assert result["exit_code"] == 0
-    code_runner_service.client.containers.run.assert_called_once()
+    code_runner_service.driver.client.containers.run.assert_called_once()
 
     # Verify tmpfs config
-    args, kwargs = code_runner_service.client.containers.run.call_args
+    args, kwargs = code_runner_service.driver.client.containers.run.call_args
     assert "exec" in kwargs["tmpfs"]["/tmp"]
     assert "exec" in kwargs["tmpfs"]["/root/.cache"]
     assert kwargs["read_only"] is True
     assert kwargs["pids_limit"] == 200
     assert kwargs["mem_limit"] == "200m"
 
+    # The source is delivered as an archive and run without a shell
+    container_id, path, data = code_runner_service.driver.put_archive.call_args.args
+    assert (container_id, path) == ("sandbox", "/tmp")
+    assert archive_members(data) == {"code.py": b'print("Hello World")'}
+    exec_args = code_runner_service.driver.client.api.exec_create.call_args.args
+    assert exec_args == ("sandbox", ["python", "/tmp/code.py"])
+    sandbox.remove.assert_called_once()
+
 
 @pytest.mark.asyncio
 async def test_run_code_timeout(code_runner_service):
-    mock_container = MagicMock()
-
-    # Simulate timeout by making wait sleep longer than timeout
-    async def delayed_wait(*args, **kwargs):
-        import asyncio
-
-        await asyncio.sleep(0.2)
-        return {"StatusCode": 0}
-
-    mock_container.wait.side_effect = lambda: __import__("time").sleep(0.2)
-    code_runner_service.client.containers.run.return_value = mock_container
+    sandbox = mock_exec(code_runner_service)
+    # Simulate timeout by making the exec block longer than the timeout
+    code_runner_service.driver.client.api.exec_start.side_effect = (
+        lambda *args, **kwargs: __import__("time").sleep(0.2) or iter([])
+    )
 
     result = await code_runner_service.run_code(
         "while True: pass", "python", timeout=0.1
@@ -59,13 +87,13 @@ async def test_run_code_timeout(code_runner_service):
 
     assert result["exit_code"] == -1
     assert "Timeout exceeded" in result["stderr"]
-    mock_container.kill.assert_called_once()
+    sandbox.remove.assert_called_once()
 
 
 @pytest.mark.asyncio
 async def test_run_code_docker_error(code_runner_service):
-    code_runner_service.client.containers.run.side_effect = docker.errors.ImageNotFound(
-        "Image not found"
+    code_runner_service.driver.client.containers.run.side_effect = (
+        docker.errors.ImageNotFound("Image not found")
     )
 
     result = await code_runner_service.run_code('print("Hello")', "python")
@@ -74,6 +102,15 @@ async def test_run_code_docker_error(code_runner_service):
     assert "Image for python not found" in result["stderr"]
 
 
+@pytest.mark.asyncio
+async def test_run_code_unsupported_language(code_runner_service):
+    result = await code_runner_service.run_code("puts 1", "ruby")
+
+    assert result["exit_code"] == -1
+    assert "Language ruby is not supported" in result["stderr"]
+    code_runner_service.driver.client.containers.run.assert_not_called()
+
+
 def test_get_available_versions(code_runner_service):
     versions = code_runner_service.get_available_versions()
     assert "python" in versions
@@ -84,29 +121,395 @@ def test_get_available_versions(code_runner_service):
 
 @pytest.mark.asyncio
 async def test_run_code_with_version(code_runner_service):
-    mock_container = MagicMock()
-    mock_container.wait.return_value = {"StatusCode": 0}
-    mock_container.logs.return_value = b"Hello World\n"
-
-    code_runner_service.client.containers.run.return_value = mock_container
+    mock_exec(code_runner_service, [(b"Hello World\n", None)])
 
     await code_runner_service.run_code('print("Hello")', "python", version="3.11")
 
     # Verify that the correct image was used
-    args, kwargs = code_runner_service.client.containers.run.call_args
+    args, kwargs = code_runner_service.driver.client.containers.run.call_args
     assert kwargs["image"] == "python:3.11-slim"
 
 
 @pytest.mark.asyncio
 async def test_run_code_with_invalid_version(code_runner_service):
     # Should fall back to default version if version not found in list
-    mock_container = MagicMock()
-    mock_container.wait.return_value = {"StatusCode": 0}
-    mock_container.logs.return_value = b"Hello World\n"
-    code_runner_service.client.containers.run.return_value = mock_container
+    mock_exec(code_runner_service, [(b"Hello World\n", None)])
 
     await code_runner_service.run_code('print("Hello")', "python", version="99.99")
 
-    args, kwargs = code_runner_service.client.containers.run.call_args
+    args, kwargs = code_runner_service.driver.client.containers.run.call_args
     # Should use default python image
     assert kwargs["image"] == "python:3.9-slim"
+
+
+@pytest.mark.asyncio
+async def test_run_code_uses_pool(code_runner_service):
+    mock_container = MagicMock()
+    code_runner_service.driver.client.api.exec_start.return_value = iter(
+        [(b"Hello World\n", None), (None, b"warning\n")]
+    )
+    code_runner_service.driver.client.api.exec_inspect.return_value = {"ExitCode": 0}
+    code_runner_service.driver.client.containers.run.return_value = mock_container
+    # The pooled container used 1s of CPU before this run and 3s after it
+    stats = iter([1e9])
+    code_runner_service.driver.client.api.stats.side_effect = lambda *a, **kw: {
+        "cpu_stats": {"cpu_usage": {"total_usage": next(stats, 3e9)}},
+        "memory_stats": {"usage": 1024},
+    }
+
+    await code_runner_service.start_pool()
+    code_runner_service.driver.client.containers.run.reset_mock()
+
+    result = await code_runner_service.run_code('print("Hello World")', "python")
+
+    assert result == {
+        "stdout": "Hello World\n",
+        "stderr": "warning\n",
+        "exit_code": 0,
+        "truncated": False,
+        "usage": {"cpu_time": 2.0, "peak_memory": 1024, "wall_time": ANY},
+    }
+    assert code_runner_service.pool.stats()["python:3.9-slim"]["hits"] == 1
+    await code_runner_service.close()
+
+
+@pytest.mark.asyncio
+async def test_run_code_image_missing_fails_fast(code_runner_service):
+    code_runner_service.image_registry = MagicMock()
+    code_runner_service.image_registry.is_present.return_value = False
+
+    result = await code_runner_service.run_code('print("Hello")', "python")
+
+    assert result["exit_code"] == -1
+    assert "Image for python not found" in result["stderr"]
+    code_runner_service.driver.client.containers.run.assert_not_called()
+    code_runner_service.driver.client.images.pull.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_run_code_prefers_runner_image(code_runner_service):
+    code_runner_service.image_registry = MagicMock()
+    code_runner_service.image_registry.is_present.return_value = True
+    code_runner_service.image_registry.has.return_value = True
+    mock_exec(code_runner_service)
+
+    await code_runner_service.run_code('print("Hello")', "python", "3.9")
+
+    args, kwargs = code_runner_service.driver.client.containers.run.call_args
+    assert kwargs["image"] == "code-runner/python:3.9-slim"
+
+
+@pytest.mark.asyncio
+async def test_run_code_streams_demuxed_output(code_runner_service):
+    # "é" split across two frames must still be decoded correctly
+    mock_exec(
+        code_runner_service,
+        [(b"caf\xc3", None), (b"\xa9\n", None), (None, b"warning\n")],
+    )
+
+    chunks = []
+
+    async def on_output(stream, text):
+        chunks.append((stream, text))
+
+    result = await code_runner_service.run_code(
+        'print("café")', "python", on_output=on_output
+    )
+
+    assert chunks == [("stdout", "caf"), ("stdout", "é\n"), ("stderr", "warning\n")]
+    assert result == {
+        "stdout": "café\n",
+        "stderr": "warning\n",
+        "exit_code": 0,
+        "truncated": False,
+        "usage": ANY,
+    }
+
+
+@pytest.mark.asyncio
+async def test_run_code_output_limit_truncates_and_kills(code_runner_service):
+    sandbox = mock_exec(code_runner_service, [(b"x" * 8, None), (b"y" * 8, None)])
+
+    with (
+        patch.object(settings, "CODE_RUNNER_MAX_STDOUT_BYTES", 10),
+        patch.object(settings, "CODE_RUNNER_KILL_ON_OUTPUT_LIMIT", True),
+    ):
+        result = await code_runner_service.run_code("while True: print()", "python")
+
+    assert result["stdout"] == "x" * 8 + "y" * 2
+    assert result["truncated"] is True
+    assert result["exit_code"] == -1
+    assert "Output limit exceeded" in result["stderr"]
+    # The exec is left running, so the sandbox is discarded
+    sandbox.remove.assert_called_once()
+    code_runner_service.driver.client.api.exec_inspect.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_run_code_output_limit_without_kill(code_runner_service):
+    mock_exec(code_runner_service, [(b"x" * 8, None), (b"y" * 8, None), (None, b"err")])
+
+    with (
+        patch.object(settings, "CODE_RUNNER_MAX_STDOUT_BYTES", 10),
+        patch.object(settings, "CODE_RUNNER_KILL_ON_OUTPUT_LIMIT", False),
+    ):
+        result = await code_runner_service.run_code("print('x' * 16)", "python")
+
+    assert result == {
+        "stdout": "x" * 8 + "y" * 2,
+        "stderr": "err",
+        "exit_code": 0,
+        "truncated": True,
+        "usage": ANY,
+    }
+
+
+@pytest.mark.asyncio
+async def test_run_code_holds_host_slot(code_runner_service):
+    held = []
+
+    class FakeHostSlots:
+        @asynccontextmanager
+        async def hold(self):
+            held.append("acquired")
+            yield "token"
+            held.append("released")
+
+    mock_exec(code_runner_service)
+    code_runner_service.host_slots = FakeHostSlots()
+
+    result = await code_runner_service.run_code("pass", "python")
+
+    assert result["exit_code"] == 0
+    assert held == ["acquired", "released"]
+
+
+def test_concurrency_limit_stays_below_host_slots(code_runner_service, monkeypatch):
+    monkeypatch.setattr(settings, "CODE_RUNNER_CONCURRENCY_MAX", 8)
+    code_runner_service.host_slots = HostSlots(MagicMock(), "host", limit=3)
+
+    concurrency = code_runner_service.start_concurrency_controller()
+    for _ in range(10):
+        concurrency.mark_saturated()
+        concurrency.adjust()
+
+    assert concurrency.limit == 3
+
+
+@pytest.mark.asyncio
+async def test_run_batch_compiles_once_and_runs_each_case(code_runner_service):
+    api = code_runner_service.driver.client.api
+    code_runner_service.driver.client.containers.run.return_value = MagicMock()
+    api.exec_start.side_effect = [
+        iter([]),
+        iter([(b"3\n", None)]),
+        iter([(None, b"bad input\n")]),
+    ]
+    api.exec_inspect.side_effect = [{"ExitCode": 0}, {"ExitCode": 0}, {"ExitCode": 1}]
+
+    result = await code_runner_service.run_batch(
+        "class Main {}",
+        "java",
+        cases=[{"stdin": "1 2\n"}, {"stdin": "x", "args": ["--strict"]}],
+    )
+
+    assert result["compile"]["exit_code"] == 0
+    assert [(c["stdout"], c["stderr"], c["exit_code"]) for c in result["cases"]] == [
+        ("3\n", "", 0),
+        ("", "bad input\n", 1),
+    ]
+    commands = [c.args[1] for c in api.exec_create.call_args_list]
+    assert commands[0] == [
+        "javac",
+        "-sourcepath",
+        "/tmp",
+        "-d",
+        "/tmp/build",
+        "/tmp/Main.java",
+    ]
+    assert commands[2] == ["java", "-cp", "/tmp/build", "Main", "--strict"]
+    # Case stdin is written to the process, never put on the command line
+    stdins = [c.kwargs.get("stdin") for c in api.exec_start.call_args_list]
+    assert stdins == [None, b"1 2\n", b"x"]
+    # The idle sandbox is started once and removed afterwards
+    code_runner_service.driver.client.containers.run.assert_called_once()
+    code_runner_service.driver.client.containers.run.return_value.remove.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_run_batch_stops_on_compile_error(code_runner_service):
+    api = code_runner_service.driver.client.api
+    code_runner_service.driver.client.containers.run.return_value = MagicMock()
+    api.exec_start.return_value = iter([(None, b"Main.java:1: error\n")])
+    api.exec_inspect.return_value = {"ExitCode": 1}
+
+    result = await code_runner_service.run_batch(
+        "class Main {", "java", cases=[{"stdin": ""}]
+    )
+
+    assert result["compile"]["exit_code"] == 1
+    assert result["compile"]["stderr"] == "Main.java:1: error\n"
+    assert result["cases"] == []
+    api.exec_create.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_run_batch_kills_case_stopped_by_output_limit(code_runner_service):
+    api = code_runner_service.driver.client.api
+    sandbox = MagicMock()
+    sandbox.exec_run.return_value = MagicMock(exit_code=0, output=(b"", b""))
+    code_runner_service.driver.client.containers.run.return_value = sandbox
+    api.exec_start.side_effect = [
+        iter([(b"x" * 8, None), (b"y" * 8, None)]),
+        iter([(b"ok\n", None)]),
+    ]
+    api.exec_inspect.return_value = {"ExitCode": 0}
+    release = AsyncMock()
+
+    with (
+        patch.object(settings, "CODE_RUNNER_MAX_STDOUT_BYTES", 10),
+        patch.object(settings, "CODE_RUNNER_KILL_ON_OUTPUT_LIMIT", True),
+        patch.object(code_runner_service, "_release_sandbox", release),
+    ):
+        result = await code_runner_service.run_batch(
+            "while True: print()", "python", cases=[{"stdin": ""}, {"stdin": ""}]
+        )
+
+    flooded, next_case = result["cases"]
+    assert flooded["exit_code"] == -1
+    assert "Output limit exceeded" in flooded["stderr"]
+    # The flooding exec is killed before the next case runs
+    kill_command = sandbox.exec_run.call_args.args[0]
+    assert "kill -9 -1" in kill_command[-1]
+    assert (next_case["stdout"], next_case["exit_code"]) == ("ok\n", 0)
+    assert release.call_args.args[1] is False
+
+
+@pytest.mark.asyncio
+async def test_run_batch_reports_sandbox_failure(code_runner_service):
+    code_runner_service.driver.client.containers.run.side_effect = (
+        docker.errors.APIError("daemon unavailable")
+    )
+
+    result = await code_runner_service.run_batch(
+        "print(1)", "python", cases=[{"stdin": ""}]
+    )
+
+    assert result["compile"]["exit_code"] == -1
+    assert "daemon unavailable" in result["compile"]["stderr"]
+    assert result["cases"] == []
+
+
+@pytest.mark.asyncio
+async def test_cancelled_batch_discards_its_sandbox(code_runner_service):
+    mock_exec(code_runner_service)
+    release = AsyncMock()
+
+    async def never_finishes(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    with (
+        patch.object(code_runner_service, "_release_sandbox", release),
+        patch.object(code_runner_service, "_run_step", never_finishes),
+    ):
+        batch = asyncio.create_task(
+            code_runner_service.run_batch("print(1)", "python", cases=[{}])
+        )
+        await asyncio.sleep(0.05)
+        batch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await batch
+
+    assert release.call_args.args[1] is False
+
+
+@pytest.mark.asyncio
+async def test_run_code_reuses_cached_build(code_runner_service, tmp_path):
+    api = code_runner_service.driver.client.api
+    code_runner_service.driver.client.containers.run.return_value = MagicMock()
+    code_runner_service.driver.client.images.get.return_value.id = "sha256:go"
+    code_runner_service.artifact_cache = ArtifactCache(str(tmp_path), 1 << 20)
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        info = tarfile.TarInfo("./main")
+        info.size, info.mode = 3, 0o755
+        tar.addfile(info, io.BytesIO(b"bin"))
+
+    # Miss: build, archive the build, then run it
+    api.exec_start.side_effect = [
+        iter([]),
+        iter([(archive.getvalue(), None)]),
+        iter([(b"hi\n", None)]),
+    ]
+    api.exec_inspect.return_value = {"ExitCode": 0}
+    first = await code_runner_service.run_code("package main", "go")
+
+    # Hit: only the run exec, from the read-only cache mount
+    api.exec_create.reset_mock()
+    api.exec_start.side_effect = [iter([(b"hi\n", None)])]
+    second = await code_runner_service.run_code("package main", "go")
+
+    assert first["stdout"] == second["stdout"] == "hi\n"
+    key = ArtifactCache.make_key("go", "sha256:go", "package main")
+    assert (tmp_path / key / "main").read_bytes() == b"bin"
+    api.exec_create.assert_called_once()
+    assert api.exec_create.call_args.args[1] == [f"/artifacts/{key}/main"]
+
+
+@pytest.mark.asyncio
+async def test_cached_build_still_gets_extra_files(code_runner_service, tmp_path):
+    mock_exec(code_runner_service, [(b"hi\n", None)])
+    code_runner_service.driver.client.images.get.return_value.id = "sha256:go"
+    files = [{"name": "input.txt", "content": "42"}]
+    key = ArtifactCache.make_key("go", "sha256:go", "package main", files)
+    (tmp_path / key).mkdir()
+    (tmp_path / key / "main").write_bytes(b"bin")
+    code_runner_service.artifact_cache = ArtifactCache(str(tmp_path), 1 << 20)
+
+    result = await code_runner_service.run_code("package main", "go", files=files)
+
+    assert result["stdout"] == "hi\n"
+    # Only the cached binary ran, next to the files it reads
+    api = code_runner_service.driver.client.api
+    assert api.exec_create.call_args.args[1] == [f"/artifacts/{key}/main"]
+    api.exec_create.assert_called_once()
+    archive = code_runner_service.driver.put_archive.call_args.args[2]
+    assert archive_members(archive)["input.txt"] == b"42"
+
+
+def test_source_archive_places_extra_files_next_to_the_source():
+    files = [
+        {"name": "util/strings.go", "content": "package util"},
+        {"name": "code.go", "content": "shadowed"},
+    ]
+
+    members = archive_members(source_archive("package main", TOOLCHAINS["go"], files))
+
+    assert members == {
+        "build": None,
+        "util": None,
+        "util/strings.go": b"package util",
+        "code.go": b"package main",
+    }
+
+
+@pytest.mark.asyncio
+async def test_run_code_builds_every_go_file_of_the_package(code_runner_service):
+    mock_exec(code_runner_service)
+    files = [
+        {"name": "helpers.go", "content": "package main"},
+        {"name": "README.md", "content": "notes"},
+    ]
+
+    await code_runner_service.run_code("package main", "go", files=files)
+
+    compile_args = code_runner_service.driver.client.api.exec_create.call_args_list[0]
+    assert compile_args.args[1] == [
+        "go",
+        "build",
+        "-o",
+        "/tmp/build/main",
+        "/tmp/code.go",
+        "/tmp/helpers.go",
+    ]
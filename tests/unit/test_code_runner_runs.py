@@ -0,0 +1,300 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth import get_optional_user_id
+from app.errors.code_runner import QuotaExceededError
+from app.handlers import register_handlers
+from app.redis import get_redis
+from app.schemas.code_runner import CodeRunRequest
+from app.services.result_dispatcher import ResultDispatcher
+from app.views.code_runner import router, submit
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+def make_client(redis_client):
+    app = FastAPI()
+    register_handlers(app)
+    app.include_router(router)
+
+    async def override_get_redis():
+        yield redis_client
+
+    app.dependency_overrides[get_redis] = override_get_redis
+    return TestClient(app)
+
+
+def complete(redis_client, task_id, result):
+    redis_client.data[f"code_runs:{task_id}"] = json.dumps(
+        {"task_id": task_id, "status": "completed", "result": result}
+    )
+
+
+def test_submit_returns_queued_run_and_publishes_it():
+    redis_client = FakeRedis()
+    publish_event = AsyncMock()
+
+    with (
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch("app.views.code_runner.admit_run", AsyncMock()),
+    ):
+        response = make_client(redis_client).post(
+            "/code/runs", json={"code": "print(1)", "language": "python"}
+        )
+
+    assert response.status_code == 202
+    run = response.json()
+    assert run["status"] == "queued"
+    assert publish_event.call_args.args[2]["task_id"] == run["task_id"]
+
+
+def test_submit_with_idempotency_key_runs_once():
+    redis_client = FakeRedis()
+    publish_event = AsyncMock()
+    payload = {"code": "print(1)", "language": "python"}
+    headers = {"Idempotency-Key": "retry-me"}
+    admit_run = AsyncMock()
+
+    with (
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch("app.views.code_runner.admit_run", admit_run),
+    ):
+        client = make_client(redis_client)
+        first = client.post("/code/runs", json=payload, headers=headers).json()
+        second = client.post("/code/runs", json=payload, headers=headers).json()
+
+    assert first["task_id"] == second["task_id"]
+    publish_event.assert_called_once()
+    admit_run.assert_called_once()
+
+
+def test_concurrent_retries_with_same_key_publish_once():
+    redis_client = FakeRedis()
+    publish_event = AsyncMock()
+    request = CodeRunRequest(code="print(1)", language="python")
+    http_request = MagicMock()
+    http_request.client.host = "10.0.0.1"
+
+    async def slow_admit_run(*args):
+        # The retry arrives while the first request is still being admitted
+        await asyncio.sleep(0.01)
+
+    async def submit_twice():
+        return await asyncio.gather(
+            *(
+                submit(request, "run_code", http_request, "key-1", None, redis_client)
+                for _ in range(2)
+            )
+        )
+
+    with (
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch("app.views.code_runner.admit_run", slow_admit_run),
+    ):
+        first, second = asyncio.run(submit_twice())
+
+    assert first == second
+    assert first["status"] == "queued"
+    publish_event.assert_called_once()
+
+
+def test_idempotency_keys_are_scoped_to_the_owner():
+    redis_client = FakeRedis()
+    publish_event = AsyncMock()
+    payload = {"code": "print(1)", "language": "python"}
+    headers = {"Idempotency-Key": "shared"}
+
+    with (
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch("app.views.code_runner.admit_run", AsyncMock()),
+    ):
+        client = make_client(redis_client)
+        client.app.dependency_overrides[get_optional_user_id] = lambda: 1
+        first = client.post("/code/runs", json=payload, headers=headers).json()
+        client.app.dependency_overrides[get_optional_user_id] = lambda: 2
+        second = client.post("/code/runs", json=payload, headers=headers).json()
+
+    assert first["task_id"] != second["task_id"]
+    assert publish_event.call_count == 2
+
+
+def test_refused_run_releases_idempotency_key():
+    redis_client = FakeRedis()
+    publish_event = AsyncMock()
+    payload = {"code": "print(1)", "language": "python"}
+    headers = {"Idempotency-Key": "retry-me"}
+    admit_run = AsyncMock(side_effect=[QuotaExceededError("Run limit reached"), None])
+
+    with (
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch("app.views.code_runner.admit_run", admit_run),
+    ):
+        client = make_client(redis_client)
+        refused = client.post("/code/runs", json=payload, headers=headers)
+        retried = client.post("/code/runs", json=payload, headers=headers)
+
+    assert refused.status_code == 429
+    assert retried.status_code == 202
+    assert retried.json()["status"] == "queued"
+    publish_event.assert_called_once()
+
+
+def test_submit_batch_publishes_cases():
+    redis_client = FakeRedis()
+    publish_event = AsyncMock()
+    payload = {
+        "code": "print(input())",
+        "language": "python",
+        "cases": [{"stdin": "1"}, {"stdin": "2", "args": ["-v"]}],
+    }
+
+    with (
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch("app.views.code_runner.admit_run", AsyncMock()),
+    ):
+        response = make_client(redis_client).post("/code/runs/batch", json=payload)
+
+    assert response.status_code == 202
+    queue_name, event, data = publish_event.call_args.args
+    assert event == "run_batch"
+    assert data["cases"] == [
+        {"stdin": "1", "args": []},
+        {"stdin": "2", "args": ["-v"]},
+    ]
+    assert data["case_timeout"] == 5
+
+
+def test_submit_rejects_file_names_outside_the_source_dir():
+    publish_event = AsyncMock()
+    payload = {
+        "code": "import util",
+        "language": "python",
+        "files": [{"name": "../etc/passwd", "content": "x"}],
+    }
+
+    with (
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch("app.views.code_runner.admit_run", AsyncMock()),
+    ):
+        response = make_client(FakeRedis()).post("/code/runs", json=payload)
+
+    assert response.status_code == 422
+    publish_event.assert_not_called()
+
+
+def test_submit_over_budget_returns_429():
+    redis_client = FakeRedis()
+    publish_event = AsyncMock()
+    admit_run = AsyncMock(side_effect=QuotaExceededError("Run limit of 1 reached"))
+
+    with (
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch("app.views.code_runner.admit_run", admit_run),
+    ):
+        response = make_client(redis_client).post(
+            "/code/runs", json={"code": "print(1)", "language": "python"}
+        )
+
+    assert response.status_code == 429
+    assert response.json() == {"detail": "Run limit of 1 reached"}
+    publish_event.assert_not_called()
+    assert redis_client.data == {}
+
+
+def test_readiness_is_503_until_every_image_is_present():
+    readiness = AsyncMock(
+        return_value={"ready": False, "workers": 1, "images": {"go:1.21": "pulling"}}
+    )
+
+    with patch("app.views.code_runner.ImageUsage.readiness", readiness):
+        response = make_client(FakeRedis()).get("/code/ready")
+
+    assert response.status_code == 503
+    assert response.json()["images"] == {"go:1.21": "pulling"}
+
+
+def test_get_unknown_run_returns_404():
+    response = make_client(FakeRedis()).get("/code/runs/missing")
+
+    assert response.status_code == 404
+
+
+def test_get_returns_stored_result():
+    redis_client = FakeRedis()
+    result = {
+        "stdout": "1\n",
+        "stderr": "",
+        "exit_code": 0,
+        "truncated": False,
+        "usage": {"cpu_time": 0.02, "peak_memory": 1024, "wall_time": 0.05},
+    }
+    complete(redis_client, "task-1", result)
+
+    response = make_client(redis_client).get("/code/runs/task-1")
+
+    assert response.json() == {
+        "task_id": "task-1",
+        "status": "completed",
+        "result": result,
+    }
+
+
+def test_get_long_polls_until_exit_frame():
+    redis_client = FakeRedis()
+    dispatcher = ResultDispatcher()
+    result = {"stdout": "", "stderr": "", "exit_code": 0, "truncated": False}
+
+    async def finish_run():
+        complete(redis_client, "task-1", result)
+        dispatcher.dispatch("task_results:task-1", json.dumps({"type": "exit"}))
+
+    original_subscribe = dispatcher.subscribe
+
+    def subscribe(task_id):
+        queue = original_subscribe(task_id)
+        asyncio.get_running_loop().call_soon(
+            lambda: asyncio.ensure_future(finish_run())
+        )
+        return queue
+
+    dispatcher.subscribe = subscribe
+    redis_client.data["code_runs:task-1"] = json.dumps(
+        {"task_id": "task-1", "status": "queued"}
+    )
+
+    with patch("app.views.code_runner.result_dispatcher", dispatcher):
+        response = make_client(redis_client).get("/code/runs/task-1?wait=5")
+
+    assert response.json()["status"] == "completed"
+    assert dispatcher._queues == {}
+
+
+def test_get_long_poll_times_out_with_queued_run():
+    redis_client = FakeRedis()
+    redis_client.data["code_runs:task-1"] = json.dumps(
+        {"task_id": "task-1", "status": "queued"}
+    )
+
+    with patch("app.views.code_runner.result_dispatcher", ResultDispatcher()):
+        response = make_client(redis_client).get("/code/runs/task-1?wait=0.05")
+
+    assert response.json() == {"task_id": "task-1", "status": "queued", "result": None}
@@ -0,0 +1,420 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.workers.code_runner import (
+    cancel_run,
+    consume,
+    process_message,
+    running_tasks,
+)
+
+
+def make_message(event="run_code", **data):
+    message = MagicMock()
+    message.process.return_value.__aenter__.return_value = None
+    message.process.return_value.__aexit__.return_value = None
+    message.body = json.dumps(
+        {
+            "event": event,
+            "data": {
+                "task_id": "task-1",
+                "code": "print(1)",
+                "language": "python",
+                "version": "3.9",
+                **data,
+            },
+        }
+    )
+    return message
+
+
+def make_redis():
+    redis_client = AsyncMock()
+    redis_client.exists.return_value = 0
+    redis_client.get.return_value = None
+    return redis_client
+
+
+def patch_redis(redis_client):
+    async def fake_get_redis():
+        yield redis_client
+
+    return patch("app.workers.code_runner.get_redis", fake_get_redis)
+
+
+@pytest.mark.asyncio
+async def test_process_message_publishes_result():
+    redis_client = make_redis()
+    service = AsyncMock()
+    service.run_code.return_value = {"stdout": "1\n", "stderr": "", "exit_code": 0}
+
+    with patch_redis(redis_client):
+        await process_message(make_message(), service)
+
+    service.run_code.assert_called_once()
+    assert service.run_code.call_args.args == ("print(1)", "python", "3.9")
+    redis_client.publish.assert_called_once_with(
+        "task_results:task-1",
+        json.dumps({"type": "exit", "exit_code": 0, "truncated": False, "usage": None}),
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_message_streams_output_frames():
+    redis_client = make_redis()
+    service = AsyncMock()
+
+    async def run_code(code, language, version, on_output, files=None):
+        await on_output("stdout", "1\n")
+        await on_output("stderr", "oops")
+        return {"stdout": "1\n", "stderr": "oops", "exit_code": 1}
+
+    service.run_code.side_effect = run_code
+
+    with patch_redis(redis_client):
+        await process_message(make_message(), service)
+
+    frames = [json.loads(c.args[1]) for c in redis_client.publish.call_args_list]
+    assert frames == [
+        {"type": "stdout", "data": "1\n"},
+        {"type": "stderr", "data": "oops"},
+        {"type": "exit", "exit_code": 1, "truncated": False, "usage": None},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_process_message_result_cache_hit():
+    redis_client = make_redis()
+    service = AsyncMock()
+    cached = {"stdout": "1\n", "stderr": "", "exit_code": 0}
+
+    with (
+        patch_redis(redis_client),
+        patch("app.workers.code_runner.settings") as mock_settings,
+        patch("app.workers.code_runner.ResultCache") as mock_cache_cls,
+    ):
+        mock_settings.CODE_RUNNER_RESULT_CACHE_ENABLED = True
+        mock_cache_cls.return_value.get = AsyncMock(return_value=cached)
+
+        await process_message(make_message(), service)
+
+    service.run_code.assert_not_called()
+    frames = [json.loads(c.args[1]) for c in redis_client.publish.call_args_list]
+    assert frames == [
+        {"type": "stdout", "data": "1\n"},
+        {"type": "exit", "exit_code": 0, "truncated": False, "usage": None},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_process_message_non_deterministic_bypasses_cache():
+    redis_client = make_redis()
+    service = AsyncMock()
+    service.run_code.return_value = {"stdout": "", "stderr": "", "exit_code": 0}
+
+    with (
+        patch_redis(redis_client),
+        patch("app.workers.code_runner.settings") as mock_settings,
+        patch("app.workers.code_runner.ResultCache") as mock_cache_cls,
+    ):
+        mock_settings.CODE_RUNNER_RESULT_CACHE_ENABLED = True
+
+        await process_message(make_message(deterministic=False), service)
+
+    mock_cache_cls.return_value.get.assert_not_called()
+    service.run_code.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_consume_runs_messages_concurrently_and_drains():
+    queue = AsyncMock()
+    stop_event = asyncio.Event()
+    started = []
+    release = asyncio.Event()
+
+    async def slow_process(message, service):
+        started.append(message)
+        await release.wait()
+
+    m1, m2 = make_message(user_id=1), make_message(user_id=2)
+
+    async def fake_consume(callback):
+        await callback(m1)
+        await callback(m2)
+        return "tag"
+
+    queue.consume.side_effect = fake_consume
+
+    with patch("app.workers.code_runner.process_message", slow_process):
+        consumer = asyncio.create_task(consume(queue, AsyncMock(), stop_event))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        assert started == [m1, m2]
+
+        stop_event.set()
+        await asyncio.sleep(0)
+        assert not consumer.done()
+
+        release.set()
+        await consumer
+
+    queue.cancel.assert_called_once_with("tag")
+
+
+@pytest.mark.asyncio
+async def test_consume_interleaves_users_and_requeues_backlog_on_stop():
+    queue = AsyncMock()
+    stop_event = asyncio.Event()
+    started = []
+    release = asyncio.Event()
+    flood = [make_message(user_id=1, code=f"print({i})") for i in range(4)]
+    other = make_message(user_id=2)
+    for message in flood:
+        message.nack = AsyncMock()
+
+    async def slow_process(message, service):
+        started.append(message)
+        await release.wait()
+
+    async def fake_consume(callback):
+        for message in [*flood, other]:
+            await callback(message)
+        return "tag"
+
+    queue.consume.side_effect = fake_consume
+
+    with (
+        patch("app.workers.code_runner.process_message", slow_process),
+        patch("app.workers.code_runner.settings") as mock_settings,
+    ):
+        mock_settings.MAX_CONCURRENT_EXECUTIONS = 3
+        mock_settings.CODE_RUNNER_MAX_IN_FLIGHT_PER_USER = 2
+        mock_settings.CODE_RUNNER_MAX_QUEUED_PER_USER = 2
+        mock_settings.CODE_RUNNER_USER_WEIGHTS = ""
+        consumer = asyncio.create_task(consume(queue, AsyncMock(), stop_event))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        # User 1 is capped at two runs, so user 2 gets the third slot
+        assert started == [flood[0], flood[1], other]
+
+        stop_event.set()
+        await asyncio.sleep(0)
+        release.set()
+        await consumer
+
+    assert len(started) == 3
+    flood[2].nack.assert_called_once_with(requeue=True)
+    flood[3].nack.assert_called_once_with(requeue=True)
+
+
+@pytest.mark.asyncio
+async def test_consume_defers_flood_that_would_fill_prefetch_window():
+    queue = MagicMock(name="queue")
+    queue.name = "code_execution_tasks"
+    queue.cancel = AsyncMock()
+    publish = queue.channel.default_exchange.publish = AsyncMock()
+    stop_event = asyncio.Event()
+    started = []
+    release = asyncio.Event()
+    # The flood takes the whole prefetch window, the other user is behind it
+    flood = [make_message(user_id=1, code=f"print({i})") for i in range(20)]
+    other = make_message(user_id=2)
+    for message in [*flood, other]:
+        message.body = message.body.encode()
+        message.headers = {}
+        message.delivery_mode = 2
+        message.ack = AsyncMock()
+        message.nack = AsyncMock()
+
+    async def slow_process(message, service):
+        started.append(message)
+        await release.wait()
+
+    async def fake_consume(callback):
+        for message in flood:
+            await callback(message)
+        # Deferred runs free their slots, letting the other user's run in
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        await callback(other)
+        return "tag"
+
+    queue.consume = AsyncMock(side_effect=fake_consume)
+
+    with (
+        patch("app.workers.code_runner.process_message", slow_process),
+        patch("app.workers.code_runner.DEFER_DELAY", 0),
+        patch("app.workers.code_runner.settings") as mock_settings,
+    ):
+        mock_settings.MAX_CONCURRENT_EXECUTIONS = 3
+        mock_settings.CODE_RUNNER_MAX_IN_FLIGHT_PER_USER = 2
+        mock_settings.CODE_RUNNER_MAX_QUEUED_PER_USER = 4
+        mock_settings.CODE_RUNNER_USER_WEIGHTS = ""
+        consumer = asyncio.create_task(consume(queue, AsyncMock(), stop_event))
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+        assert started == [flood[0], flood[1], other]
+        # Two running and four queued, the rest went to the back of the queue
+        assert publish.await_count == 14
+        assert publish.await_args.kwargs["routing_key"] == "code_execution_tasks"
+        for message in flood[6:]:
+            message.ack.assert_awaited_once()
+            message.nack.assert_not_called()
+
+        stop_event.set()
+        await asyncio.sleep(0)
+        release.set()
+        await consumer
+
+    for message in flood[2:6]:
+        message.nack.assert_called_once_with(requeue=True)
+
+
+@pytest.mark.asyncio
+async def test_consume_follows_adaptive_limit():
+    queue = AsyncMock()
+    stop_event = asyncio.Event()
+    release = asyncio.Event()
+    messages = [make_message(user_id=i) for i in range(3)]
+    for message in messages:
+        message.nack = AsyncMock()
+    started = []
+    concurrency = MagicMock(limit=1)
+
+    async def slow_process(message, service):
+        started.append(message)
+        await release.wait()
+
+    async def fake_consume(callback):
+        for message in messages:
+            await callback(message)
+        return "tag"
+
+    queue.consume.side_effect = fake_consume
+
+    with patch("app.workers.code_runner.process_message", slow_process):
+        consumer = asyncio.create_task(
+            consume(queue, AsyncMock(), stop_event, concurrency)
+        )
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        assert started == [messages[0]]
+        concurrency.mark_saturated.assert_called()
+
+        stop_event.set()
+        await asyncio.sleep(0)
+        release.set()
+        await consumer
+
+
+@pytest.mark.asyncio
+async def test_process_message_cancelled_while_running():
+    redis_client = make_redis()
+    service = AsyncMock()
+    started = asyncio.Event()
+
+    async def run_code(code, language, version, on_output, files=None):
+        started.set()
+        await asyncio.sleep(10)
+
+    service.run_code.side_effect = run_code
+
+    with patch_redis(redis_client):
+        processing = asyncio.create_task(process_message(make_message(), service))
+        await started.wait()
+        cancel_run("task-1")
+        await processing
+
+    frames = [json.loads(c.args[1]) for c in redis_client.publish.call_args_list]
+    assert frames == [
+        {"type": "exit", "exit_code": -1, "truncated": False, "cancelled": True}
+    ]
+    assert "task-1" not in running_tasks
+
+
+@pytest.mark.asyncio
+async def test_process_message_cancelled_before_start():
+    redis_client = make_redis()
+    redis_client.exists.return_value = 1
+    service = AsyncMock()
+
+    with patch_redis(redis_client):
+        await process_message(make_message(), service)
+
+    service.run_code.assert_called_once()
+    redis_client.exists.assert_called_once_with("task_cancelled:task-1")
+    frames = [json.loads(c.args[1]) for c in redis_client.publish.call_args_list]
+    assert frames[-1]["cancelled"] is True
+
+
+@pytest.mark.asyncio
+async def test_process_message_stores_result_before_exit_frame():
+    redis_client = make_redis()
+    service = AsyncMock()
+    service.run_code.return_value = {"stdout": "1\n", "stderr": "", "exit_code": 0}
+    calls = []
+    redis_client.set.side_effect = lambda *args, **kwargs: calls.append("set")
+    redis_client.publish.side_effect = lambda *args: calls.append("publish")
+
+    with patch_redis(redis_client):
+        await process_message(make_message(), service)
+
+    assert calls == ["set", "publish"]
+    key, value = redis_client.set.call_args.args
+    assert key == "code_runs:task-1"
+    assert json.loads(value) == {
+        "task_id": "task-1",
+        "status": "completed",
+        "result": {"stdout": "1\n", "stderr": "", "exit_code": 0},
+    }
+
+
+@pytest.mark.asyncio
+async def test_process_message_skips_finished_redelivery():
+    redis_client = make_redis()
+    redis_client.get.return_value = json.dumps(
+        {"task_id": "task-1", "status": "completed", "result": {}}
+    )
+    service = AsyncMock()
+
+    with patch_redis(redis_client):
+        await process_message(make_message(), service)
+
+    service.run_code.assert_not_called()
+    redis_client.publish.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_process_message_runs_batch():
+    redis_client = make_redis()
+    service = AsyncMock()
+    step = {"stdout": "", "stderr": "", "exit_code": 0, "truncated": False}
+    service.run_batch.return_value = {
+        "compile": step,
+        "cases": [step],
+        "usage": None,
+    }
+    cases = [{"stdin": "1", "args": []}]
+
+    with patch_redis(redis_client):
+        await process_message(
+            make_message("run_batch", cases=cases, case_timeout=2), service
+        )
+
+    service.run_code.assert_not_called()
+    assert service.run_batch.call_args.kwargs == {
+        "cases": cases,
+        "case_timeout": 2,
+        "files": None,
+    }
+    frames = [json.loads(c.args[1]) for c in redis_client.publish.call_args_list]
+    assert frames == [
+        {"type": "exit", "exit_code": 0, "truncated": False, "usage": None}
+    ]
@@ -0,0 +1,131 @@
+from unittest.mock import AsyncMock, patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from app.errors.code_runner import QuotaExceededError
+from app.services.result_dispatcher import ResultDispatcher
+from app.views.code_runner import router
+
+
+def make_client():
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_ws_runs_are_tagged_and_can_be_cancelled():
+    dispatcher = ResultDispatcher()
+    dispatcher.cancel = AsyncMock(side_effect=dispatcher.unsubscribe)
+    published = []
+
+    async def publish_event(queue_name, event_type, data):
+        published.append(data)
+        if data["code"] == "print(1)":
+            queue = dispatcher._queues[data["task_id"]][0]
+            queue.put_nowait({"type": "stdout", "data": "1\n"})
+            queue.put_nowait({"type": "exit", "exit_code": 0})
+
+    with (
+        patch("app.views.code_runner.result_dispatcher", dispatcher),
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch("app.views.code_runner.admit_run", AsyncMock()),
+    ):
+        client = make_client()
+        with client.websocket_connect("/code/ws/run") as websocket:
+            websocket.send_json(
+                {"run_id": "slow", "code": "import time", "language": "python"}
+            )
+            websocket.send_json(
+                {"run_id": "fast", "code": "print(1)", "language": "python"}
+            )
+
+            assert websocket.receive_json() == {
+                "type": "stdout",
+                "data": "1\n",
+                "run_id": "fast",
+            }
+            assert websocket.receive_json() == {
+                "type": "exit",
+                "exit_code": 0,
+                "run_id": "fast",
+            }
+
+            websocket.send_json({"type": "cancel", "run_id": "slow"})
+            frame = websocket.receive_json()
+            assert frame["run_id"] == "slow"
+            assert frame["cancelled"] is True
+
+    slow_task_id = published[0]["task_id"]
+    dispatcher.cancel.assert_called_once_with(slow_task_id)
+    assert dispatcher._queues == {}
+
+
+def test_ws_disconnect_cancels_pending_runs():
+    dispatcher = ResultDispatcher()
+    dispatcher.cancel = AsyncMock(side_effect=dispatcher.unsubscribe)
+
+    with (
+        patch("app.views.code_runner.result_dispatcher", dispatcher),
+        patch("app.views.code_runner.publish_event", AsyncMock()),
+        patch("app.views.code_runner.admit_run", AsyncMock()),
+    ):
+        client = make_client()
+        with client.websocket_connect("/code/ws/run") as websocket:
+            websocket.send_json({"code": "while True: pass", "language": "python"})
+            # Round trip to make sure the run was registered
+            websocket.send_json({"type": "cancel", "run_id": "unknown"})
+            assert websocket.receive_json()["error"] == "Unknown run"
+
+    dispatcher.cancel.assert_called_once()
+
+
+def test_ws_rejects_runs_over_budget():
+    publish_event = AsyncMock()
+
+    with (
+        patch("app.views.code_runner.publish_event", publish_event),
+        patch(
+            "app.views.code_runner.admit_run",
+            AsyncMock(side_effect=QuotaExceededError("Run limit of 1 reached")),
+        ),
+    ):
+        client = make_client()
+        with client.websocket_connect("/code/ws/run") as websocket:
+            websocket.send_json({"run_id": "r", "code": "1", "language": "python"})
+            assert websocket.receive_json() == {
+                "error": "Run limit of 1 reached",
+                "run_id": "r",
+            }
+
+    publish_event.assert_not_called()
+
+
+def test_ws_redis_failure_fails_only_that_run():
+    dispatcher = ResultDispatcher()
+    dispatcher.cancel = AsyncMock(side_effect=dispatcher.unsubscribe)
+    admit_run = AsyncMock(side_effect=[None, RedisConnectionError("down")])
+
+    with (
+        patch("app.views.code_runner.result_dispatcher", dispatcher),
+        patch("app.views.code_runner.publish_event", AsyncMock()),
+        patch("app.views.code_runner.admit_run", admit_run),
+    ):
+        client = make_client()
+        with client.websocket_connect("/code/ws/run") as websocket:
+            websocket.send_json({"run_id": "a", "code": "1", "language": "python"})
+            websocket.send_json({"run_id": "b", "code": "2", "language": "python"})
+            frame = websocket.receive_json()
+            assert frame["run_id"] == "b"
+            assert "down" in frame["error"]
+
+            # The first run is still in flight on the same socket
+            websocket.send_json({"run_id": "a", "code": "1", "language": "python"})
+            assert websocket.receive_json() == {
+                "error": "Run id already in use",
+                "run_id": "a",
+            }
+
+    assert admit_run.await_args_list[0].args[0] is dispatcher.client
+    dispatcher.cancel.assert_called_once()
@@ -0,0 +1,98 @@
+import itertools
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app.metrics import metrics
+from app.services.code_runner import SANDBOX_OPTIONS
+from app.services.container_pool import RECYCLE_COMMAND, ContainerPool
+
+
+def make_create_container():
+    ids = itertools.count()
+    return AsyncMock(side_effect=lambda image: f"container-{next(ids)}")
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.mark.asyncio
+async def test_pool_start_prewarms_min_size():
+    create_container = make_create_container()
+    driver = AsyncMock()
+    pool = ContainerPool(driver, create_container, min_size=2)
+
+    await pool.start(["python:3.9-slim", "node:16-alpine"])
+
+    assert create_container.call_count == 4
+    assert pool.stats()["python:3.9-slim"]["idle"] == 2
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_acquire_hit_and_miss():
+    create_container = make_create_container()
+    driver = AsyncMock()
+    pool = ContainerPool(driver, create_container, min_size=1)
+    await pool.start(["python:3.9-slim"])
+
+    first = await pool.acquire("python:3.9-slim")
+    second = await pool.acquire("python:3.9-slim")
+
+    stats = pool.stats()["python:3.9-slim"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert first is not second
+
+    await pool.release(first)
+    await pool.release(second)
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_release_recycles_until_max_uses():
+    create_container = make_create_container()
+    driver = AsyncMock()
+    pool = ContainerPool(driver, create_container, min_size=0, max_uses=2)
+    await pool.start(["python:3.9-slim"])
+
+    pooled = await pool.acquire("python:3.9-slim")
+    await pool.release(pooled)
+    driver.exec_run.assert_called_once()
+    driver.remove.assert_not_called()
+
+    assert await pool.acquire("python:3.9-slim") is pooled
+    await pool.release(pooled)
+    driver.remove.assert_called_once_with(pooled.container_id, force=True)
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_discards_unhealthy_and_expired():
+    create_container = make_create_container()
+    driver = AsyncMock()
+    pool = ContainerPool(driver, create_container, min_size=0, ttl=0)
+    await pool.start(["python:3.9-slim"])
+
+    pooled = await pool.acquire("python:3.9-slim")
+    await pool.release(pooled, healthy=False)
+    driver.remove.assert_called_once_with(pooled.container_id, force=True)
+
+    expired = await pool.acquire("python:3.9-slim")
+    await pool.release(expired)
+    driver.remove.assert_called_with(expired.container_id, force=True)
+    driver.exec_run.assert_not_called()
+    await pool.close()
+
+
+def test_recycle_command_wipes_every_writable_mount():
+    script = RECYCLE_COMMAND[-1]
+
+    for mount in [*SANDBOX_OPTIONS["tmpfs"], "/dev/shm"]:
+        assert f" {mount} " in script
+    # Hidden files, including names starting with "..", go too
+    assert "-mindepth 1 -delete" in script
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import socket
+import struct
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.docker_driver import (
+    STDERR,
+    STDOUT,
+    AsyncDockerDriver,
+    DockerPyDriver,
+    collect_frames,
+    parse_bytes,
+    split_image,
+    to_host_config,
+)
+from app.errors.code_runner import DockerDriverError
+
+
+def frame(stream_type: int, data: bytes) -> bytes:
+    return struct.pack(">BxxxL", stream_type, len(data)) + data
+
+
+def test_parse_bytes():
+    assert parse_bytes("200m") == 200 * 1024 * 1024
+    assert parse_bytes("10k") == 10 * 1024
+    assert parse_bytes(512) == 512
+    with pytest.raises(ValueError):
+        parse_bytes("lots")
+
+
+def test_split_image():
+    assert split_image("python:3.9-slim") == ("python", "3.9-slim")
+    assert split_image("eclipse-temurin:17-jdk-alpine") == (
+        "eclipse-temurin",
+        "17-jdk-alpine",
+    )
+    assert split_image("localhost:5000/runner") == ("localhost:5000/runner", "latest")
+
+
+def test_to_host_config():
+    host_config = to_host_config(
+        {
+            "mem_limit": "200m",
+            "network_mode": "none",
+            "read_only": True,
+            "tmpfs": {"/tmp": "size=10m"},
+            "cap_drop": ["ALL"],
+            "pids_limit": 200,
+        }
+    )
+
+    assert host_config == {
+        "Memory": 200 * 1024 * 1024,
+        "NetworkMode": "none",
+        "ReadonlyRootfs": True,
+        "Tmpfs": {"/tmp": "size=10m"},
+        "CapDrop": ["ALL"],
+        "PidsLimit": 200,
+    }
+
+
+@pytest.mark.asyncio
+async def test_read_frames_demuxes_stream():
+    reader = asyncio.StreamReader()
+    reader.feed_data(
+        frame(STDOUT, b"out1") + frame(STDERR, b"err") + frame(STDOUT, b"out2")
+    )
+    reader.feed_eof()
+
+    stdout, stderr = await collect_frames(AsyncDockerDriver._read_frames(reader))
+
+    assert stdout == b"out1out2"
+    assert stderr == b"err"
+
+
+@pytest.mark.asyncio
+async def test_exec_with_stdin_writes_input_and_reads_frames():
+    ours, theirs = socket.socketpair()
+    client = MagicMock()
+    client.api.exec_start.return_value = ours
+    driver = DockerPyDriver(client)
+
+    theirs.sendall(frame(STDOUT, b"out") + frame(STDERR, b"err"))
+    theirs.shutdown(socket.SHUT_WR)
+    stdout, stderr = await collect_frames(driver.exec_attach("exec", b"input"))
+
+    assert (stdout, stderr) == (b"out", b"err")
+    assert theirs.recv(16) == b"input"
+    client.api.exec_start.assert_called_once_with("exec", socket=True)
+    theirs.close()
+
+
+@pytest.mark.asyncio
+async def test_put_archive_extracts_with_tar_over_stdin():
+    calls = []
+
+    class FakeDriver(DockerPyDriver):
+        async def exec_create(self, container_id, command, workdir=None, stdin=False):
+            calls.append((container_id, command, stdin))
+            return "exec"
+
+        async def exec_attach(self, exec_id, stdin=None):
+            calls.append(stdin)
+            yield STDERR, b"tar: short read"
+
+        async def exec_exit_code(self, exec_id):
+            return 1
+
+    driver = FakeDriver(MagicMock())
+
+    with pytest.raises(DockerDriverError, match="short read"):
+        await driver.put_archive("sandbox", "/tmp", b"archive")
+
+    assert calls == [
+        ("sandbox", ["tar", "-x", "-C", "/tmp", "-f", "-"], True),
+        b"archive",
+    ]
+
+
+async def fake_docker(socket_path: str, exit_code: int):
+    """Engine API on a unix socket: exec create, hijacked start, inspect."""
+    received = bytearray()
+    inspects = []
+
+    async def respond(writer, status: str, body: dict):
+        data = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+
+    async def handle(reader, writer):
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            request_line, *header_lines = head.decode().split("\r\n")
+            method, path, _ = request_line.split(" ")
+            headers = dict(
+                line.lower().split(": ", 1) for line in header_lines if ": " in line
+            )
+            await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if path.endswith("/exec"):
+                await respond(writer, "201 Created", {"Id": "exec1"})
+            elif path == "/exec/exec1/start":
+                assert headers["upgrade"] == "tcp"
+                writer.write(
+                    b"HTTP/1.1 101 UPGRADED\r\n"
+                    b"Content-Type: application/vnd.docker.raw-stream\r\n"
+                    b"Connection: Upgrade\r\nUpgrade: tcp\r\n\r\n"
+                )
+                received.extend(await reader.read())
+                writer.write(frame(STDERR, b"tar: done"))
+                await writer.drain()
+                break
+            elif path == "/exec/exec1/json":
+                # Still running on the first inspect, right after the stream ended
+                inspects.append(path)
+                running = len(inspects) == 1
+                await respond(
+                    writer,
+                    "200 OK",
+                    {"Running": running, "ExitCode": None if running else exit_code},
+                )
+        writer.close()
+
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    return server, received, inspects
+
+
+@pytest.mark.asyncio
+async def test_async_driver_put_archive_over_hijacked_socket(tmp_path):
+    socket_path = str(tmp_path / "docker.sock")
+    server, received, inspects = await fake_docker(socket_path, exit_code=0)
+    driver = AsyncDockerDriver(socket_path)
+    try:
+        await driver.put_archive("sandbox", "/tmp", b"archive bytes")
+    finally:
+        await driver.close()
+        server.close()
+
+    assert bytes(received) == b"archive bytes"
+    assert len(inspects) == 2
+
+
+@pytest.mark.asyncio
+async def test_async_driver_exec_run_with_stdin_reports_failure(tmp_path):
+    socket_path = str(tmp_path / "docker.sock")
+    server, _, _ = await fake_docker(socket_path, exit_code=2)
+    driver = AsyncDockerDriver(socket_path)
+    try:
+        result = await driver.exec_run("sandbox", ["tar"], stdin=b"data")
+    finally:
+        await driver.close()
+        server.close()
+
+    assert result == (2, b"", b"tar: done")
@@ -0,0 +1,55 @@
+import pytest
+
+from app.services.fair_scheduler import FairScheduler, parse_weights
+
+
+def drain_order(scheduler: FairScheduler) -> list[str]:
+    order = []
+    while (picked := scheduler.next()) is not None:
+        user, item = picked
+        order.append(item)
+        scheduler.done(user)
+    return order
+
+
+def test_parse_weights():
+    assert parse_weights("user:1=2, ip:10.0.0.1=0.5,") == {
+        "user:1": 2.0,
+        "ip:10.0.0.1": 0.5,
+    }
+    assert parse_weights("") == {}
+    with pytest.raises(ValueError):
+        parse_weights("user:1=0")
+
+
+def test_round_robin_between_users():
+    scheduler = FairScheduler()
+    for i in range(3):
+        scheduler.submit("a", f"a{i}")
+    scheduler.submit("b", "b0")
+
+    assert drain_order(scheduler) == ["a0", "b0", "a1", "a2"]
+    assert len(scheduler) == 0
+
+
+def test_weights_share_runs_proportionally():
+    scheduler = FairScheduler(weights={"a": 2})
+    for i in range(4):
+        scheduler.submit("a", f"a{i}")
+        scheduler.submit("b", f"b{i}")
+
+    assert drain_order(scheduler)[:6] == ["a0", "a1", "b0", "a2", "a3", "b1"]
+
+
+def test_in_flight_cap_skips_busy_user():
+    scheduler = FairScheduler(max_in_flight_per_user=1)
+    scheduler.submit("a", "a0")
+    scheduler.submit("a", "a1")
+    scheduler.submit("b", "b0")
+
+    assert scheduler.next() == ("a", "a0")
+    assert scheduler.next() == ("b", "b0")
+    assert scheduler.next() is None
+
+    scheduler.done("a")
+    assert scheduler.next() == ("a", "a1")
@@ -2,7 +2,9 @@ from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 from app.errors.language import LanguageNotFoundError
+from app.errors.snippet import InvalidCursorError, SearchWindowExceededError
 from app.handlers.language import attach as attach_language_handlers
+from app.handlers.snippet import attach as attach_snippet_handlers
 
 
 def test_language_not_found_handler():
@@ -17,3 +19,30 @@ def test_language_not_found_handler():
     response = client.get("/error")
     assert response.status_code == 404
     assert response.json() == {"detail": "Language not found"}
+
+
+def test_invalid_cursor_handler():
+    app = FastAPI()
+    attach_snippet_handlers(app)
+
+    @app.get("/error")
+    def error_endpoint():
+        raise InvalidCursorError()
+
+    client = TestClient(app)
+    response = client.get("/error")
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_search_window_exceeded_handler():
+    app = FastAPI()
+    attach_snippet_handlers(app)
+
+    @app.get("/error")
+    def error_endpoint():
+        raise SearchWindowExceededError()
+
+    client = TestClient(app)
+    response = client.get("/error")
+    assert response.status_code == 400
@@ -0,0 +1,55 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.services.host_slots import HostSlots
+
+
+def make_slots(acquire_results, renew_result=1, lease_ttl=30):
+    redis_client = AsyncMock()
+    acquire_script = AsyncMock(side_effect=acquire_results)
+    renew_script = AsyncMock(return_value=renew_result)
+    redis_client.register_script = MagicMock(side_effect=[acquire_script, renew_script])
+    slots = HostSlots(
+        redis_client, "host-1", limit=2, lease_ttl=lease_ttl, retry_interval=0.001
+    )
+    return slots, redis_client, acquire_script, renew_script
+
+
+@pytest.mark.asyncio
+async def test_acquire_retries_until_a_slot_is_free():
+    slots, _, acquire_script, _ = make_slots([0, 0, 1])
+
+    token = await slots.acquire()
+
+    assert acquire_script.call_count == 3
+    assert acquire_script.call_args.kwargs == {
+        "keys": ["code_runner:slots:host-1"],
+        "args": [2, 30000, token],
+    }
+
+
+@pytest.mark.asyncio
+async def test_hold_releases_lease_on_error():
+    slots, redis_client, _, _ = make_slots([1])
+
+    with pytest.raises(RuntimeError):
+        async with slots.hold() as token:
+            raise RuntimeError("boom")
+
+    redis_client.zrem.assert_called_once_with("code_runner:slots:host-1", token)
+
+
+@pytest.mark.asyncio
+async def test_hold_renews_lease_while_running():
+    slots, _, _, renew_script = make_slots([1], lease_ttl=0.03)
+
+    async with slots.hold() as token:
+        await asyncio.sleep(0.05)
+
+    assert renew_script.call_count >= 1
+    assert renew_script.call_args.kwargs == {
+        "keys": ["code_runner:slots:host-1"],
+        "args": [30, token],
+    }
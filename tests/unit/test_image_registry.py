@@ -0,0 +1,71 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app.metrics import metrics
+from app.services.image_registry import ImageRegistry
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.mark.asyncio
+async def test_registry_refresh_fills_present_images():
+    pull = AsyncMock()
+    registry = ImageRegistry(
+        AsyncMock(return_value=["python:3.9-slim"]),
+        pull,
+        ["python:3.9-slim", "node:16-alpine"],
+    )
+
+    await registry.refresh()
+    await asyncio.gather(*registry._pulling.values())
+
+    assert registry.is_present("python:3.9-slim")
+    pull.assert_called_once_with("node:16-alpine")
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_registry_miss_counts_and_pulls_in_background():
+    pull = AsyncMock()
+    registry = ImageRegistry(AsyncMock(return_value=[]), pull, ["python:3.9-slim"])
+
+    assert not registry.is_present("python:3.9-slim")
+    assert metrics.get("code_runner_image_misses_total", image="python:3.9-slim") == 1
+
+    await asyncio.gather(*registry._pulling.values())
+    pull.assert_called_once_with("python:3.9-slim")
+    assert registry.is_present("python:3.9-slim")
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_registry_pulls_in_order_with_bounded_concurrency():
+    started, running, peak = [], 0, 0
+
+    async def pull(image):
+        nonlocal running, peak
+        started.append(image)
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    registry = ImageRegistry(
+        AsyncMock(return_value=[]), pull, ["a", "b", "c", "d"], max_concurrent_pulls=2
+    )
+
+    await registry.refresh()
+    assert registry.status() == dict.fromkeys(["a", "b", "c", "d"], "pulling")
+    await asyncio.gather(*registry._pulling.values())
+
+    assert started == ["a", "b", "c", "d"]
+    assert peak == 2
+    assert registry.status() == dict.fromkeys(["a", "b", "c", "d"], "present")
+    await registry.close()
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from app.services.image_usage import ImageUsage, status_key
+
+
+class FakeRedis:
+    def __init__(self, scores=None, data=None):
+        self.scores = scores or {}
+        self.data = data or {}
+
+    async def zmscore(self, key, members):
+        return [self.scores.get(member) for member in members]
+
+    async def scan_iter(self, match=None):
+        prefix = match.rstrip("*")
+        for key in list(self.data):
+            if key.startswith(prefix):
+                yield key
+
+    async def get(self, key):
+        return self.data.get(key)
+
+
+@pytest.mark.asyncio
+async def test_rank_puts_most_used_images_first():
+    redis_client = FakeRedis(scores={"go:1.21": 5.0, "node:20": 9.0})
+
+    ranked = await ImageUsage(redis_client).rank(
+        ["python:3.9", "go:1.21", "java:17", "node:20"]
+    )
+
+    assert ranked == ["node:20", "go:1.21", "python:3.9", "java:17"]
+
+
+@pytest.mark.asyncio
+async def test_readiness_merges_worker_statuses():
+    redis_client = FakeRedis(
+        data={
+            status_key("a"): json.dumps(
+                {"python:3.9": "present", "go:1.21": "missing"}
+            ),
+            status_key("b"): json.dumps(
+                {"python:3.9": "missing", "go:1.21": "pulling"}
+            ),
+        }
+    )
+
+    readiness = await ImageUsage(redis_client).readiness()
+
+    assert readiness == {
+        "ready": False,
+        "workers": 2,
+        "images": {"python:3.9": "present", "go:1.21": "pulling"},
+    }
+
+
+@pytest.mark.asyncio
+async def test_readiness_without_workers_is_not_ready():
+    readiness = await ImageUsage(FakeRedis()).readiness()
+
+    assert readiness == {"ready": False, "workers": 0, "images": {}}
@@ -0,0 +1,107 @@
+import os
+import time
+
+import pytest
+
+from app.services.code_runner import CodeRunnerService
+from app.services.docker_driver import DockerDriverError
+from app.services.local_driver import (
+    LocalExec,
+    LocalProcessDriver,
+    LocalSandbox,
+    compilers,
+)
+
+
+@pytest.fixture(autouse=True)
+def unprivileged(monkeypatch):
+    # The backend refuses to start as root, which CI containers often are
+    monkeypatch.setattr("app.services.local_driver.os.geteuid", lambda: 1000)
+
+
+@pytest.fixture
+def local_service(tmp_path):
+    # Namespaces are probed at first use, whether they exist doesn't matter here
+    yield CodeRunnerService(driver=LocalProcessDriver(root=str(tmp_path)))
+
+
+@pytest.mark.asyncio
+async def test_local_run_code_and_cleanup(local_service, tmp_path):
+    result = await local_service.run_code('print("Hello World")', "python")
+
+    assert result["stdout"] == "Hello World\n"
+    assert result["exit_code"] == 0
+    assert result["usage"]["wall_time"] > 0
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_local_run_code_does_not_see_worker_environment(
+    local_service, monkeypatch
+):
+    monkeypatch.setenv("SECRET_KEY", "hunter2")
+
+    result = await local_service.run_code(
+        'import os; print(os.environ.get("SECRET_KEY"))', "python"
+    )
+
+    assert result["stdout"] == "None\n"
+
+
+@pytest.mark.asyncio
+async def test_local_run_code_timeout_kills_the_run(local_service):
+    started = time.monotonic()
+
+    result = await local_service.run_code(
+        "import time; time.sleep(30)", "python", timeout=0.5
+    )
+
+    assert result["exit_code"] == -1
+    assert "Timeout exceeded" in result["stderr"]
+    assert time.monotonic() - started < 5
+
+
+@pytest.mark.asyncio
+async def test_local_run_batch_feeds_stdin_to_each_case(local_service):
+    result = await local_service.run_batch(
+        "import sys; print(input()[::-1], *sys.argv[1:])",
+        "python",
+        cases=[{"stdin": "abc\n"}, {"stdin": "xyz", "args": ["-v"]}],
+    )
+
+    assert [case["stdout"] for case in result["cases"]] == ["cba\n", "zyx -v\n"]
+
+
+@pytest.mark.asyncio
+async def test_local_run_code_with_extra_files(local_service):
+    files = [{"name": "pkg/util.py", "content": "def hello(): print('from pkg')"}]
+
+    result = await local_service.run_code(
+        "from pkg import util; util.hello()", "python", files=files
+    )
+
+    assert result["stdout"] == "from pkg\n"
+
+
+def test_translate_maps_sandbox_paths(tmp_path):
+    driver = LocalProcessDriver(root=str(tmp_path))
+    sandbox = LocalSandbox(
+        root="/sandboxes/1", options={}, main=LocalExec(["true"], None, False)
+    )
+
+    assert driver._translate(sandbox, "/tmp/code.py") == "/sandboxes/1/code.py"
+    assert driver._translate(sandbox, "/tmp") == "/sandboxes/1"
+    assert driver._translate(sandbox, "/tmpfile") == "/tmpfile"
+    assert driver._translate(sandbox, "/root/.cache") == "/sandboxes/1/.home/.cache"
+
+
+def test_refuses_to_start_as_root(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.services.local_driver.os.geteuid", lambda: 0)
+
+    with pytest.raises(DockerDriverError):
+        LocalProcessDriver(root=str(tmp_path))
+
+
+def test_compile_steps_are_not_memory_limited():
+    assert {"go", "javac"} <= compilers()
+    assert "python" not in compilers()
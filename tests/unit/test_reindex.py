@@ -1,18 +1,28 @@
+import asyncio
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
-from app.reindex import reindex_all
+from app.reindex import BulkReindexer, checkpoint_key, reindex_all
+from app.services.search import SearchService
 
 
-@pytest.mark.asyncio
-async def test_reindex_all():
+@pytest.fixture
+def reindex_env():
     with (
         patch("app.reindex.SearchService") as mock_search_cls,
         patch("app.reindex.SessionLocal") as mock_session_cls,
         patch("app.reindex.Snippet") as mock_snippet_cls,
+        patch("app.reindex.get_redis") as mock_get_redis,
+        patch("app.reindex.WRITE_TARGETS_TTL", 0),
     ):
         mock_search = AsyncMock()
+        mock_search.snippet_document = SearchService.snippet_document
+        mock_search.building_index.return_value = None
+        mock_search.start_rebuild.return_value = "snippets_v2"
+        mock_search.finish_rebuild.return_value = ["snippets_v1"]
+        mock_search.bulk_index.side_effect = lambda docs, index: (len(docs), [])
         mock_search_cls.return_value = mock_search
 
         mock_session = AsyncMock()
@@ -20,16 +30,160 @@ async def test_reindex_all():
         mock_session.__aenter__.return_value = mock_session
         mock_session.__aexit__.return_value = None
 
-        snippet1 = MagicMock(id=1, title="T1", code="C1", language="L1")
-        snippet2 = MagicMock(id=2, title="T2", code="C2", language="L2")
+        redis_client = AsyncMock()
+        redis_client.get.return_value = None
+
+        async def fake_get_redis():
+            yield redis_client
+
+        mock_get_redis.side_effect = fake_get_redis
+
+        rows = [
+            SimpleNamespace(
+                snippet_id=i,
+                _mapping={
+                    "snippet_id": i,
+                    "title": f"T{i}",
+                    "code": f"C{i}",
+                    "language": "Python" if i % 2 else None,
+                    "user_id": 7,
+                    "language_id": 1 if i % 2 else None,
+                    "tags": ["cli"] if i == 1 else [],
+                },
+            )
+            for i in range(1, 6)
+        ]
+
+        def stream_for_index(session, after_id, batch_size):
+            async def gen():
+                for row in rows:
+                    if row.snippet_id > after_id:
+                        yield row
+
+            return gen()
+
+        mock_snippet_cls.stream_for_index.side_effect = stream_for_index
+
+        yield mock_search, redis_client
+
+
+@pytest.mark.asyncio
+async def test_reindex_all_streams_chunks_into_bulk_requests(reindex_env):
+    mock_search, redis_client = reindex_env
+
+    report = await reindex_all(chunk_size=2, parallelism=2)
+
+    mock_search.create_index.assert_called_once()
+    mock_search.start_rebuild.assert_called_once()
+    chunks = [call.args[0] for call in mock_search.bulk_index.call_args_list]
+    assert {call.args[1] for call in mock_search.bulk_index.call_args_list} == {
+        "snippets_v2"
+    }
+    assert [[doc["id"] for doc in chunk] for chunk in chunks] == [[1, 2], [3, 4], [5]]
+    assert chunks[0][0] == {
+        "id": 1,
+        "title": "T1",
+        "code": "C1",
+        "language": "Python",
+        "user_id": 7,
+        "language_id": 1,
+        "tags": ["cli"],
+    }
+    assert chunks[0][1]["language"] is None
+
+    key = checkpoint_key("snippets_v2")
+    assert [call.args for call in redis_client.set.call_args_list] == [
+        (key, 2),
+        (key, 4),
+        (key, 5),
+    ]
+    mock_search.finish_rebuild.assert_called_once_with("snippets_v2")
+    redis_client.delete.assert_called_with(key)
+    assert report["swapped"] is True
+    assert report["indexed"] == 5
+    assert report["errors"] == 0
+    mock_search.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_reindex_all_resumes_unfinished_rebuild(reindex_env):
+    mock_search, redis_client = reindex_env
+    mock_search.building_index.return_value = "snippets_v2"
+    redis_client.get.return_value = "3"
+
+    report = await reindex_all(chunk_size=10, parallelism=1)
+
+    mock_search.start_rebuild.assert_not_called()
+    redis_client.get.assert_called_with(checkpoint_key("snippets_v2"))
+    chunk = mock_search.bulk_index.call_args.args[0]
+    assert [doc["id"] for doc in chunk] == [4, 5]
+    assert report["indexed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_reindex_all_counts_errors(reindex_env):
+    mock_search, _ = reindex_env
+    mock_search.bulk_index.side_effect = lambda docs, index: (
+        len(docs) - 1,
+        [{"index": {"_id": str(docs[0]["id"]), "error": "mapper_parsing_exception"}}],
+    )
+
+    report = await reindex_all(chunk_size=5, parallelism=1)
+
+    assert report["indexed"] == 4
+    assert report["errors"] == 1
+    # The old index stays live, the new one keeps receiving writes
+    assert report["swapped"] is False
+    mock_search.finish_rebuild.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_reindex_all_restart_drops_unfinished_rebuild(reindex_env):
+    mock_search, redis_client = reindex_env
+    mock_search.building_index.return_value = "snippets_v2"
+    mock_search.start_rebuild.return_value = "snippets_v3"
+
+    report = await reindex_all(chunk_size=10, parallelism=1, restart=True)
+
+    mock_search.abort_rebuild.assert_called_once_with("snippets_v2")
+    redis_client.delete.assert_any_call(checkpoint_key("snippets_v2"))
+    assert report["index"] == "snippets_v3"
+    assert report["indexed"] == 5
+
+
+@pytest.mark.asyncio
+async def test_reindex_all_keeps_checkpoint_on_failure(reindex_env):
+    mock_search, redis_client = reindex_env
+    mock_search.bulk_index.side_effect = [(2, []), ConnectionError("es down")]
+
+    with pytest.raises(ConnectionError):
+        await reindex_all(chunk_size=2, parallelism=1)
+
+    redis_client.set.assert_called_once_with(checkpoint_key("snippets_v2"), 2)
+    redis_client.delete.assert_not_called()
+    mock_search.finish_rebuild.assert_not_called()
+    mock_search.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_bulk_reindexer_limits_requests_in_flight():
+    in_flight = 0
+    peak = 0
 
-        async def mock_get_all(*args, **kwargs):
-            return [snippet1, snippet2]
+    async def bulk_index(documents, index):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return len(documents), []
 
-        mock_snippet_cls.get_all.side_effect = mock_get_all
+    search_service = MagicMock(bulk_index=bulk_index)
+    reindexer = BulkReindexer(search_service, AsyncMock(), "snippets_v2", parallelism=2)
 
-        await reindex_all()
+    for i in range(6):
+        await reindexer.submit([{"id": i}])
+    await reindexer.drain()
 
-        mock_search.create_index.assert_called_once()
-        assert mock_search.index_snippet.call_count == 2
-        mock_search.close.assert_called_once()
+    assert peak == 2
+    assert reindexer.indexed == 6
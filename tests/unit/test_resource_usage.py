@@ -0,0 +1,45 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.services.resource_usage import UsageSampler, memory_bytes
+
+
+def cgroup_v1_stats(usage: int, max_usage: int) -> dict:
+    return {
+        "cpu_stats": {"cpu_usage": {"total_usage": 0}},
+        "memory_stats": {"usage": usage, "max_usage": max_usage},
+    }
+
+
+def test_memory_bytes_prefers_cgroup_v1_peak():
+    stats = cgroup_v1_stats(usage=10, max_usage=50)
+
+    assert memory_bytes(stats) == 50
+    assert memory_bytes(stats, lifetime_peak=False) == 10
+    assert memory_bytes({"memory_stats": {"usage": 10}}) == 10
+
+
+@pytest.mark.asyncio
+async def test_reused_container_ignores_peak_of_earlier_runs():
+    driver = MagicMock()
+    # An earlier run in the pooled container peaked at 500 bytes
+    driver.stats = AsyncMock(return_value=cgroup_v1_stats(usage=20, max_usage=500))
+    sampler = UsageSampler(driver, "container", interval=0.01)
+
+    await sampler.start(baseline=True)
+    usage = await sampler.stop()
+
+    assert usage["peak_memory"] == 20
+
+
+@pytest.mark.asyncio
+async def test_fresh_container_reports_cgroup_v1_peak():
+    driver = MagicMock()
+    driver.stats = AsyncMock(return_value=cgroup_v1_stats(usage=20, max_usage=500))
+    sampler = UsageSampler(driver, "container", interval=0.01)
+
+    await sampler.start()
+    usage = await sampler.stop()
+
+    assert usage["peak_memory"] == 500
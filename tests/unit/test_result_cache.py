@@ -0,0 +1,55 @@
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.services.result_cache import ResultCache
+
+
+def make_redis(size: int):
+    redis_client = AsyncMock()
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=[True, 1, size])
+    redis_client.pipeline = MagicMock()
+    redis_client.pipeline.return_value.__aenter__.return_value = pipe
+    return redis_client, pipe
+
+
+def test_make_key_is_content_addressed():
+    key = ResultCache.make_key("print(1)", "python", "3.9", limits={"timeout": 10})
+
+    assert key == ResultCache.make_key(
+        "print(1)", "python", "3.9", limits={"timeout": 10}
+    )
+    assert key != ResultCache.make_key("print(2)", "python", "3.9")
+    assert key != ResultCache.make_key(
+        "print(1)", "python", "3.9", limits={"timeout": 5}
+    )
+    assert key != ResultCache.make_key("print(1)", "python", "3.9", stdin="x")
+
+
+@pytest.mark.asyncio
+async def test_get_returns_cached_result():
+    redis_client, _ = make_redis(1)
+    redis_client.get.return_value = json.dumps({"stdout": "1\n", "exit_code": 0})
+
+    cache = ResultCache(redis_client)
+    result = await cache.get("abc")
+
+    assert result == {"stdout": "1\n", "exit_code": 0}
+    redis_client.get.assert_called_with("code_results:abc")
+    redis_client.zadd.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_set_evicts_least_recently_used():
+    redis_client, pipe = make_redis(3)
+    redis_client.zpopmin.return_value = [("old", 1.0)]
+
+    cache = ResultCache(redis_client, ttl=60, max_entries=2)
+    await cache.set("new", {"stdout": "", "stderr": "", "exit_code": 0})
+
+    pipe.set.assert_called_once()
+    assert pipe.set.call_args.kwargs["ex"] == 60
+    redis_client.zpopmin.assert_called_with("code_results:index", 1)
+    redis_client.delete.assert_called_with("code_results:old")
@@ -0,0 +1,37 @@
+import json
+
+from app.services.result_dispatcher import ResultDispatcher
+
+
+def test_dispatch_routes_frames_to_subscribed_task():
+    dispatcher = ResultDispatcher()
+    queue = dispatcher.subscribe("task-1")
+
+    dispatcher.dispatch("task_results:task-1", json.dumps({"type": "stdout"}))
+    dispatcher.dispatch("task_results:task-2", json.dumps({"type": "stdout"}))
+
+    assert queue.qsize() == 1
+    assert queue.get_nowait() == {"type": "stdout"}
+
+
+def test_dispatch_ignores_unsubscribed_task():
+    dispatcher = ResultDispatcher()
+    queue = dispatcher.subscribe("task-1")
+    dispatcher.unsubscribe("task-1")
+
+    dispatcher.dispatch("task_results:task-1", json.dumps({"type": "exit"}))
+
+    assert queue.empty()
+
+
+def test_dispatch_fans_out_to_every_subscriber():
+    dispatcher = ResultDispatcher()
+    first = dispatcher.subscribe("task-1")
+    second = dispatcher.subscribe("task-1")
+
+    dispatcher.dispatch("task_results:task-1", json.dumps({"type": "exit"}))
+    dispatcher.unsubscribe("task-1", first)
+    dispatcher.dispatch("task_results:task-1", json.dumps({"type": "exit"}))
+
+    assert first.qsize() == 1
+    assert second.qsize() == 2
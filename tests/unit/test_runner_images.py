@@ -0,0 +1,72 @@
+from unittest.mock import MagicMock, patch
+
+import docker
+
+from app.services.runner_images import (
+    BASE_ID_LABEL,
+    RECIPE_LABEL,
+    recipe_hash,
+    runner_dockerfile,
+    runner_image_name,
+)
+from app.workers.init_images import build_runner_images, pull_images
+
+
+def test_runner_image_name():
+    assert runner_image_name("python:3.9-slim") == "code-runner/python:3.9-slim"
+    assert runner_image_name("library/golang:1.21") == "code-runner/library_golang:1.21"
+
+
+def test_runner_dockerfile_uses_base_image():
+    dockerfile = runner_dockerfile("java", "openjdk:17-slim")
+
+    assert dockerfile.startswith("FROM openjdk:17-slim\n")
+    assert runner_dockerfile("javascript", "node:16-alpine") is None
+
+
+def test_build_runner_images_skips_up_to_date_images():
+    client = MagicMock()
+    client.images.get.side_effect = lambda image: MagicMock(
+        id="sha256:base",
+        labels={
+            BASE_ID_LABEL: "sha256:base",
+            RECIPE_LABEL: recipe_hash(
+                runner_dockerfile("python", image.removeprefix("code-runner/")) or ""
+            ),
+        },
+    )
+
+    build_runner_images(client)
+
+    built = [c.kwargs["tag"] for c in client.images.build.call_args_list]
+    assert not any(tag.startswith("code-runner/python") for tag in built)
+
+
+def test_build_runner_images_builds_missing_images():
+    client = MagicMock()
+
+    def get(image):
+        if image.startswith("code-runner/"):
+            raise docker.errors.ImageNotFound("missing")
+        return MagicMock(id="sha256:base")
+
+    client.images.get.side_effect = get
+
+    build_runner_images(client)
+
+    tags = [c.kwargs["tag"] for c in client.images.build.call_args_list]
+    assert "code-runner/python:3.9-slim" in tags
+    assert not any(tag.startswith("code-runner/node") for tag in tags)
+    labels = client.images.build.call_args.kwargs["labels"]
+    assert labels[BASE_ID_LABEL] == "sha256:base"
+
+
+def test_pull_images_pulls_missing_images_in_parallel():
+    client = MagicMock()
+    client.images.get.side_effect = docker.errors.ImageNotFound("missing")
+
+    with patch("docker.from_env", return_value=client):
+        assert pull_images(["python:3.9-slim", "node:16-alpine"])
+
+    pulled = {c.args[0] for c in client.images.pull.call_args_list}
+    assert pulled == {"python:3.9-slim", "node:16-alpine"}
@@ -1,8 +1,29 @@
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from elasticsearch import NotFoundError
 
-from app.services.search import SearchService
+from app.config import settings
+from app.errors.snippet import InvalidCursorError, SearchWindowExceededError
+from app.services.search import (
+    MAPPINGS,
+    SearchService,
+    create_client,
+    decode_cursor,
+    encode_cursor,
+)
+from app.views.snippet import get_search_service
+
+
+def aliases(mapping: dict):
+    """get_alias for an alias -> indices mapping, 404 for unknown aliases."""
+
+    async def get_alias(name):
+        if name not in mapping:
+            raise NotFoundError("alias missing", None, None)
+        return {index: {"aliases": {name: {}}} for index in mapping[name]}
+
+    return get_alias
 
 
 @pytest.mark.asyncio
@@ -13,51 +34,112 @@ async def test_search_service_create_index():
 
         service = SearchService()
 
-        # Test index exists
-        mock_es.indices.exists.return_value = True
+        # Test aliases exist
+        mock_es.indices.exists_alias.return_value = True
         await service.create_index()
         mock_es.indices.create.assert_not_called()
 
-        # Test index does not exist
+        # Test nothing exists yet
+        mock_es.indices.exists_alias.return_value = False
         mock_es.indices.exists.return_value = False
         await service.create_index()
-        mock_es.indices.create.assert_called_once()
+        mock_es.indices.create.assert_called_once_with(
+            index="snippets_v1",
+            mappings=MAPPINGS,
+            aliases={"snippets": {}, "snippets_write": {}},
+        )
 
         await service.close()
 
 
+@pytest.mark.asyncio
+async def test_search_service_create_index_migrates_unversioned_index():
+    with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
+        mock_es = AsyncMock()
+        mock_es_cls.return_value = mock_es
+        mock_es.indices.exists_alias.return_value = False
+        mock_es.indices.exists.return_value = True
+
+        service = SearchService()
+        await service.create_index()
+
+        mock_es.reindex.assert_called_once_with(
+            source={"index": "snippets"},
+            dest={"index": "snippets_v1"},
+            wait_for_completion=True,
+        )
+        actions = mock_es.indices.update_aliases.call_args.kwargs["actions"]
+        assert actions[0] == {"remove_index": {"index": "snippets"}}
+
+
 @pytest.mark.asyncio
 async def test_search_service_index_snippet():
     with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
         mock_es = AsyncMock()
         mock_es_cls.return_value = mock_es
+        mock_es.indices.get_alias.side_effect = aliases(
+            {"snippets_write": ["snippets_v1"]}
+        )
 
         service = SearchService()
-        await service.index_snippet(1, "Title", "Code", "Python")
+        await service.index_snippet(
+            1, "Title", "Code", "Python", user_id=7, language_id=3, tags=["cli"]
+        )
 
         mock_es.index.assert_called_with(
-            index="snippets",
+            index="snippets_v1",
             id="1",
             document={
                 "id": 1,
                 "title": "Title",
                 "code": "Code",
                 "language": "Python",
+                "user_id": 7,
+                "language_id": 3,
+                "tags": ["cli"],
             },
+            routing="7",
         )
         await service.close()
 
 
+@pytest.mark.asyncio
+async def test_search_service_writes_to_rebuilt_index_too():
+    with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
+        mock_es = AsyncMock()
+        mock_es_cls.return_value = mock_es
+        mock_es.indices.get_alias.side_effect = aliases(
+            {"snippets_write": ["snippets_v1", "snippets_v2"]}
+        )
+
+        service = SearchService()
+        await service.index_snippet(1, "Title", "Code", "Python")
+        await service.delete_snippet(2)
+
+        indexed = [call.kwargs["index"] for call in mock_es.index.call_args_list]
+        assert indexed == ["snippets_v1", "snippets_v2"]
+        mock_es.delete.assert_called_with(
+            index="snippets_v2", id="2", routing=None, ignore=[404]
+        )
+        # The alias was resolved once for both writes
+        mock_es.indices.get_alias.assert_called_once()
+
+
 @pytest.mark.asyncio
 async def test_search_service_delete_snippet():
     with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
         mock_es = AsyncMock()
         mock_es_cls.return_value = mock_es
+        mock_es.indices.get_alias.side_effect = aliases(
+            {"snippets_write": ["snippets_v1"]}
+        )
 
         service = SearchService()
-        await service.delete_snippet(1)
+        await service.delete_snippet(1, user_id=7)
 
-        mock_es.delete.assert_called_with(index="snippets", id="1", ignore=[404])
+        mock_es.delete.assert_called_with(
+            index="snippets_v1", id="1", routing="7", ignore=[404]
+        )
         await service.close()
 
 
@@ -73,25 +155,245 @@ async def test_search_service_search_snippets():
         mock_es.search.return_value = {
             "hits": {
                 "hits": [
-                    {"_id": "1"},
-                    {"_id": "2"},
+                    {"_id": "1", "sort": [2.5, 1]},
+                    {"_id": "2", "sort": [1.5, 2]},
                 ]
             }
         }
 
-        results = await service.search_snippets("query")
+        results, cursor = await service.search_snippets(
+            "query", user_id=7, tag="cli", language_id=3, size=2
+        )
         assert results == [1, 2]
+        assert decode_cursor(cursor) == [1.5, 2]
 
         mock_es.search.assert_called_with(
             index="snippets",
+            routing="7",
             body={
                 "query": {
-                    "multi_match": {
-                        "query": "query",
-                        "fields": ["title", "code"],
-                        "fuzziness": "AUTO",
+                    "bool": {
+                        "must": {
+                            "multi_match": {
+                                "query": "query",
+                                "fields": ["title", "code"],
+                                "fuzziness": "AUTO",
+                            }
+                        },
+                        "filter": [
+                            {"term": {"user_id": 7}},
+                            {"term": {"tags": "cli"}},
+                            {"term": {"language_id": 3}},
+                        ],
                     }
-                }
+                },
+                "sort": [{"_score": "desc"}, {"id": "asc"}],
+                "size": 2,
+                "_source": False,
             },
         )
         await service.close()
+
+
+@pytest.mark.asyncio
+async def test_search_service_search_snippets_continues_after_cursor():
+    with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
+        mock_es = AsyncMock()
+        mock_es_cls.return_value = mock_es
+        mock_es.search.return_value = {"hits": {"hits": [{"_id": "3", "sort": [1, 3]}]}}
+
+        service = SearchService()
+        results, cursor = await service.search_snippets(
+            "query", user_id=7, size=2, offset=20, cursor=encode_cursor([1.5, 2])
+        )
+
+        body = mock_es.search.call_args.kwargs["body"]
+        assert body["search_after"] == [1.5, 2]
+        assert "from" not in body
+        # A short page is the last one
+        assert results == [3]
+        assert cursor is None
+
+
+@pytest.mark.asyncio
+async def test_search_service_rejects_malformed_cursor():
+    with patch("app.services.search.AsyncElasticsearch"):
+        service = SearchService()
+
+        with pytest.raises(InvalidCursorError):
+            await service.search_snippets("query", user_id=7, cursor="not a cursor")
+        with pytest.raises(InvalidCursorError):
+            await service.search_snippets("query", user_id=7, cursor=encode_cursor(1))
+
+
+@pytest.mark.asyncio
+async def test_search_service_rejects_offset_past_result_window():
+    with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
+        service = SearchService()
+
+        with pytest.raises(SearchWindowExceededError):
+            await service.search_snippets("query", user_id=7, size=100, offset=9950)
+        mock_es_cls.return_value.search.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_search_service_bulk_index():
+    with (
+        patch("app.services.search.AsyncElasticsearch"),
+        patch("app.services.search.async_bulk", new_callable=AsyncMock) as mock_bulk,
+    ):
+        conflict = {"create": {"_id": "2", "status": 409}}
+        failure = {"create": {"_id": "3", "status": 400}}
+        mock_bulk.return_value = (1, [conflict, failure])
+        service = SearchService()
+        documents = [
+            SearchService.snippet_document(1, "T1", "C1", "Python", user_id=7),
+            SearchService.snippet_document(2, "T2", "C2", None, user_id=7),
+            SearchService.snippet_document(3, "T3", "C3", None, user_id=8),
+        ]
+
+        # A conflict means a live write already added the document
+        assert await service.bulk_index(documents, "snippets_v2") == (2, [failure])
+
+        actions = mock_bulk.call_args.args[1]
+        assert actions[0] == {
+            "_op_type": "create",
+            "_index": "snippets_v2",
+            "_id": "1",
+            "_routing": "7",
+            "_source": documents[0],
+        }
+        assert mock_bulk.call_args.kwargs["raise_on_error"] is False
+
+
+@pytest.mark.asyncio
+async def test_search_service_start_rebuild_creates_next_version():
+    with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
+        mock_es = AsyncMock()
+        mock_es_cls.return_value = mock_es
+        mock_es.indices.get.return_value = {"snippets_v1": {}, "snippets_v2": {}}
+
+        service = SearchService()
+
+        assert await service.start_rebuild() == "snippets_v3"
+        kwargs = mock_es.indices.create.call_args.kwargs
+        assert kwargs["index"] == "snippets_v3"
+        assert kwargs["aliases"] == {"snippets_write": {}}
+        assert kwargs["settings"] == {"index": {"refresh_interval": "-1"}}
+
+
+@pytest.mark.asyncio
+async def test_search_service_building_index():
+    with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
+        mock_es = AsyncMock()
+        mock_es_cls.return_value = mock_es
+        service = SearchService()
+
+        mock_es.indices.get_alias.side_effect = aliases(
+            {"snippets": ["snippets_v1"], "snippets_write": ["snippets_v1"]}
+        )
+        assert await service.building_index() is None
+
+        mock_es.indices.get_alias.side_effect = aliases(
+            {
+                "snippets": ["snippets_v1"],
+                "snippets_write": ["snippets_v1", "snippets_v2"],
+            }
+        )
+        assert await service.building_index() == "snippets_v2"
+
+
+@pytest.mark.asyncio
+async def test_search_service_finish_rebuild_swaps_aliases_atomically():
+    with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
+        mock_es = AsyncMock()
+        mock_es_cls.return_value = mock_es
+        mock_es.indices.get_alias.side_effect = aliases(
+            {
+                "snippets": ["snippets_v1"],
+                "snippets_write": ["snippets_v1", "snippets_v2"],
+            }
+        )
+        service = SearchService()
+
+        assert await service.finish_rebuild("snippets_v2") == ["snippets_v1"]
+
+        mock_es.indices.put_settings.assert_called_once_with(
+            index="snippets_v2", settings={"index": {"refresh_interval": None}}
+        )
+        mock_es.indices.refresh.assert_called_once_with(index="snippets_v2")
+        mock_es.indices.update_aliases.assert_called_once_with(
+            actions=[
+                {"add": {"index": "snippets_v2", "alias": "snippets"}},
+                {"remove_index": {"index": "snippets_v1"}},
+            ]
+        )
+
+
+@pytest.mark.asyncio
+async def test_search_service_bulk_apply_writes_every_write_index():
+    with (
+        patch("app.services.search.AsyncElasticsearch") as mock_es_cls,
+        patch("app.services.search.async_bulk", new_callable=AsyncMock) as mock_bulk,
+    ):
+        mock_es = AsyncMock()
+        mock_es_cls.return_value = mock_es
+        mock_es.indices.get_alias.side_effect = aliases(
+            {"snippets_write": ["snippets_v1", "snippets_v2"]}
+        )
+        missing = {"delete": {"_id": "2", "status": 404}}
+        failure = {"index": {"_id": "1", "status": 400}}
+        mock_bulk.return_value = (2, [missing, failure])
+        service = SearchService()
+        document = SearchService.snippet_document(1, "T", "C", None, user_id=7)
+
+        assert await service.bulk_apply([document], [(2, 8)]) == [failure]
+
+        actions = mock_bulk.call_args.args[1]
+        assert actions == [
+            {"_index": "snippets_v1", "_id": "1", "_routing": "7", "_source": document},
+            {
+                "_op_type": "delete",
+                "_index": "snippets_v1",
+                "_id": "2",
+                "_routing": "8",
+            },
+            {"_index": "snippets_v2", "_id": "1", "_routing": "7", "_source": document},
+            {
+                "_op_type": "delete",
+                "_index": "snippets_v2",
+                "_id": "2",
+                "_routing": "8",
+            },
+        ]
+
+
+@pytest.mark.asyncio
+async def test_search_service_leaves_shared_client_open():
+    shared = AsyncMock()
+
+    service = SearchService(shared)
+    await service.close()
+
+    assert service.client is shared
+    shared.close.assert_not_called()
+
+
+def test_create_client_configures_pool_and_retries():
+    with patch("app.services.search.AsyncElasticsearch") as mock_es_cls:
+        create_client()
+
+        kwargs = mock_es_cls.call_args.kwargs
+        assert kwargs["connections_per_node"] == settings.ES_CONNECTIONS_PER_NODE
+        assert kwargs["request_timeout"] == settings.ES_REQUEST_TIMEOUT
+        assert kwargs["max_retries"] == settings.ES_MAX_RETRIES
+        assert kwargs["retry_on_timeout"] is True
+        assert 429 in kwargs["retry_on_status"]
+
+
+def test_get_search_service_uses_app_client():
+    request = MagicMock()
+
+    service = get_search_service(request)
+
+    assert service.client is request.app.state.search_client
@@ -0,0 +1,66 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.errors.code_runner import QuotaExceededError
+from app.services.usage_budget import UsageBudget, run_owner
+
+
+def make_redis(buckets: list[dict]):
+    redis_client = AsyncMock()
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=buckets)
+    redis_client.pipeline = MagicMock()
+    redis_client.pipeline.return_value.__aenter__.return_value = pipe
+    return redis_client, pipe
+
+
+def test_run_owner():
+    assert run_owner(7, "10.0.0.1") == "user:7"
+    assert run_owner(None, "10.0.0.1") == "ip:10.0.0.1"
+    assert run_owner(None, None) == "ip:unknown"
+
+
+@pytest.mark.asyncio
+async def test_usage_sums_buckets_in_window():
+    redis_client, pipe = make_redis(
+        [{"runs": "2", "cpu_seconds": "1.5"}, {}, {"runs": "1"}]
+    )
+    budget = UsageBudget(redis_client, 10, 10, window=180)
+
+    assert await budget.usage("user:1") == {"cpu_seconds": 1.5, "runs": 3}
+    assert pipe.hgetall.call_count == 3
+    assert pipe.hgetall.call_args_list[0].args[0].startswith("code_usage:user:1:")
+
+
+@pytest.mark.asyncio
+async def test_check_rejects_spent_budgets():
+    redis_client, _ = make_redis([{"runs": "3", "cpu_seconds": "2"}])
+
+    with pytest.raises(QuotaExceededError, match="Run limit"):
+        await UsageBudget(redis_client, 0, 3, window=60).check("user:1")
+    with pytest.raises(QuotaExceededError, match="CPU time limit"):
+        await UsageBudget(redis_client, 2, 0, window=60).check("user:1")
+    await UsageBudget(redis_client, 5, 5, window=60).check("user:1")
+
+
+@pytest.mark.asyncio
+async def test_check_with_budgets_disabled_skips_redis():
+    redis_client, pipe = make_redis([])
+
+    await UsageBudget(redis_client, 0, 0).check("user:1")
+
+    pipe.execute.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_record_increments_current_bucket():
+    redis_client, pipe = make_redis([])
+    budget = UsageBudget(redis_client, 10, 10, window=3600)
+
+    await budget.record("user:1", runs=1, cpu_seconds=0.25)
+
+    key = pipe.hincrby.call_args.args[0]
+    pipe.hincrby.assert_called_once_with(key, "runs", 1)
+    pipe.hincrbyfloat.assert_called_once_with(key, "cpu_seconds", 0.25)
+    pipe.expire.assert_called_once_with(key, 3660)
@@ -1,46 +1,128 @@
+import asyncio
 import json
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
 from app.enums.snippet import SnippetEventEnum
-from app.workers.snippet import main, process_message
+from app.services.search import SearchService
+from app.workers.snippet import batches, collapse_events, main, process_batch
+
+
+def make_event(event: SnippetEventEnum, **payload):
+    message = MagicMock()
+    message.ack = AsyncMock()
+    message.nack = AsyncMock()
+    message.body = json.dumps({"event": event.value, "data": payload})
+    return message
+
+
+def test_collapse_events_keeps_last_state_per_snippet():
+    messages = [
+        make_event(SnippetEventEnum.CREATED, id=1, title="T", code="C", language=None),
+        make_event(SnippetEventEnum.CREATED, id=2, title="T", code="C", language=None),
+        make_event(
+            SnippetEventEnum.UPDATED,
+            id=1,
+            title="T2",
+            code="C2",
+            language="Python",
+            user_id=7,
+            language_id=3,
+            tags=["cli"],
+        ),
+        make_event(SnippetEventEnum.DELETED, id=2, user_id=7),
+    ]
+
+    documents, deleted = collapse_events(messages)
+
+    assert documents == [
+        {
+            "id": 1,
+            "title": "T2",
+            "code": "C2",
+            "language": "Python",
+            "user_id": 7,
+            "language_id": 3,
+            "tags": ["cli"],
+        }
+    ]
+    assert deleted == [(2, 7)]
+
+
+def test_collapse_events_skips_malformed_messages():
+    broken = MagicMock(body=b"not json")
+    unknown = MagicMock(body=json.dumps({"event": "snippet.moved", "data": {"id": 3}}))
+
+    assert collapse_events([broken, unknown]) == ([], [])
 
 
 @pytest.mark.asyncio
-async def test_process_message_created():
+async def test_process_batch_acks_after_bulk_request():
     mock_search_service = AsyncMock()
-    mock_message = MagicMock()
-    mock_message.process.return_value.__aenter__.return_value = None
-    mock_message.process.return_value.__aexit__.return_value = None
-
-    payload = {"id": 1, "title": "Title", "code": "Code", "language": "Python"}
-    mock_message.body = json.dumps(
-        {"event": SnippetEventEnum.CREATED.value, "data": payload}
+    mock_search_service.bulk_apply.return_value = []
+    messages = [
+        make_event(
+            SnippetEventEnum.CREATED, id=1, title="Title", code="Code", language="Py"
+        ),
+        make_event(SnippetEventEnum.DELETED, id=2),
+    ]
+
+    assert await process_batch(messages, mock_search_service) is True
+
+    mock_search_service.bulk_apply.assert_called_once_with(
+        [SearchService.snippet_document(1, "Title", "Code", "Py")], [(2, None)]
     )
+    messages[-1].ack.assert_called_once_with(multiple=True)
+    messages[0].ack.assert_not_called()
 
-    await process_message(mock_message, mock_search_service)
 
-    mock_search_service.index_snippet.assert_called_with(
-        snippet_id=1, title="Title", code="Code", language="Python"
-    )
+@pytest.mark.asyncio
+async def test_process_batch_requeues_when_bulk_request_fails():
+    mock_search_service = AsyncMock()
+    mock_search_service.bulk_apply.side_effect = ConnectionError("es down")
+    messages = [make_event(SnippetEventEnum.DELETED, id=1)]
+
+    assert await process_batch(messages, mock_search_service) is False
+
+    messages[-1].nack.assert_called_once_with(multiple=True, requeue=True)
+    messages[-1].ack.assert_not_called()
 
 
 @pytest.mark.asyncio
-async def test_process_message_deleted():
+async def test_process_batch_requeues_rejected_items_only_when_retriable():
     mock_search_service = AsyncMock()
-    mock_message = MagicMock()
-    mock_message.process.return_value.__aenter__.return_value = None
-    mock_message.process.return_value.__aexit__.return_value = None
+    messages = [make_event(SnippetEventEnum.DELETED, id=1)]
 
-    payload = {"id": 1}
-    mock_message.body = json.dumps(
-        {"event": SnippetEventEnum.DELETED.value, "data": payload}
-    )
+    mock_search_service.bulk_apply.return_value = [{"delete": {"status": 429}}]
+    assert await process_batch(messages, mock_search_service) is False
+    messages[-1].nack.assert_called_once_with(multiple=True, requeue=True)
+
+    # A document ES will never accept is logged, not redelivered forever
+    mock_search_service.bulk_apply.return_value = [{"index": {"status": 400}}]
+    assert await process_batch(messages, mock_search_service) is True
+    messages[-1].ack.assert_called_once_with(multiple=True)
+
+
+@pytest.mark.asyncio
+async def test_batches_flush_on_size_and_timeout():
+    release = asyncio.Event()
+
+    class Queue:
+        async def __aiter__(self):
+            for i in range(3):
+                yield i
+            await release.wait()
+            yield 3
 
-    await process_message(mock_message, mock_search_service)
+    batches_seen = []
+    async for batch in batches(Queue(), size=2, timeout=0.05):
+        batches_seen.append(batch)
+        if len(batches_seen) == 2:
+            release.set()
 
-    mock_search_service.delete_snippet.assert_called_with(snippet_id=1)
+    # Full batch, then a partial one after the timeout, then the rest at the end
+    assert batches_seen == [[0, 1], [2], [3]]
 
 
 @pytest.mark.asyncio
@@ -67,7 +149,7 @@ async def test_worker_main():
 
         # Mock process_message to avoid actual processing logic in main test
         with patch(
-            "app.workers.snippet.process_message", new_callable=AsyncMock
+            "app.workers.snippet.process_batch", new_callable=AsyncMock
         ) as mock_process:
             await main()
 